@@ -2,17 +2,21 @@ import ssl
 
 import paho.mqtt.client as mqtt
 from mqttk.constants import PROTOCOL_LOOKUP, SSL_LIST, ERROR_CODES
+from mqttk.topic_trie import TopicTrie
 from uuid import uuid4
 
 
 class MqttManager:
-    def __init__(self, connection_configuration, on_connect_callback, on_disconnect_callback, logger):
+    def __init__(self, connection_configuration, on_connect_callback, on_disconnect_callback, logger, message_queue):
         if not connection_configuration:
             raise Exception("Invalid connection parameters, configuration empty")
         self.on_connect_callback = on_connect_callback
         self.on_disconnect_callback = on_disconnect_callback
         self.log = logger
+        self.message_queue = message_queue
         self.disconnect_requested = False
+        # Every subscription is dispatched from a single paho on_message callback through the trie
+        self.subscriptions = TopicTrie()
 
         autogen = connection_configuration.get("client_id_autogen", 0)
         if autogen == 1:
@@ -72,6 +76,7 @@ class MqttManager:
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
         self.client.connect(host=connection_configuration.get("broker_addr", ""),
                             port=int(connection_configuration.get("broker_port", "")),
                             keepalive=int(connection_configuration.get("keepalive", 60)))
@@ -111,14 +116,25 @@ class MqttManager:
 
     def add_subscription(self, topic_pattern, on_message_callback):
         self.log.info("MQTT client manager adding subscription", topic_pattern)
+        self.subscriptions.add(topic_pattern, on_message_callback)
         self.client.subscribe(topic_pattern)
-        self.client.message_callback_add(topic_pattern, on_message_callback)
+
+    def on_message(self, _, __, msg):
+        # Runs on the paho network thread, the message is handed over to the Tk mainloop via the message queue
+        for on_message_callback in self.subscriptions.matches(msg.topic):
+            self.message_queue.put(on_message_callback, msg)
+
+    def set_subscription_muted(self, topic_filter, muted):
+        # Messages of muted subscriptions are dropped before they are queued
+        self.subscriptions.set_muted(topic_filter, muted)
 
     def unsubscribe(self, topic_filter):
         self.log.info("MQTT client manager unsubscribing", topic_filter)
         self.client.unsubscribe(topic_filter)
-        self.client.message_callback_remove(topic_filter)
+        self.subscriptions.remove(topic_filter)
 
-    def publish(self, topic, payload, qos, retained):
-        self.log.info("Publish", topic)
+    def publish(self, topic, payload, qos, retained, log=True):
+        # log=False for publishes from background threads (e.g. replay), the logger isn't thread safe
+        if log:
+            self.log.info("Publish", topic)
         self.client.publish(topic, payload, qos, retained)
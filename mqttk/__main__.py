@@ -16,13 +16,11 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
-import json
 import os
 import traceback
 from datetime import datetime
 import sys
 import time
-import csv
 from functools import partial
 try:
     import tkinter as tk
@@ -43,13 +41,21 @@ from mqttk.widgets.subscribe_tab import SubscribeTab
 from mqttk.widgets.header_frame import HeaderFrame
 from mqttk.widgets.publish_tab import PublishTab
 from mqttk.widgets.broker_stats import BrokerStats
-from mqttk.constants import CONNECT, DISCONNECT, EVENT_LEVELS
+from mqttk.constants import CONNECT, DISCONNECT, EVENT_LEVELS, INGESTION_INTERVAL, INGESTION_TIME_BUDGET, \
+    INGESTION_STATS_INTERVAL, EXPORT_POLL_INTERVAL
 from mqttk.widgets.log_tab import LogTab
 from mqttk.widgets.topic_browser import TopicBrowser
-from mqttk.widgets.dialogs import AboutDialog, SplashScreen, ConnectionConfigImportExport, SubscribePublishImportExport
+from mqttk.widgets.dialogs import AboutDialog, SplashScreen, ConnectionConfigImportExport, SubscribePublishImportExport, \
+    ArchiveQueryDialog, CaptureRecordingDialog, ReplayDialog, ExportSplitDialog
 from mqttk.widgets.configuration_dialog import ConfigurationWindow
 from mqttk.config_handler import ConfigHandler
 from mqttk.MQTT_manager import MqttManager
+from mqttk.message_queue import MessageQueue
+from mqttk.capture_archive import CaptureArchive
+from mqttk.capture_file import CaptureRecorder
+from mqttk.replay import CaptureLoader
+from mqttk.message_export import MessageExporter, EXPORT_JSON, EXPORT_JSON_LINES, EXPORT_CSV, EXPORT_COLUMNAR, \
+    EXPORT_GZIP, EXPORT_XZ, EXPORT_FILE_EXTENSIONS, EXPORT_COMPRESSION_EXTENSIONS
 from paho.mqtt.client import MQTT_LOG_ERR, MQTT_LOG_INFO, MQTT_LOG_NOTICE, MQTT_LOG_WARNING
 
 
@@ -61,9 +67,6 @@ __maintainer__ = "Máté Szabó"
 __status__ = "Production"
 
 
-root = tk.Tk()
-
-
 class PotatoLog:
     def __init__(self):
         self.add_message_callback = None
@@ -122,8 +125,15 @@ class App:
         self.log.config_handler = self.config_handler
 
         self.mqtt_manager = None
+        self.message_queue = MessageQueue()
+        self.capture_archive = None
+        self.capture_recorder = None
+        self.capture_loader = None
+        self.message_exporter = None
         self.base64_only = tk.IntVar()
         self.base64_only.set(self.config_handler.get_export_encode_selection())
+        self.export_compression = tk.StringVar()
+        self.export_compression.set(self.config_handler.get_export_compression())
 
         root.title("MQTTk")
 
@@ -196,7 +206,12 @@ class App:
         self.export_messages_menu = tk.Menu(self.menubar, background=self.style.lookup("TLabel", "background"),
                                             foreground=self.style.lookup("TLabel", "foreground"))
 
+        self.archive_menu = tk.Menu(self.menubar, background=self.style.lookup("TLabel", "background"),
+                                    foreground=self.style.lookup("TLabel", "foreground"))
+
         self.menubar.add_cascade(menu=self.file_menu, label="File")
+        self.file_menu.add_command(label="Open capture offline", command=self.on_open_capture)
+        self.file_menu.add_separator()
         self.file_menu.add_command(label="Exit", command=self.on_exit)
 
         self.menubar.add_cascade(menu=self.import_menu, label="Import")
@@ -206,16 +221,39 @@ class App:
 
         self.menubar.add_cascade(menu=self.export_menu, label="Export")
         self.export_menu.add_cascade(menu=self.export_messages_menu, label="Messages")
-        self.export_messages_menu.add_command(label="All messages as JSON", command=partial(self.export_messages, format="JSON"))
-        self.export_messages_menu.add_command(label="All messages as CSV", command=partial(self.export_messages, format="CSV"))
+        self.export_messages_menu.add_command(label="All messages as JSON", command=partial(self.export_messages, format=EXPORT_JSON))
+        self.export_messages_menu.add_command(label="All messages as JSON Lines", command=partial(self.export_messages, format=EXPORT_JSON_LINES))
+        self.export_messages_menu.add_command(label="All messages as CSV", command=partial(self.export_messages, format=EXPORT_CSV))
+        self.export_messages_menu.add_command(label="All messages as columnar JSON Lines", command=partial(self.export_messages, format=EXPORT_COLUMNAR))
+        self.export_messages_menu.add_command(label="Search results as JSON", command=partial(self.export_messages, format=EXPORT_JSON, search_results=True))
+        self.export_messages_menu.add_command(label="Search results as JSON Lines", command=partial(self.export_messages, format=EXPORT_JSON_LINES, search_results=True))
+        self.export_messages_menu.add_command(label="Search results as CSV", command=partial(self.export_messages, format=EXPORT_CSV, search_results=True))
+        self.export_messages_menu.add_command(label="Search results as columnar JSON Lines", command=partial(self.export_messages, format=EXPORT_COLUMNAR, search_results=True))
         self.export_messages_menu.add_separator()
         self.export_messages_menu.add_radiobutton(label="Base64 encode all message payload", value=1, variable=self.base64_only, command=self.save_export_selection)
         self.export_messages_menu.add_radiobutton(label="Base64 encode binary payload only", value=0, variable=self.base64_only, command=self.save_export_selection)
         self.export_messages_menu.add_separator()
+        self.export_messages_menu.add_radiobutton(label="Uncompressed", value="", variable=self.export_compression, command=self.save_export_compression)
+        self.export_messages_menu.add_radiobutton(label="gzip compressed", value=EXPORT_GZIP, variable=self.export_compression, command=self.save_export_compression)
+        self.export_messages_menu.add_radiobutton(label="xz compressed", value=EXPORT_XZ, variable=self.export_compression, command=self.save_export_compression)
+        self.export_messages_menu.add_command(label="Split into files...", command=self.on_export_split_size)
+        self.export_messages_menu.add_separator()
         self.export_messages_menu.add_command(label="Current message payload as raw data", command=partial(self.export_messages, format="RAW"))
         self.export_menu.add_command(label="Connection configuration", command=self.export_connection_config)
         self.export_menu.add_command(label="Subscribe/publish content", command=self.export_subscribe_publish)
 
+        self.menubar.add_cascade(menu=self.archive_menu, label="Archive")
+        self.archive_menu.add_command(label="Start recording to SQLite archive", command=self.start_archive)
+        self.archive_menu.add_command(label="Stop recording", command=self.stop_archive, state="disabled")
+        self.archive_menu.add_separator()
+        self.archive_menu.add_command(label="Query archive", command=self.on_query_archive)
+        self.archive_menu.add_separator()
+        self.archive_menu.add_command(label="Start recording to capture files", command=self.on_capture_recording)
+        self.archive_menu.add_command(label="Stop capture file recording", command=self.stop_capture_recording,
+                                      state="disabled")
+        self.archive_menu.add_separator()
+        self.archive_menu.add_command(label="Replay capture to broker", command=self.on_replay)
+
         self.menubar.add_cascade(menu=self.about_menu, label="Help")
         self.about_menu.add_command(label="About MQTTk", command=self.on_about_menu)
 
@@ -269,6 +307,159 @@ class App:
         self.publish_frame.interface_toggle(DISCONNECT)
         self.broker_stats.interface_toggle(DISCONNECT, None)
 
+        self.root.after(INGESTION_INTERVAL, self.process_message_queue)
+        self.root.after(INGESTION_STATS_INTERVAL, self.update_ingestion_stats)
+
+    def process_message_queue(self):
+        # Drain the messages queued up by the paho network thread within a time budget, so the UI stays responsive
+        deadline = time.time() + INGESTION_TIME_BUDGET
+        while time.time() < deadline:
+            queued_item = self.message_queue.get()
+            if queued_item is None:
+                break
+            callback, message = queued_item
+            try:
+                callback(None, None, message)
+            except Exception as e:
+                self.log.exception("Failed to process incoming message", message.topic, e, traceback.format_exc())
+        self.root.after(1 if self.message_queue.depth() else INGESTION_INTERVAL, self.process_message_queue)
+
+    def update_ingestion_stats(self):
+        self.header_frame.update_queue_stats(self.message_queue.depth(),
+                                             self.message_queue.dropped,
+                                             None if self.capture_archive is None else self.capture_archive.dropped,
+                                             None if self.capture_recorder is None else self.capture_recorder.dropped)
+        if self.capture_archive is not None and self.capture_archive.error is not None:
+            self.log.error("Capture archive recording failed", self.capture_archive.error)
+            self.stop_archive()
+            messagebox.showerror("Error", "Recording to the capture archive failed, see log for details")
+        if self.capture_recorder is not None and self.capture_recorder.error is not None:
+            self.log.error("Capture file recording failed", self.capture_recorder.error)
+            self.stop_capture_recording()
+            messagebox.showerror("Error", "Recording to capture files failed, see log for details")
+        self.root.after(INGESTION_STATS_INTERVAL, self.update_ingestion_stats)
+
+    def start_archive(self):
+        database_file = filedialog.asksaveasfilename(initialdir=self.config_handler.get_last_used_directory(),
+                                                     title="Record messages to SQLite archive",
+                                                     defaultextension="sqlite",
+                                                     initialfile="MQTTk_archive_{}.sqlite".format(int(time.time())),
+                                                     confirmoverwrite=False)
+        if database_file == "":
+            self.log.warning("Empty file name on archive recording (maybe the cancel button was pressed?")
+            return
+        self.config_handler.save_last_used_directory(database_file)
+        try:
+            self.capture_archive = CaptureArchive(database_file)
+        except Exception as e:
+            self.log.exception("Failed to open capture archive", e, traceback.format_exc())
+            messagebox.showerror("Error", "Failed to open capture archive: {}".format(e))
+            return
+        self.subscribe_frame.recorders.append(self.capture_archive)
+        self.archive_menu.entryconfigure(0, state="disabled")
+        self.archive_menu.entryconfigure(1, state="normal")
+        self.log.info("Recording messages to capture archive", database_file)
+
+    def stop_archive(self):
+        if self.capture_archive is None:
+            return
+        if self.capture_archive in self.subscribe_frame.recorders:
+            self.subscribe_frame.recorders.remove(self.capture_archive)
+        self.capture_archive.close()
+        self.log.info("Stopped recording to capture archive", self.capture_archive.database_file,
+                      "{} messages written, {} dropped".format(self.capture_archive.written,
+                                                                self.capture_archive.dropped))
+        self.capture_archive = None
+        self.archive_menu.entryconfigure(0, state="normal")
+        self.archive_menu.entryconfigure(1, state="disabled")
+
+    def on_capture_recording(self):
+        CaptureRecordingDialog(self.root,
+                               self.icon,
+                               self.config_handler.get_capture_recording_settings(),
+                               self.start_capture_recording)
+
+    def start_capture_recording(self, settings):
+        self.config_handler.save_capture_recording_settings(settings)
+        try:
+            self.capture_recorder = CaptureRecorder(settings["directory"],
+                                                    compress=settings["compress"],
+                                                    rotate_size=settings["rotate_size"],
+                                                    rotate_interval=settings["rotate_interval"])
+        except Exception as e:
+            self.log.exception("Failed to start capture file recording", e, traceback.format_exc())
+            messagebox.showerror("Error", "Failed to start capture file recording: {}".format(e))
+            return
+        self.subscribe_frame.recorders.append(self.capture_recorder)
+        self.archive_menu.entryconfigure(5, state="disabled")
+        self.archive_menu.entryconfigure(6, state="normal")
+        self.log.info("Recording messages to capture files in", settings["directory"])
+
+    def stop_capture_recording(self):
+        if self.capture_recorder is None:
+            return
+        if self.capture_recorder in self.subscribe_frame.recorders:
+            self.subscribe_frame.recorders.remove(self.capture_recorder)
+        self.capture_recorder.close()
+        self.log.info("Stopped capture file recording",
+                      "{} messages written, {} dropped, files:".format(self.capture_recorder.written,
+                                                                       self.capture_recorder.dropped),
+                      ", ".join(self.capture_recorder.files))
+        self.capture_recorder = None
+        self.archive_menu.entryconfigure(5, state="normal")
+        self.archive_menu.entryconfigure(6, state="disabled")
+
+    def on_replay(self):
+        ReplayDialog(self.root, self.icon, self.config_handler, self.log, lambda: self.mqtt_manager)
+
+    def on_query_archive(self):
+        ArchiveQueryDialog(self.root,
+                           self.icon,
+                           self.config_handler,
+                           self.log,
+                           None if self.capture_archive is None else self.capture_archive.database_file)
+
+    def on_open_capture(self):
+        if self.capture_loader is not None:
+            messagebox.showinfo("Info", "A capture is already being loaded")
+            return
+        capture_file = filedialog.askopenfilename(initialdir=self.config_handler.get_last_used_directory(),
+                                                  title="Open capture file or JSON export")
+        if capture_file == "":
+            self.log.warning("Empty file name on opening capture (maybe the cancel button was pressed?")
+            return
+        self.config_handler.save_last_used_directory(capture_file)
+        self.log.info("Loading capture", capture_file)
+        self.capture_loader = CaptureLoader(capture_file, self.message_queue, self.on_offline_message)
+        self.capture_loader.start()
+        self.check_capture_loader()
+
+    def on_offline_message(self, _, __, msg, subscription_pattern):
+        # Same path as live messages, but there is no subscription in place for the patterns of the capture
+        if subscription_pattern not in self.subscribe_frame.subscription_frames:
+            self.subscribe_frame.add_subscription_frame(subscription_pattern,
+                                                        self.subscribe_frame.remove_subscription_frame)
+        self.subscribe_frame.on_mqtt_message(_, __, msg, subscription_pattern)
+        self.topic_browser.on_mqtt_message(_, __, msg, subscription_pattern)
+
+    def check_capture_loader(self):
+        loader = self.capture_loader
+        if loader is None:
+            return
+        if loader.running():
+            self.header_frame.show_progress("Loading {} messages".format(loader.loaded),
+                                            loader.fraction(),
+                                            loader.stop)
+            self.root.after(INGESTION_STATS_INTERVAL, self.check_capture_loader)
+            return
+        self.header_frame.hide_progress()
+        self.capture_loader = None
+        if loader.error is not None:
+            self.log.error("Failed to load capture", loader.path, loader.error)
+            messagebox.showerror("Error", "Failed to load capture: {}".format(loader.error))
+        else:
+            self.log.info("Loaded {} messages from".format(loader.loaded), loader.path)
+
     def on_client_disconnect(self, notify=None):
         if notify is not None:
             self.header_frame.connection_error_notification["text"] = notify
@@ -303,7 +494,8 @@ class App:
             self.mqtt_manager = MqttManager(self.config_handler.get_connection_broker_parameters(self.header_frame.connection_selector.get()),
                                             self.on_client_connect,
                                             self.on_client_disconnect,
-                                            self.log)
+                                            self.log,
+                                            self.message_queue)
         except Exception as e:
             self.log.exception("Failed to initialise MQTT client:", e, "\r\n", traceback.format_exc())
             self.header_frame.connection_error_notification["text"] = "Failed to connect, see log for details"
@@ -318,7 +510,7 @@ class App:
         self.header_frame.disconnect_button.configure(state="disabled")
         if self.mqtt_manager is not None:
             self.mqtt_manager.disconnect()
-            root.after(2000, self.check_disconnect)
+            self.root.after(2000, self.check_disconnect)
 
     def on_config_update(self):
         connection_profile_list = sorted(self.config_handler.get_connection_profiles())
@@ -348,7 +540,12 @@ class App:
         self.config_handler.save_autoscroll(self.subscribe_frame.autoscroll_state.get())
         self.config_handler.save_decompress(self.subscribe_frame.attempt_to_decompress.get())
         self.config_handler.save_decoder(self.subscribe_frame.message_decoder_selector.get())
-        root.after(100, root.destroy())
+        self.stop_archive()
+        self.stop_capture_recording()
+        if self.message_exporter is not None:
+            self.message_exporter.cancel()
+        self.subscribe_frame.close()
+        self.root.after(100, self.root.destroy())
         # root.destroy()
 
     def on_destroy(self):
@@ -362,7 +559,7 @@ class App:
         if success:
             self.on_config_update()
 
-    def export_messages(self, format):
+    def export_messages(self, format, search_results=False):
 
         if self.tabs.tab(self.tabs.select(), "text") not in ("Subscribe"):
             messagebox.showinfo("Info", 'Please engage this operation on the "Subscribe" tab')
@@ -372,6 +569,15 @@ class App:
             messagebox.showinfo("Info", "The message list is empty")
             return
 
+        if search_results and self.subscribe_frame.search_result_count() == 0:
+            messagebox.showinfo("Info", "There are no search results to export")
+            return
+
+        if format != "RAW" and self.message_exporter is not None:
+            messagebox.showinfo("Info", "An export is already in progress")
+            return
+
+        compression = None if format == "RAW" else self.export_compression.get() or None
         selected_message_payload = None
         if format == "RAW":
             selected_message_payload = self.subscribe_frame.get_selected_message_payload()
@@ -381,7 +587,8 @@ class App:
 
         output_location = filedialog.asksaveasfilename(initialdir=self.config_handler.get_last_used_directory(),
                                                        title="Export {}".format(format),
-                                                       defaultextension=format.lower(),
+                                                       defaultextension=EXPORT_FILE_EXTENSIONS.get(format, "") +
+                                                       EXPORT_COMPRESSION_EXTENSIONS.get(compression, ""),
                                                        initialfile="MQTTk_messages_{}".format(time.time()))
         if output_location == "":
             self.log.warning("Empty file name on export message (maybe the cancel button was pressed?")
@@ -392,40 +599,21 @@ class App:
 
         self.config_handler.save_last_used_directory(output_location)
 
-        try:
-            if format == "RAW":
-                data = selected_message_payload
-                with open(output_location, "wb") as outputfile:
-                    outputfile.write(data)
-
-            if format == "JSON":
-                messages = []
-                for message in self.subscribe_frame.get_messages(bool(int(self.base64_only.get()))):
-                    messages.append(message)
-                data = json.dumps(messages, indent=2, ensure_ascii=False)
-                with open(output_location, "w", encoding="utf-8") as outputfile:
-                    outputfile.write(data)
-
-            if format == "CSV":
-                with open(output_location, "w", encoding="utf-8") as outputfile:
-                    output_writer = csv.writer(outputfile, quoting=csv.QUOTE_MINIMAL, delimiter=',', quotechar='"')
-                    header = "timestamp,date,time,subscription pattern,topic,QoS,retained,payload"
-                    output_writer.writerow(header)
-                    for message in self.subscribe_frame.get_messages(bool(int(self.base64_only.get()))):
-                        timestamp = message["timestamp"]
-                        datetime_object = datetime.fromtimestamp(timestamp)
-                        row = [
-                            timestamp,
-                            datetime_object.strftime("%Y/%m/%d"),
-                            datetime_object.strftime("%H:%M:%S.%f"),
-                            message["subscription_pattern"],
-                            message["topic"],
-                            message["qos"],
-                            message["retained"],
-                            message["payload"]
-                        ]
-                        output_writer.writerow(row)
+        if format != "RAW":
+            self.message_exporter = MessageExporter(self.subscribe_frame.message_store,
+                                                    self.subscribe_frame.get_export_message_ids(search_results),
+                                                    output_location,
+                                                    format,
+                                                    bool(int(self.base64_only.get())),
+                                                    compression,
+                                                    self.config_handler.get_export_split_size() * 1024 * 1024)
+            self.message_exporter.start()
+            self.check_message_exporter()
+            return
 
+        try:
+            with open(output_location, "wb") as outputfile:
+                outputfile.write(selected_message_payload)
         except Exception as e:
             self.log.exception("Failed to export message data", e, traceback.format_exc())
             messagebox.showerror("Failed to export messages", "Failed to export messages: {} See log for details".format(e))
@@ -433,6 +621,31 @@ class App:
             self.log.info("Messages exported successfully")
             messagebox.showinfo("Success", "Messages exported successfully")
 
+    def check_message_exporter(self):
+        exporter = self.message_exporter
+        if exporter is None:
+            return
+        if exporter.running():
+            exporter.poll()
+            self.header_frame.show_progress("Exporting {} messages".format(exporter.written),
+                                            exporter.fraction(),
+                                            exporter.cancel)
+            self.root.after(EXPORT_POLL_INTERVAL, self.check_message_exporter)
+            return
+        self.header_frame.hide_progress()
+        self.message_exporter = None
+        if exporter.error is not None:
+            self.log.error("Failed to export message data", exporter.path, exporter.error)
+            messagebox.showerror("Failed to export messages", "Failed to export messages: {} See log for details".format(exporter.error))
+        elif exporter.cancelled():
+            self.log.info("Message export cancelled", exporter.path)
+        else:
+            skipped = ""
+            if exporter.skipped:
+                skipped = ", {} messages were evicted before they could be exported".format(exporter.skipped)
+            self.log.info("{} messages exported successfully{}".format(exporter.written, skipped))
+            messagebox.showinfo("Success", "{} messages exported successfully{}".format(exporter.written, skipped))
+
     def export_connection_config(self):
         export_dialog = ConnectionConfigImportExport(self.root, self.icon, self.config_handler, self.log, False)
 
@@ -452,13 +665,21 @@ class App:
             self.log_tab.tab_deselected()
             
         # Solves display errors on Mac mini M1 (Monterey) 
-        root.after(50, lambda: self.tabs.tab(self.tabs.select(), text=self.tabs.tab(self.tabs.select(), "text")))
+        self.root.after(50, lambda: self.tabs.tab(self.tabs.select(), text=self.tabs.tab(self.tabs.select(), "text")))
 
     def save_export_selection(self, *args, **kwargs):
         self.config_handler.save_export_encode_selection(int(self.base64_only.get()))
 
+    def save_export_compression(self, *args, **kwargs):
+        self.config_handler.save_export_compression(self.export_compression.get())
+
+    def on_export_split_size(self):
+        ExportSplitDialog(self.root, self.config_handler.get_export_split_size(), self.config_handler.save_export_split_size)
+
 
 def main():
+    # Created here rather than on import, the spawned search worker processes import this module too
+    root = tk.Tk()
     app = App(root)
     root.mainloop()
 
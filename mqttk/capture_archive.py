@@ -0,0 +1,195 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os.path
+import queue
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from paho.mqtt.client import topic_matches_sub
+
+from mqttk.constants import ARCHIVE_BATCH_SIZE, ARCHIVE_QUERY_LIMIT, ARCHIVE_QUEUE_LENGTH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    topic TEXT NOT NULL,
+    subscription_pattern TEXT NOT NULL,
+    qos INTEGER NOT NULL,
+    retained INTEGER NOT NULL,
+    payload BLOB
+);
+CREATE INDEX IF NOT EXISTS messages_topic ON messages (topic, timestamp);
+CREATE INDEX IF NOT EXISTS messages_subscription_pattern ON messages (subscription_pattern, timestamp);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+"""
+
+INSERT = "INSERT INTO messages (timestamp, topic, subscription_pattern, qos, retained, payload) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def topic_filter_prefix(topic_filter):
+    # The part of the topic filter before the first wildcard, usable for an index range scan
+    for wildcard in ("+", "#"):
+        if wildcard in topic_filter:
+            topic_filter = topic_filter[:topic_filter.index(wildcard)]
+    return topic_filter
+
+
+def connect(database_file):
+    # Connection of the archive writer, creates the database file if needed
+    connection = sqlite3.connect(database_file)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def connect_read_only(database_file):
+    # Connection for queries, it never creates or modifies anything, so querying the wrong file can't damage it
+    uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(database_file)))
+    connection = sqlite3.connect(uri, uri=True)
+    try:
+        table = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+    except Exception:
+        connection.close()
+        raise
+    if table is None:
+        connection.close()
+        raise ValueError("{} is not a capture archive".format(database_file))
+    connection.create_function("topic_matches", 2, lambda topic_filter, topic: topic_matches_sub(topic_filter, topic))
+    return connection
+
+
+class CaptureArchive:
+    def __init__(self, database_file):
+        """
+        Records captured messages to an SQLite database.
+
+        add() only queues the message, a writer thread inserts whatever has queued up in a single transaction, so
+        the cost on the Tk thread is one queue put per message. If the writer falls behind by ARCHIVE_QUEUE_LENGTH
+        messages, further messages are not recorded and counted as dropped. Errors on the writer thread are kept in
+        self.error, the writer stops on the first one.
+        """
+        self.database_file = database_file
+        self.queue = queue.Queue(ARCHIVE_QUEUE_LENGTH)
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        # Create the schema before returning, so queries work straight away
+        connection = connect(database_file)
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def add(self, topic, payload, qos, retained, subscription_pattern, timestamp):
+        try:
+            self.queue.put_nowait((timestamp, topic, subscription_pattern, qos, 1 if retained else 0, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def writer(self):
+        try:
+            connection = connect(self.database_file)
+        except Exception as e:
+            self.error = e
+            return
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < ARCHIVE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            try:
+                with connection:
+                    connection.executemany(INSERT, batch)
+            except Exception as e:
+                self.error = e
+                break
+            self.written += len(batch)
+        connection.close()
+
+    def close(self):
+        # The queue may be full, and after an error the writer no longer empties it
+        while self.writer_thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.writer_thread.join()
+
+    def pending(self):
+        return self.queue.qsize()
+
+
+def query_archive(database_file, topic_filter="", subscription_pattern="", start=None, end=None,
+                  limit=ARCHIVE_QUERY_LIMIT):
+    """
+    Query an archive, all arguments are optional. topic_filter may contain MQTT wildcards, start and end are
+    timestamps. Returns a list of (id, timestamp, topic, subscription_pattern, qos, retained, payload) tuples in
+    reception order.
+    """
+    conditions = []
+    arguments = []
+    if topic_filter:
+        prefix = topic_filter_prefix(topic_filter)
+        if prefix == topic_filter:
+            conditions.append("topic = ?")
+            arguments.append(topic_filter)
+        else:
+            # Narrow down with an index range scan, then check the wildcards
+            if prefix and topic_filter == prefix + "#":
+                # "a/b/#" also matches the parent level "a/b", which sorts before the prefix range
+                conditions.append("(topic = ? OR (topic >= ? AND topic < ?))")
+                arguments += [prefix[:-1], prefix, prefix + "\U0010ffff"]
+            elif prefix:
+                conditions.append("topic >= ? AND topic < ?")
+                arguments += [prefix, prefix + "\U0010ffff"]
+            conditions.append("topic_matches(?, topic)")
+            arguments.append(topic_filter)
+    if subscription_pattern:
+        conditions.append("subscription_pattern = ?")
+        arguments.append(subscription_pattern)
+    if start is not None:
+        conditions.append("? <= timestamp")
+        arguments.append(start)
+    if end is not None:
+        conditions.append("timestamp <= ?")
+        arguments.append(end)
+
+    statement = "SELECT id, timestamp, topic, subscription_pattern, qos, retained, payload FROM messages"
+    if conditions:
+        statement += " WHERE " + " AND ".join(conditions)
+    statement += " ORDER BY id LIMIT ?"
+    arguments.append(limit)
+
+    connection = connect_read_only(database_file)
+    try:
+        return connection.execute(statement, arguments).fetchall()
+    finally:
+        connection.close()
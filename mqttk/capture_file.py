@@ -0,0 +1,221 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from mqttk.constants import CAPTURE_BLOCK_SIZE, CAPTURE_BLOCK_INTERVAL, CAPTURE_ROTATE_SIZE, \
+    CAPTURE_ROTATE_INTERVAL, CAPTURE_FILE_EXTENSION, CAPTURE_QUEUE_LENGTH
+
+# Capture file layout, all integers little endian:
+#
+# file header:   b"MQTTKCAP", version (uint8)
+# block header:  flags (uint8, bit 0: zlib compressed), stored data length (uint32), record count (uint32),
+#                crc32 of the stored data (uint32)
+# block data:    records, zlib compressed if the flag is set
+# record:        timestamp (double), qos (uint8), retained (uint8), topic length (uint16),
+#                subscription pattern length (uint16), payload length (uint32), topic, subscription pattern, payload
+#
+# Blocks are only written complete, a reader stops at the first truncated or corrupt block, so a crash loses at
+# most the block that was being collected.
+
+FILE_MAGIC = b"MQTTKCAP"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sB")
+BLOCK_HEADER = struct.Struct("<BIII")
+RECORD_HEADER = struct.Struct("<dBBHHI")
+FLAG_ZLIB = 0x01
+
+
+class CaptureRecorder:
+    def __init__(self, directory, compress=True, rotate_size=CAPTURE_ROTATE_SIZE,
+                 rotate_interval=CAPTURE_ROTATE_INTERVAL):
+        """
+        Continuously records messages to rotating capture files in directory.
+
+        add() only queues the message, packing, compression and file writes happen on a writer thread. A new file
+        is started when the current one reaches rotate_size bytes or gets older than rotate_interval seconds.
+        If the writer falls behind by CAPTURE_QUEUE_LENGTH messages, further messages are not recorded and counted
+        as dropped. Errors on the writer thread are kept in self.error, the writer stops on the first one.
+        """
+        self.directory = directory
+        self.compress = compress
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.queue = queue.Queue(CAPTURE_QUEUE_LENGTH)
+        self.error = None
+        self.written = 0
+        self.dropped = 0
+        self.files = []
+        self.capture_file = None
+        self.file_started = 0
+        self.file_counter = 0
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.writer_thread.start()
+
+    def add(self, topic, payload, qos, retained, subscription_pattern, timestamp):
+        try:
+            self.queue.put_nowait((timestamp, qos, 1 if retained else 0, topic, subscription_pattern, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def open_file(self):
+        self.file_counter += 1
+        file_name = "MQTTk_capture_{}_{:04d}{}".format(datetime.now().strftime("%Y%m%d_%H%M%S"),
+                                                      self.file_counter,
+                                                      CAPTURE_FILE_EXTENSION)
+        path = os.path.join(self.directory, file_name)
+        self.capture_file = open(path, "wb")
+        self.capture_file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        self.file_started = time.time()
+        self.files.append(path)
+
+    def close_file(self):
+        if self.capture_file is not None:
+            self.capture_file.close()
+            self.capture_file = None
+
+    def write_block(self, block, record_count):
+        if self.capture_file is None:
+            self.open_file()
+        flags = 0
+        data = bytes(block)
+        if self.compress:
+            data = zlib.compress(data, 1)
+            flags |= FLAG_ZLIB
+        self.capture_file.write(BLOCK_HEADER.pack(flags, len(data), record_count, zlib.crc32(data)))
+        self.capture_file.write(data)
+        self.capture_file.flush()
+        os.fsync(self.capture_file.fileno())
+        self.written += record_count
+
+    def check_rotation(self):
+        # Also called when the queue is idle, so the files of a quiet stream are rotated on time as well
+        if self.capture_file is None:
+            return
+        if (self.rotate_size and self.rotate_size <= self.capture_file.tell()) or \
+                (self.rotate_interval and self.rotate_interval <= time.time() - self.file_started):
+            self.close_file()
+
+    def writer(self):
+        block = bytearray()
+        record_count = 0
+        block_started = time.time()
+        running = True
+        try:
+            while running:
+                try:
+                    item = self.queue.get(timeout=CAPTURE_BLOCK_INTERVAL)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    running = False
+                elif item:
+                    timestamp, qos, retained, topic, subscription_pattern, payload = item
+                    topic = topic.encode("utf-8")
+                    subscription_pattern = subscription_pattern.encode("utf-8")
+                    block += RECORD_HEADER.pack(timestamp, qos, retained, len(topic), len(subscription_pattern),
+                                                len(payload))
+                    block += topic
+                    block += subscription_pattern
+                    block += payload
+                    record_count += 1
+                if record_count and (not running or CAPTURE_BLOCK_SIZE <= len(block) or
+                                     CAPTURE_BLOCK_INTERVAL <= time.time() - block_started):
+                    self.write_block(block, record_count)
+                    block = bytearray()
+                    record_count = 0
+                if record_count == 0:
+                    block_started = time.time()
+                self.check_rotation()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.close_file()
+
+    def close(self):
+        # The queue may be full, and after an error the writer no longer empties it
+        while self.writer_thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.writer_thread.join()
+
+    def pending(self):
+        return self.queue.qsize()
+
+
+def is_capture_file(path):
+    try:
+        with open(path, "rb") as capture_file:
+            return capture_file.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+def read_capture_file(path, progress=None):
+    """
+    Generator of (timestamp, topic, subscription_pattern, qos, retained, payload) tuples from a capture file.
+    Stops quietly at a truncated or corrupt block, which is what a crash during recording leaves behind.
+    If a progress dict is passed, its "position" and "size" are kept up to date in bytes.
+    """
+    if progress is not None:
+        progress["size"] = os.path.getsize(path)
+    with open(path, "rb") as capture_file:
+        header = capture_file.read(FILE_HEADER.size)
+        if len(header) != FILE_HEADER.size:
+            raise ValueError("Not an MQTTk capture file")
+        magic, version = FILE_HEADER.unpack(header)
+        if magic != FILE_MAGIC:
+            raise ValueError("Not an MQTTk capture file")
+        if version != FILE_VERSION:
+            raise ValueError("Unsupported capture file version {}".format(version))
+
+        while True:
+            block_header = capture_file.read(BLOCK_HEADER.size)
+            if len(block_header) != BLOCK_HEADER.size:
+                return
+            flags, length, record_count, crc = BLOCK_HEADER.unpack(block_header)
+            data = capture_file.read(length)
+            if len(data) != length or zlib.crc32(data) != crc:
+                return
+            if progress is not None:
+                progress["position"] = capture_file.tell()
+            if flags & FLAG_ZLIB:
+                data = zlib.decompress(data)
+            data = memoryview(data)
+            position = 0
+            for _ in range(record_count):
+                timestamp, qos, retained, topic_length, pattern_length, payload_length = \
+                    RECORD_HEADER.unpack_from(data, position)
+                position += RECORD_HEADER.size
+                topic = str(data[position:position + topic_length], "utf-8")
+                position += topic_length
+                subscription_pattern = str(data[position:position + pattern_length], "utf-8")
+                position += pattern_length
+                payload = bytes(data[position:position + payload_length])
+                position += payload_length
+                yield timestamp, topic, subscription_pattern, qos, retained, payload
@@ -0,0 +1,128 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import bz2
+import lzma
+import zlib
+
+from mqttk.constants import DECOMPRESS_MAX_BYTES
+
+ZLIB = "zlib"
+GZIP = "gzip"
+BZ2 = "bz2"
+XZ = "xz"
+LZMA = "lzma"
+DEFLATE = "deflate"
+
+ZLIB_WINDOW_BITS = {ZLIB: 15, GZIP: 31, DEFLATE: -15}
+
+
+class DecompressionLimitExceeded(Exception):
+    pass
+
+
+def detect_compression(data):
+    # Codec from the magic bytes of data, None if it doesn't look compressed. Raw deflate has no header.
+    if data[:2] == b"\x1f\x8b":
+        return GZIP
+    if data[:3] == b"BZh" and data[3:4].isdigit():
+        return BZ2
+    if data[:6] == b"\xfd7zXZ\x00":
+        return XZ
+    if data[:3] == b"\x5d\x00\x00":
+        return LZMA
+    # zlib: deflate method with a window of at most 32K, the header is a multiple of 31
+    if 2 <= len(data) and data[0] & 0x0F == 8 and data[0] >> 4 <= 7 and ((data[0] << 8) | data[1]) % 31 == 0:
+        return ZLIB
+    return None
+
+
+def decompress(data, codec, max_size=DECOMPRESS_MAX_BYTES):
+    """
+    Decompresses data with the given codec, producing at most max_size bytes.
+
+    Raises DecompressionLimitExceeded if the output would be larger, so a small payload can't expand into gigabytes,
+    and ValueError or the codec's own error if data isn't a complete stream of that codec.
+    """
+    if codec in ZLIB_WINDOW_BITS:
+        decompressor = zlib.decompressobj(ZLIB_WINDOW_BITS[codec])
+    elif codec == BZ2:
+        decompressor = bz2.BZ2Decompressor()
+    elif codec in (XZ, LZMA):
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ if codec == XZ else lzma.FORMAT_ALONE)
+    else:
+        raise ValueError("Unknown codec {}".format(codec))
+
+    result = decompressor.decompress(data, max_size + 1)
+    if max_size < len(result) or (codec in ZLIB_WINDOW_BITS and decompressor.unconsumed_tail):
+        raise DecompressionLimitExceeded("decompresses to more than {:.0f} MB".format(max_size / (1024 * 1024)))
+    if not decompressor.eof:
+        raise ValueError("Truncated {} stream".format(codec))
+    if codec == DEFLATE:
+        # Raw deflate has no header or checksum, plenty of random or plain text data inflates to something. Only
+        # a stream that spans the whole input and inflates to text is taken for compressed.
+        if decompressor.unused_data or not result:
+            raise ValueError("Not a raw deflate stream")
+        result.decode("utf-8")
+    return result
+
+
+class CodecCache:
+    def __init__(self, max_size=DECOMPRESS_MAX_BYTES):
+        """
+        Decompression with the codec remembered per topic.
+
+        The codec that worked for the previous message of a topic is tried first, then the one detected from the
+        magic bytes, then raw deflate. Raw deflate is only accepted if it inflates to UTF-8 text, see decompress().
+        Topics whose payloads turned out not to be compressed are remembered as well, so they don't pay for a raw
+        deflate attempt on every message.
+        """
+        self.max_size = max_size
+        # Topic: codec, None if the payloads of the topic weren't compressed
+        self.codecs = {}
+
+    def decompress(self, topic, data, max_size=None):
+        # (decompressed data, codec), or (data, None) if data isn't compressed. max_size overrides the limit.
+        if max_size is None:
+            max_size = self.max_size
+        candidates = []
+        cached_codec = self.codecs.get(topic)
+        if cached_codec is not None:
+            candidates.append(cached_codec)
+        detected_codec = detect_compression(data)
+        if detected_codec is not None and detected_codec not in candidates:
+            candidates.append(detected_codec)
+        if DEFLATE not in candidates and (topic not in self.codecs or cached_codec is not None):
+            candidates.append(DEFLATE)
+
+        for codec in candidates:
+            try:
+                result = decompress(data, codec, max_size)
+            except DecompressionLimitExceeded:
+                self.codecs[topic] = codec
+                raise
+            except Exception:
+                continue
+            self.codecs[topic] = codec
+            return result, codec
+        self.codecs[topic] = None
+        return data, None
+
+    def clear(self):
+        self.codecs = {}
@@ -25,6 +25,8 @@ import json
 from tkinter import messagebox
 from tkinter import filedialog
 import mqttk.mqtt_fx_config_parser as configparser
+from mqttk.constants import MESSAGE_STORE_MAX_MESSAGES, MESSAGE_STORE_MAX_PAYLOAD_BYTES, CAPTURE_ROTATE_SIZE, \
+    CAPTURE_ROTATE_INTERVAL, TOPIC_HISTORY_LENGTH, TOPIC_HISTORY_MAX_BYTES
 from datetime import datetime
 
 LOAD = "load"
@@ -67,7 +69,24 @@ class ConfigHandler:
             "window_geometry: last used window geometry string,
             "autoscroll: true/false,
             "last_used_decoder": last used message decoder,
-            "last_used_directory": last used directory for browsing files
+            "last_used_directory": last used directory for browsing files,
+            "message_store_limits": {
+                "max_messages": maximum number of captured messages, 0 is unlimited,
+                "max_payload_bytes": maximum total payload size of captured messages, 0 is unlimited,
+                "spill_to_disk": keep the captured payloads in temporary files instead of memory
+            },
+            "capture_recording": {
+                "directory": directory of the recorded capture files,
+                "compress": compress capture file blocks,
+                "rotate_size": start a new capture file after this many bytes, 0 is never,
+                "rotate_interval": start a new capture file after this many seconds, 0 is never
+            },
+            "export_compression": "", "gzip" or "xz" compression of message exports,
+            "export_split_size": split message exports into files of this many MB, 0 is never,
+            "topic_history_limits": {
+                "length": values kept per topic in the topic browser,
+                "max_bytes": memory limit of the topic browser value history
+            }
         }
 
         configuration_dict[connections] = {
@@ -393,6 +412,21 @@ class ConfigHandler:
     def get_export_encode_selection(self):
         return self.configuration_dict.get("export_encoding", 1)
 
+    def save_export_compression(self, value):
+        self.configuration_dict["export_compression"] = value
+        self.config_file_manager(SAVE)
+
+    def get_export_compression(self):
+        return self.configuration_dict.get("export_compression", "")
+
+    def save_export_split_size(self, value):
+        self.configuration_dict["export_split_size"] = value
+        self.config_file_manager(SAVE)
+
+    def get_export_split_size(self):
+        # MB, 0 if exports aren't split
+        return self.configuration_dict.get("export_split_size", 0)
+
     def get_resubscribe(self, connection):
         return self.configuration_dict.get("connections", {}).get(connection, {}).get("connection_parameters", {}).get("resubscribe", 0)
 
@@ -405,3 +439,41 @@ class ConfigHandler:
             self.config_file_manager(SAVE)
         except Exception as e:
             self.log.error("Failed to save resubscribe topics:", e)
+
+    def get_message_store_limits(self):
+        limits = self.configuration_dict.get("message_store_limits", {})
+        return (limits.get("max_messages", MESSAGE_STORE_MAX_MESSAGES),
+                limits.get("max_payload_bytes", MESSAGE_STORE_MAX_PAYLOAD_BYTES),
+                bool(limits.get("spill_to_disk", False)))
+
+    def get_topic_history_limits(self):
+        limits = self.configuration_dict.get("topic_history_limits", {})
+        return limits.get("length", TOPIC_HISTORY_LENGTH), limits.get("max_bytes", TOPIC_HISTORY_MAX_BYTES)
+
+    def save_topic_history_limits(self, length, max_bytes):
+        self.configuration_dict["topic_history_limits"] = {
+            "length": length,
+            "max_bytes": max_bytes
+        }
+        self.config_file_manager(SAVE)
+
+    def save_message_store_limits(self, max_messages, max_payload_bytes, spill_to_disk):
+        self.configuration_dict["message_store_limits"] = {
+            "max_messages": max_messages,
+            "max_payload_bytes": max_payload_bytes,
+            "spill_to_disk": bool(spill_to_disk)
+        }
+        self.config_file_manager(SAVE)
+
+    def get_capture_recording_settings(self):
+        settings = self.configuration_dict.get("capture_recording", {})
+        return {
+            "directory": settings.get("directory", str(self.get_last_used_directory())),
+            "compress": bool(settings.get("compress", True)),
+            "rotate_size": settings.get("rotate_size", CAPTURE_ROTATE_SIZE),
+            "rotate_interval": settings.get("rotate_interval", CAPTURE_ROTATE_INTERVAL)
+        }
+
+    def save_capture_recording_settings(self, settings):
+        self.configuration_dict["capture_recording"] = settings
+        self.config_file_manager(SAVE)
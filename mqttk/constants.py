@@ -61,3 +61,75 @@ EVENT_LEVELS = {
 
 
 MQTT_VERSION_LIST = list(PROTOCOL_LOOKUP.keys())
+
+# Ingestion queue between the paho network thread and the Tk mainloop
+INGESTION_QUEUE_LENGTH = 200000
+INGESTION_INTERVAL = 20  # ms between queue drains when idle
+INGESTION_TIME_BUDGET = 0.03  # s spent on the Tk thread per drain
+INGESTION_STATS_INTERVAL = 500  # ms between queue statistics updates
+
+# Message list rendering
+RENDER_INTERVAL = 33  # ms, messages received within a frame are rendered together
+TOPIC_BROWSER_REFRESH_INTERVAL = 100  # ms, topic browser rows changed within this time are updated together
+TOPIC_STATS_REFRESH_INTERVAL = 1000  # ms between updates of the topic browser rates, ages and sort order
+TOPIC_RATE_TIME_CONSTANT = 10.0  # s, time constant of the topic browser msg/s and bytes/s moving averages
+TOPIC_HISTORY_LENGTH = 100  # Last values kept per topic in the topic browser
+TOPIC_HISTORY_MAX_BYTES = 64 * 1024 * 1024  # Memory limit of the topic browser value history of all topics
+
+# Message store limits, 0 means unlimited
+MESSAGE_STORE_MAX_MESSAGES = 1000000
+MESSAGE_STORE_MAX_PAYLOAD_BYTES = 512 * 1024 * 1024
+SPILL_SEGMENT_SIZE = 64 * 1024 * 1024  # Payload segment file size when the capture is spilled to disk
+SPILL_HOT_BYTES = 16 * 1024 * 1024  # Most recent payload bytes kept in memory when spilling to disk
+
+# SQLite capture archive
+ARCHIVE_BATCH_SIZE = 5000  # Maximum number of messages written in a single transaction
+ARCHIVE_QUERY_LIMIT = 10000  # Maximum number of rows returned by an archive query
+ARCHIVE_QUEUE_LENGTH = 100000  # Messages waiting for the archive writer, further messages are not recorded
+ARCHIVE_QUERY_POLL_INTERVAL = 50  # ms between checks of a running archive query
+
+# Binary capture files
+CAPTURE_BLOCK_SIZE = 64 * 1024  # Uncompressed bytes collected before a block is written
+CAPTURE_BLOCK_INTERVAL = 1.0  # s, a partial block is written after this long, at most this much is lost on a crash
+CAPTURE_ROTATE_SIZE = 256 * 1024 * 1024  # bytes, 0 disables size based rotation
+CAPTURE_ROTATE_INTERVAL = 3600  # s, 0 disables time based rotation
+CAPTURE_FILE_EXTENSION = ".mqttkcap"
+CAPTURE_QUEUE_LENGTH = 100000  # Messages waiting for the capture file writer, further messages are not recorded
+
+# Replay
+REPLAY_ORIGINAL_TIMING = "original"
+REPLAY_FLAT_OUT = "flat"
+OFFLINE_LOAD_CHUNK = 1000  # Messages queued between checks of the message queue depth when loading offline
+
+# Message search
+SEARCH_INLINE_BYTES = 8 * 1024 * 1024  # Payload scans smaller than this are not handed to the worker processes
+SEARCH_CHUNK_BYTES = 4 * 1024 * 1024  # Payload bytes sent to a worker process in one go
+SEARCH_MAX_WORKERS = 4
+SEARCH_POLL_INTERVAL = 20  # ms between search progress checks
+SEARCH_TIME_BUDGET = 0.03  # s spent on the Tk thread per search progress check
+
+# Message viewer
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Decoded and formatted payloads kept for re-selection
+AUTOSCROLL_DETAILS_INTERVAL = 250  # ms, the message details follow autoscroll at most this often
+DECODE_INLINE_BYTES = 256 * 1024  # Larger payloads are decoded and formatted on a background thread
+DECODE_WORKERS = 2
+DECODE_POLL_INTERVAL = 50  # ms between background decoding progress checks
+PAYLOAD_VIEW_INITIAL_CHARS = 512 * 1024  # Characters of a payload shown before "Load more" is needed
+PAYLOAD_VIEW_LOAD_MORE_CHARS = 1024 * 1024  # Characters added by each "Load more"
+PAYLOAD_VIEW_CHUNK = 64 * 1024  # Characters inserted into the payload box per mainloop iteration
+PAYLOAD_VIEW_MAX_LINE = 4096  # Longer lines are split, Tk lays out very long lines very slowly
+DECOMPRESS_MAX_BYTES = 256 * 1024 * 1024  # Payloads decompressing to more than this are shown compressed
+
+# Message export
+EXPORT_BATCH = 1000  # Messages read from the message store and handed to the export thread in one go
+EXPORT_QUEUE_BATCHES = 8  # Batches waiting for the export thread before reading from the store pauses
+EXPORT_POLL_INTERVAL = 20  # ms between export progress checks
+EXPORT_TIME_BUDGET = 0.02  # s spent reading messages for the export on the Tk thread per progress check
+
+# Broker statistics charts
+SYS_METRIC_LEVELS = ((1, 600), (10, 720), (60, 1440))  # (resolution s, points) of each downsampling level
+SYS_CUMULATIVE_METRICS = ("bytes/received", "bytes/sent", "messages/received", "messages/sent",
+                          "publish/messages/received", "publish/messages/sent", "publish/messages/dropped",
+                          "publish/bytes/received", "publish/bytes/sent")  # Counters shown as rates too
+SYS_CHART_SPANS = (("10 minutes", 600), ("1 hour", 3600), ("24 hours", 86400))
+SYS_CHART_REFRESH_INTERVAL = 500  # ms, new samples of the plotted metrics are drawn together
@@ -1,3 +1,4 @@
+from datetime import datetime
 from functools import partial
 
 
@@ -28,3 +29,40 @@ def clear_combobox_selection(*_, combobox_instance):
 
 def get_clear_combobox_selection_function(combobox_instance):
     return partial(clear_combobox_selection, combobox_instance=combobox_instance)
+
+
+def parse_time_string(time_string):
+    # Accepts "YYYY/MM/DD HH:MM:SS[.ffffff]" or "HH:MM:SS[.ffffff]" for today, returns a timestamp or None if empty
+    time_string = time_string.strip()
+    if time_string == "":
+        return None
+    for time_format in ("%Y/%m/%d %H:%M:%S.%f", "%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M"):
+        try:
+            return datetime.strptime(time_string, time_format).timestamp()
+        except ValueError:
+            pass
+    for time_format in ("%H:%M:%S.%f", "%H:%M:%S", "%H:%M"):
+        try:
+            time_of_day = datetime.strptime(time_string, time_format).time()
+        except ValueError:
+            continue
+        return datetime.combine(datetime.now().date(), time_of_day).timestamp()
+    raise ValueError("Invalid time: {}".format(time_string))
+
+
+def format_size(size):
+    if size < 1024:
+        return "{} B".format(size)
+    if size < 1024 * 1024:
+        return "{:.1f} KB".format(size / 1024)
+    return "{:.1f} MB".format(size / (1024 * 1024))
+
+
+def format_age(seconds):
+    if seconds < 60:
+        return "{:.0f} s".format(max(0, seconds))
+    if seconds < 3600:
+        return "{:.0f} min".format(seconds / 60)
+    if seconds < 86400:
+        return "{:.1f} h".format(seconds / 3600)
+    return "{:.1f} d".format(seconds / 86400)
@@ -17,39 +17,64 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-import itertools
-
 BEGIN_PRINTABLES = 33
 END_PRINTABLES = 126
+# Rows formatted in one go by hex_viewer
+ROW_BATCH = 4096
+
+# bytes.translate() table, printable characters are kept, everything else becomes a dot
+ASCII_TABLE = bytes(x if BEGIN_PRINTABLES <= x <= END_PRINTABLES else ord(".") for x in range(256))
+ROW_TEMPLATE = '{:0>8x}       {:<53}       {}'
+
+
+def spaced_hex(data):
+    try:
+        return data.hex(" ")
+    except TypeError:
+        # bytes.hex() has no separator argument before Python 3.8
+        hex_string = data.hex()
+        return " ".join(hex_string[i:i + 2] for i in range(0, len(hex_string), 2))
 
 
 def hex_group_formatter(iterable):
-    chunks = [iter(iterable)] * 4
-    return '   '.join(
-        ' '.join(format(x, '0>2x') for x in chunk)
-        for chunk in itertools.zip_longest(*chunks, fillvalue=0))
+    # Groups of 4 bytes, "00 01 02 03   04 05 06 07 ..."
+    hex_string = spaced_hex(bytes(iterable))
+    return '   '.join(hex_string[i:i + 11] for i in range(0, len(hex_string), 12))
 
 
 def ascii_group_formatter(iterable):
-    return ''.join(
-        chr(x) if BEGIN_PRINTABLES <= x <= END_PRINTABLES else '.'
-        for x in iterable)
+    return bytes(iterable).translate(ASCII_TABLE).decode("ascii")
+
+
+def hex_header(chunk_size=16):
+    return 'ADDRESS        {:<53}       ASCII'.format(hex_group_formatter(range(chunk_size)))
+
+
+def hex_row_count(message_data, chunk_size=16):
+    return (len(message_data) + chunk_size - 1) // chunk_size
+
+
+def format_hex_rows(message_data, first_row, row_count, chunk_size=16):
+    """
+    Rows first_row ... first_row + row_count - 1 of the hex dump of message_data. The whole range is converted
+    with a single bytes.hex() and bytes.translate() call, the rows are sliced out of the results.
+    """
+    start = first_row * chunk_size
+    block = bytes(message_data[start:start + row_count * chunk_size])
+    hex_string = spaced_hex(block)
+    ascii_string = block.translate(ASCII_TABLE).decode("ascii")
+    row_width = 3 * chunk_size
+    rows = []
+    for row in range(hex_row_count(block, chunk_size)):
+        row_hex = hex_string[row * row_width:(row + 1) * row_width - 1]
+        rows.append(ROW_TEMPLATE.format(start + row * chunk_size,
+                                        '   '.join(row_hex[i:i + 11] for i in range(0, len(row_hex), 12)),
+                                        ascii_string[row * chunk_size:(row + 1) * chunk_size]))
+    return rows
 
 
 def hex_viewer(message_data, chunk_size=16):
-    header = hex_group_formatter(range(chunk_size))
-    yield 'ADDRESS        {:<53}       ASCII'.format(header)
+    yield hex_header(chunk_size)
     yield ''
-    template = '{:0>8x}       {:<53}       {}'
-    for chunk_count in itertools.count(0):
-        start = (chunk_size+1)*(chunk_count)
-        finish = start + chunk_size
-        if len(message_data) < finish:
-            finish = len(message_data)
-        chunk = message_data[start:finish]
-        if not chunk:
-            return
-        yield template.format(
-            chunk_count * chunk_size,
-            hex_group_formatter(chunk),
-            ascii_group_formatter(chunk))
+    for first_row in range(0, hex_row_count(message_data, chunk_size), ROW_BATCH):
+        yield from format_hex_rows(message_data, first_row, ROW_BATCH, chunk_size)
@@ -0,0 +1,338 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import io
+import os
+import csv
+import gzip
+import json
+import lzma
+import time
+import queue
+import base64
+import threading
+from datetime import datetime
+
+from mqttk.constants import EXPORT_BATCH, EXPORT_QUEUE_BATCHES, EXPORT_TIME_BUDGET
+
+EXPORT_JSON = "JSON"
+EXPORT_JSON_LINES = "JSON Lines"
+EXPORT_CSV = "CSV"
+EXPORT_COLUMNAR = "Columnar JSON Lines"
+
+EXPORT_FILE_EXTENSIONS = {
+    EXPORT_JSON: ".json",
+    EXPORT_JSON_LINES: ".jsonl",
+    EXPORT_CSV: ".csv",
+    EXPORT_COLUMNAR: ".jsonl"
+}
+
+EXPORT_GZIP = "gzip"
+EXPORT_XZ = "xz"
+
+EXPORT_COMPRESSION_EXTENSIONS = {
+    EXPORT_GZIP: ".gz",
+    EXPORT_XZ: ".xz"
+}
+
+CSV_HEADER = ["timestamp", "date", "time", "subscription pattern", "topic", "QoS", "retained", "payload"]
+
+
+def encode_payload(payload, base64_only):
+    # (payload string, encoding), binary payloads are always base64 encoded
+    if not base64_only:
+        try:
+            return payload.decode("utf-8"), "utf-8"
+        except Exception:
+            pass
+    return base64.b64encode(payload).decode("utf-8"), "base64"
+
+
+def export_record(record, base64_only):
+    # Message dict of a (timestamp, qos, retained, topic, subscription pattern, payload) record, as exported in JSON
+    timestamp, qos, retained, topic, subscription_pattern, payload = record
+    payload, payload_encoding = encode_payload(payload, base64_only)
+    return {
+        "topic": topic,
+        "payload": payload,
+        "qos": qos,
+        "subscription_pattern": subscription_pattern,
+        "retained": retained,
+        "timestamp": timestamp,
+        "payload_encoding": payload_encoding
+    }
+
+
+class JsonArrayWriter:
+    def __init__(self, output_file, base64_only):
+        # Same output as json.dumps(messages, indent=2), written one message at a time
+        self.output_file = output_file
+        self.base64_only = base64_only
+        self.separator = "\n  "
+
+    def begin(self):
+        self.output_file.write("[")
+
+    def write(self, records):
+        for record in records:
+            message = json.dumps(export_record(record, self.base64_only), indent=2, ensure_ascii=False)
+            self.output_file.write(self.separator + message.replace("\n", "\n  "))
+            self.separator = ",\n  "
+
+    def end(self):
+        self.output_file.write("]" if self.separator == "\n  " else "\n]")
+
+
+class JsonLinesWriter:
+    def __init__(self, output_file, base64_only):
+        # One JSON message per line
+        self.output_file = output_file
+        self.base64_only = base64_only
+
+    def begin(self):
+        pass
+
+    def write(self, records):
+        self.output_file.write("".join(json.dumps(export_record(record, self.base64_only), ensure_ascii=False) + "\n"
+                                       for record in records))
+
+    def end(self):
+        pass
+
+
+class CsvWriter:
+    def __init__(self, output_file, base64_only):
+        self.output_writer = csv.writer(output_file, quoting=csv.QUOTE_MINIMAL, delimiter=',', quotechar='"')
+        self.base64_only = base64_only
+
+    def begin(self):
+        self.output_writer.writerow(CSV_HEADER)
+
+    def write(self, records):
+        rows = []
+        for timestamp, qos, retained, topic, subscription_pattern, payload in records:
+            datetime_object = datetime.fromtimestamp(timestamp)
+            rows.append([
+                timestamp,
+                datetime_object.strftime("%Y/%m/%d"),
+                datetime_object.strftime("%H:%M:%S.%f"),
+                subscription_pattern,
+                topic,
+                qos,
+                retained,
+                encode_payload(payload, self.base64_only)[0]
+            ])
+        self.output_writer.writerows(rows)
+
+    def end(self):
+        pass
+
+
+class ColumnarWriter:
+    def __init__(self, output_file, base64_only):
+        """
+        One JSON object per line for each batch of messages, holding the fields in columns. Topics and subscription
+        patterns are listed once per block and referenced by index, the payloads are concatenated and base64 encoded
+        in one go, payload_size tells where each payload ends. The payloads are always base64 encoded.
+        """
+        self.output_file = output_file
+
+    def begin(self):
+        pass
+
+    def write(self, records):
+        topics = {}
+        patterns = {}
+        block = {
+            "timestamp": [record[0] for record in records],
+            "qos": [record[1] for record in records],
+            "retained": [record[2] for record in records],
+            "topic": [topics.setdefault(record[3], len(topics)) for record in records],
+            "subscription_pattern": [patterns.setdefault(record[4], len(patterns)) for record in records],
+            "payload_size": [len(record[5]) for record in records],
+            "payload": base64.b64encode(b"".join(record[5] for record in records)).decode("utf-8"),
+            "payload_encoding": "base64"
+        }
+        block["topics"] = list(topics.keys())
+        block["subscription_patterns"] = list(patterns.keys())
+        self.output_file.write(json.dumps(block, ensure_ascii=False) + "\n")
+
+    def end(self):
+        pass
+
+
+EXPORT_WRITERS = {
+    EXPORT_JSON: JsonArrayWriter,
+    EXPORT_JSON_LINES: JsonLinesWriter,
+    EXPORT_CSV: CsvWriter,
+    EXPORT_COLUMNAR: ColumnarWriter
+}
+
+
+def export_file_path(path, export_format, compression):
+    # Adds the compression extension if it's missing
+    extension = EXPORT_COMPRESSION_EXTENSIONS.get(compression, "")
+    if not path.endswith(extension):
+        path += extension
+    return path
+
+
+def export_part_path(path, export_format, compression, part):
+    # "messages.jsonl.gz" -> "messages_0002.jsonl.gz"
+    extension = EXPORT_COMPRESSION_EXTENSIONS.get(compression, "")
+    if path.endswith(EXPORT_FILE_EXTENSIONS[export_format] + extension):
+        extension = EXPORT_FILE_EXTENSIONS[export_format] + extension
+    return "{}_{:04d}{}".format(path[:len(path) - len(extension)], part, extension)
+
+
+class MessageExporter:
+    def __init__(self, message_store, message_ids, path, export_format, base64_only, compression=None,
+                 split_bytes=0):
+        """
+        Writes the messages of message_ids to path on a background thread.
+
+        compression is None, EXPORT_GZIP or EXPORT_XZ. If split_bytes is not 0, a new numbered file is started
+        whenever the current one reaches split_bytes on disk, each file is complete in its own right. Files are only
+        split between batches and the compressors buffer their output, so the files can be somewhat larger.
+
+        message_ids is the snapshot taken when the export starts, messages received during the export aren't
+        exported. The message store is only touched on the Tk thread: poll() reads the messages in batches and
+        hands them over to the export thread through a bounded queue, the export thread encodes and writes them, so
+        nothing is copied up front and ingestion carries on. Messages evicted before poll() gets to them are
+        skipped. A cancelled export deletes the files written.
+        """
+        self.message_store = message_store
+        self.message_ids = message_ids
+        self.path = export_file_path(path, export_format, compression)
+        self.export_format = export_format
+        self.base64_only = base64_only
+        self.compression = compression
+        self.split_bytes = split_bytes
+        # Files written so far
+        self.paths = []
+        # Index of the next message ID to read from the store
+        self.position = 0
+        self.end_queued = False
+        self.written = 0
+        self.skipped = 0
+        self.error = None
+        self.batches = queue.Queue(EXPORT_QUEUE_BATCHES)
+        self.stop_event = threading.Event()
+        self.export_thread = threading.Thread(target=self.export, daemon=True)
+
+    def start(self):
+        self.export_thread.start()
+
+    def cancel(self):
+        self.stop_event.set()
+
+    def cancelled(self):
+        return self.stop_event.is_set()
+
+    def running(self):
+        return self.export_thread.is_alive()
+
+    def fraction(self):
+        total = len(self.message_ids) - self.skipped
+        if total <= 0:
+            return 1.0
+        return min(1.0, self.written / total)
+
+    def poll(self, time_budget=EXPORT_TIME_BUDGET):
+        # Called on the Tk thread, reads messages from the store until the queue is full or the time is up
+        message_store = self.message_store
+        deadline = time.monotonic() + time_budget
+        while not self.end_queued and not self.batches.full() and not self.stop_event.is_set() and \
+                time.monotonic() < deadline:
+            if len(self.message_ids) <= self.position:
+                self.batches.put(None)
+                self.end_queued = True
+                break
+            batch_ids = self.message_ids[self.position:self.position + EXPORT_BATCH]
+            self.position += len(batch_ids)
+            batch = []
+            for message_id in batch_ids:
+                summary = message_store.get_summary(message_id)
+                if summary is None:
+                    self.skipped += 1
+                    continue
+                timestamp, qos, retained, topic, subscription_pattern = summary
+                batch.append((timestamp, qos, retained, topic, subscription_pattern,
+                              message_store.get_payload(message_id)))
+            self.batches.put(batch)
+
+    def next_batch(self):
+        # None at the end of the export or when cancelled
+        while not self.stop_event.is_set():
+            try:
+                return self.batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def open_file(self):
+        # (file on disk, text file to write to)
+        if self.split_bytes:
+            path = export_part_path(self.path, self.export_format, self.compression, len(self.paths) + 1)
+        else:
+            path = self.path
+        self.paths.append(path)
+        disk_file = open(path, "wb")
+        if self.compression == EXPORT_GZIP:
+            binary_file = gzip.GzipFile(fileobj=disk_file, mode="wb")
+        elif self.compression == EXPORT_XZ:
+            binary_file = lzma.LZMAFile(disk_file, "wb")
+        else:
+            binary_file = disk_file
+        return disk_file, io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+
+    def export(self):
+        disk_file = None
+        output_file = None
+        try:
+            disk_file, output_file = self.open_file()
+            writer = EXPORT_WRITERS[self.export_format](output_file, self.base64_only)
+            writer.begin()
+            batch = self.next_batch()
+            while batch is not None:
+                writer.write(batch)
+                self.written += len(batch)
+                batch = self.next_batch()
+                if batch is not None and self.split_bytes and self.split_bytes <= disk_file.tell():
+                    writer.end()
+                    output_file.close()
+                    disk_file.close()
+                    disk_file, output_file = self.open_file()
+                    writer = EXPORT_WRITERS[self.export_format](output_file, self.base64_only)
+                    writer.begin()
+            writer.end()
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+        finally:
+            if output_file is not None:
+                output_file.close()
+            if disk_file is not None:
+                disk_file.close()
+        if self.stop_event.is_set():
+            for path in self.paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,62 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+from collections import deque, namedtuple
+
+from mqttk.constants import INGESTION_QUEUE_LENGTH
+
+# Same attribute names as the paho MQTTMessage, so the widget callbacks can consume either
+QueuedMessage = namedtuple("QueuedMessage", ["topic", "payload", "qos", "retain", "timestamp"])
+
+
+class MessageQueue:
+    def __init__(self, max_length=INGESTION_QUEUE_LENGTH):
+        """
+        Handoff between the paho network thread and the Tk mainloop.
+
+        The network thread only ever appends and the Tk thread only ever pops, both of which are atomic on a deque,
+        so no locking is needed. When the queue is full, the oldest message is discarded and counted as dropped.
+        """
+        self.max_length = max_length
+        self.queue = deque(maxlen=max_length)
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, callback, mqtt_message_object, timestamp=None):
+        if len(self.queue) == self.max_length:
+            self.dropped += 1
+        self.received += 1
+        self.queue.append((callback, QueuedMessage(mqtt_message_object.topic,
+                                                   mqtt_message_object.payload,
+                                                   mqtt_message_object.qos,
+                                                   mqtt_message_object.retain,
+                                                   time.time() if timestamp is None else timestamp)))
+
+    def get(self):
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            return None
+
+    def depth(self):
+        return len(self.queue)
+
+    def clear(self):
+        self.queue.clear()
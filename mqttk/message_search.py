@@ -0,0 +1,291 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import time
+import heapq
+import multiprocessing
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from paho.mqtt.client import topic_matches_sub
+
+from mqttk.constants import SEARCH_INLINE_BYTES, SEARCH_CHUNK_BYTES, SEARCH_MAX_WORKERS, SEARCH_TIME_BUDGET
+
+# Messages checked between two looks at the clock
+SEARCH_BATCH = 500
+
+
+def payload_matches(payload, needle, regex):
+    if regex:
+        return re.search(needle, payload) is not None
+    return needle in payload
+
+
+def scan_payload_chunk(blob, sizes, needle, regex):
+    # Runs in a worker process. blob is the concatenation of payloads of the given sizes, returns the indexes of
+    # the payloads that match
+    matches = []
+    if regex:
+        offset = 0
+        for index, size in enumerate(sizes):
+            if re.search(needle, blob[offset:offset + size]) is not None:
+                matches.append(index)
+            offset += size
+        return matches
+
+    ends = list(accumulate(sizes))
+    position = blob.find(needle)
+    while position != -1:
+        index = bisect_right(ends, position)
+        if position + len(needle) <= ends[index]:
+            matches.append(index)
+            position = blob.find(needle, ends[index])
+        else:
+            # The occurrence spans two payloads
+            position = blob.find(needle, position + 1)
+    return matches
+
+
+class SearchQuery:
+    def __init__(self, topic_filter="", payload="", regex=False, qos=None, retained=None, start=None, end=None):
+        """
+        Message search criteria, empty criteria match everything.
+
+        topic_filter is an MQTT subscription pattern, payload is a substring or a regular expression matched against
+        the raw payload bytes, start and end are timestamps. Raises ValueError or re.error for invalid criteria.
+        """
+        self.topic_filter = topic_filter
+        self.payload = payload
+        self.regex = regex
+        self.qos = qos
+        self.retained = retained
+        self.start = start
+        self.end = end
+        self.needle = payload.encode("utf-8") if payload else None
+        if self.needle is not None and regex:
+            re.compile(self.needle)
+        if topic_filter:
+            # paho validates the filter
+            topic_matches_sub(topic_filter, "mqttk")
+        # Topic filter results per topic, each distinct topic is only matched once
+        self.topic_matches = {}
+
+    def matches_topic(self, topic):
+        if not self.topic_filter:
+            return True
+        match = self.topic_matches.get(topic)
+        if match is None:
+            try:
+                match = topic_matches_sub(self.topic_filter, topic)
+            except Exception:
+                match = False
+            self.topic_matches[topic] = match
+        return match
+
+    def matches_metadata(self, timestamp, qos, retained):
+        if self.qos is not None and qos != self.qos:
+            return False
+        if self.retained is not None and bool(retained) != self.retained:
+            return False
+        if self.start is not None and timestamp < self.start:
+            return False
+        if self.end is not None and self.end < timestamp:
+            return False
+        return True
+
+    def matches(self, message_store, message_id):
+        summary = message_store.get_summary(message_id)
+        if summary is None:
+            return False
+        timestamp, qos, retained, topic, _ = summary
+        if not self.matches_topic(topic) or not self.matches_metadata(timestamp, qos, retained):
+            return False
+        if self.needle is None:
+            return True
+        return payload_matches(message_store.get_payload(message_id), self.needle, self.regex)
+
+
+def candidate_ids(message_store, query):
+    # Message IDs narrowed down by the topic and time indexes, in ascending order
+    time_range = message_store.time_range_ids(query.start, query.end)
+    if not query.topic_filter:
+        return time_range
+    topic_message_ids = [message_store.topic_message_ids(topic)
+                         for topic in message_store.topics if query.matches_topic(topic)]
+    if len(topic_message_ids) == 1:
+        message_ids = topic_message_ids[0]
+    else:
+        message_ids = array("Q", heapq.merge(*topic_message_ids))
+    return message_ids[bisect_left(message_ids, time_range.start):bisect_left(message_ids, time_range.stop)]
+
+
+class SearchWorkers:
+    def __init__(self, max_workers=SEARCH_MAX_WORKERS):
+        """
+        Worker processes scanning payload chunks, started on first use.
+
+        The spawn start method is used on every platform, forking the Tk process isn't safe. If the workers can't be
+        started or break, submit() returns None and the searches carry on in the Tk process.
+        """
+        self.max_workers = min(max_workers, os.cpu_count() or 1)
+        self.executor = None
+        self.failed = self.max_workers < 2
+
+    def submit(self, blob, sizes, needle, regex):
+        if self.failed:
+            return None
+        try:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            return self.executor.submit(scan_payload_chunk, blob, sizes, needle, regex)
+        except Exception:
+            self.set_failed()
+            return None
+
+    def set_failed(self):
+        self.failed = True
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class SearchTask:
+    def __init__(self, message_store, query, workers):
+        """
+        Search of the message store, driven from the Tk mainloop by calling poll() until it returns True.
+
+        The candidates come from the indexes, the metadata is checked on the Tk thread. Payloads are scanned inline
+        up to SEARCH_INLINE_BYTES, larger scans are sent to the worker processes in chunks. Messages added after
+        the search has started (ID snapshot_id and above) are not searched.
+        """
+        self.message_store = message_store
+        self.query = query
+        self.workers = workers
+        self.snapshot_id = message_store.next_id
+        self.candidates = candidate_ids(message_store, query)
+        self.check_metadata = query.qos is not None or query.retained is not None or \
+            (not message_store.timestamps_sorted and (query.start is not None or query.end is not None))
+        self.position = 0
+        self.inline_bytes = 0
+        # Matching IDs of each chunk by chunk sequence number, the chunks may finish out of order
+        self.chunk_results = {}
+        self.chunk_sequence = 0
+        # (sequence, future, message IDs, blob, sizes) for chunks handed to the workers
+        self.pending = deque()
+        self.done = False
+        self.error = None
+
+    def fraction(self):
+        if len(self.candidates) == 0:
+            return 1.0
+        return self.position / len(self.candidates)
+
+    def next_chunk(self):
+        # Candidates passing the metadata checks, with their payloads if the payload has to be searched
+        message_store = self.message_store
+        message_ids = array("Q")
+        payloads = []
+        payload_bytes = 0
+        while self.position < len(self.candidates) and payload_bytes < SEARCH_CHUNK_BYTES and \
+                len(message_ids) < SEARCH_BATCH * 10:
+            message_id = self.candidates[self.position]
+            self.position += 1
+            row = message_store.row(message_id)
+            if row is None:
+                continue
+            if self.check_metadata and not self.query.matches_metadata(message_store.timestamps[row],
+                                                                       message_store.qos[row],
+                                                                       message_store.retained[row]):
+                continue
+            message_ids.append(message_id)
+            if self.query.needle is not None:
+                payload = message_store.get_payload(message_id)
+                payloads.append(payload)
+                payload_bytes += len(payload)
+            elif SEARCH_BATCH <= len(message_ids):
+                break
+        return message_ids, payloads, payload_bytes
+
+    def scan_inline(self, sequence, message_ids, blob, sizes):
+        matches = scan_payload_chunk(blob, sizes, self.query.needle, self.query.regex)
+        self.chunk_results[sequence] = array("Q", (message_ids[index] for index in matches))
+
+    def collect_finished(self):
+        while len(self.pending) != 0 and self.pending[0][1].done():
+            sequence, future, message_ids, blob, sizes = self.pending.popleft()
+            try:
+                matches = future.result()
+            except Exception:
+                self.workers.set_failed()
+                self.scan_inline(sequence, message_ids, blob, sizes)
+            else:
+                self.chunk_results[sequence] = array("Q", (message_ids[index] for index in matches))
+
+    def poll(self, time_budget=SEARCH_TIME_BUDGET):
+        deadline = time.monotonic() + time_budget
+        try:
+            while not self.done and time.monotonic() < deadline:
+                self.collect_finished()
+                if self.position == len(self.candidates):
+                    if len(self.pending) == 0:
+                        self.done = True
+                    break
+                if self.workers.max_workers * 2 <= len(self.pending):
+                    break
+                sequence = self.chunk_sequence
+                self.chunk_sequence += 1
+                message_ids, payloads, payload_bytes = self.next_chunk()
+                if self.query.needle is None:
+                    self.chunk_results[sequence] = message_ids
+                    continue
+                blob = b"".join(payloads)
+                sizes = [len(payload) for payload in payloads]
+                future = None
+                if SEARCH_INLINE_BYTES <= self.inline_bytes:
+                    future = self.workers.submit(blob, sizes, self.query.needle, self.query.regex)
+                if future is None:
+                    self.inline_bytes += payload_bytes
+                    self.scan_inline(sequence, message_ids, blob, sizes)
+                else:
+                    self.pending.append((sequence, future, message_ids, blob, sizes))
+        except Exception as e:
+            self.error = e
+            self.cancel()
+        return self.done
+
+    def results(self):
+        message_ids = array("Q")
+        for sequence in sorted(self.chunk_results.keys()):
+            message_ids.extend(self.chunk_results[sequence])
+        return message_ids
+
+    def cancel(self):
+        for pending in self.pending:
+            pending[1].cancel()
+        self.pending.clear()
+        self.done = True
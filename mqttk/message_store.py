@@ -0,0 +1,390 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import mmap
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+from mqttk.constants import MESSAGE_STORE_MAX_MESSAGES, MESSAGE_STORE_MAX_PAYLOAD_BYTES, SPILL_SEGMENT_SIZE, \
+    SPILL_HOT_BYTES
+
+# Evicted rows are only physically removed from the columns once there are this many of them
+COMPACTION_THRESHOLD = 4096
+
+
+class MemoryPayloadArena:
+    def __init__(self):
+        """
+        Payloads appended to a single bytearray. Offsets are absolute, the arena only holds the bytes from base.
+        """
+        self.arena = bytearray()
+        self.base = 0
+
+    def end_offset(self):
+        return self.base + len(self.arena)
+
+    def append(self, payload):
+        offset = self.end_offset()
+        self.arena += payload
+        return offset
+
+    def read(self, offset, size):
+        start = offset - self.base
+        return bytes(self.arena[start:start + size])
+
+    def release(self, offset):
+        # Everything before offset belongs to evicted messages
+        del self.arena[:offset - self.base]
+        self.base = offset
+
+    def close(self):
+        self.arena = bytearray()
+
+
+class DiskPayloadArena:
+    def __init__(self, segment_size=SPILL_SEGMENT_SIZE, hot_bytes=SPILL_HOT_BYTES):
+        """
+        Payloads appended to segment files in a temporary directory, read back through mmap.
+
+        The most recent hot_bytes of payload are also kept in memory, so the latest messages are served without
+        touching the disk. A payload never spans two segments, segments are deleted once every message in them has
+        been evicted.
+        """
+        self.segment_size = segment_size
+        self.hot_bytes = hot_bytes
+        self.directory = tempfile.mkdtemp(prefix="mqttk_capture_")
+        # [start offset, end offset, path, file object, mmap object or None, mapped length]
+        self.segments = []
+        self.segment_counter = 0
+        self.end = 0
+        self.hot = bytearray()
+        self.hot_base = 0
+        self.new_segment()
+
+    def new_segment(self):
+        path = os.path.join(self.directory, "segment_{:08d}.bin".format(self.segment_counter))
+        self.segment_counter += 1
+        self.segments.append([self.end, self.end, path, open(path, "w+b"), None, 0])
+
+    def end_offset(self):
+        return self.end
+
+    def append(self, payload):
+        segment = self.segments[-1]
+        if segment[1] != segment[0] and self.segment_size < segment[1] - segment[0] + len(payload):
+            segment[3].flush()
+            self.new_segment()
+            segment = self.segments[-1]
+        offset = self.end
+        segment[3].write(payload)
+        segment[1] += len(payload)
+        self.end += len(payload)
+
+        self.hot += payload
+        if 2 * self.hot_bytes < len(self.hot):
+            cut = len(self.hot) - self.hot_bytes
+            del self.hot[:cut]
+            self.hot_base += cut
+        return offset
+
+    def find_segment(self, offset):
+        for segment in reversed(self.segments):
+            if segment[0] <= offset:
+                return segment
+        return None
+
+    def read(self, offset, size):
+        if size == 0:
+            return b""
+        if self.hot_base <= offset:
+            start = offset - self.hot_base
+            return bytes(self.hot[start:start + size])
+        segment = self.find_segment(offset)
+        if segment is None:
+            return b""
+        start = offset - segment[0]
+        if segment[5] < start + size:
+            # The segment grew since it was mapped (or has never been mapped), map it again
+            segment[3].flush()
+            if segment[4] is not None:
+                segment[4].close()
+            segment[5] = segment[1] - segment[0]
+            segment[4] = mmap.mmap(segment[3].fileno(), segment[5], access=mmap.ACCESS_READ)
+        return segment[4][start:start + size]
+
+    def release(self, offset):
+        while 1 < len(self.segments) and self.segments[0][1] <= offset:
+            self.close_segment(self.segments.pop(0))
+
+    @staticmethod
+    def close_segment(segment):
+        if segment[4] is not None:
+            segment[4].close()
+        segment[3].close()
+        try:
+            os.remove(segment[2])
+        except OSError:
+            pass
+
+    def close(self):
+        for segment in self.segments:
+            self.close_segment(segment)
+        self.segments = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MessageStore:
+    def __init__(self, max_messages=MESSAGE_STORE_MAX_MESSAGES, max_payload_bytes=MESSAGE_STORE_MAX_PAYLOAD_BYTES,
+                 spill_to_disk=False):
+        """
+        Bounded ring buffer of captured messages.
+
+        Message IDs are assigned sequentially and are never reused, the stored messages always have the IDs
+        first_id ... next_id - 1. When either limit is exceeded, the oldest messages are evicted first. A limit of
+        0 means unlimited.
+
+        Messages are stored in columns rather than one dict per message: timestamps, QoS and retained flags live in
+        arrays, topics and subscription patterns are interned and referenced by ID, and the payloads are appended to
+        a payload arena, either in memory or spilled to disk. get() builds the familiar message dict on demand:
+
+        message = {
+            "topic": "message topic",
+            "subscription_pattern": "subscription pattern",
+            "timestamp": reception timestamp,
+            "qos": message qos,
+            "retained": message retained flag,
+            "payload": message content
+        }
+        """
+        self.max_messages = max_messages
+        self.max_payload_bytes = max_payload_bytes
+        self.spill_to_disk = spill_to_disk
+        self.payload_arena = None
+        self.next_id = 0
+        self.clear()
+
+    @staticmethod
+    def new_payload_arena(spill_to_disk):
+        return DiskPayloadArena() if spill_to_disk else MemoryPayloadArena()
+
+    def clear(self):
+        self.timestamps = array("d")
+        self.qos = array("B")
+        self.retained = array("B")
+        self.topic_ids = array("I")
+        self.pattern_ids = array("I")
+        self.payload_offsets = array("Q")
+        if self.payload_arena is not None:
+            self.payload_arena.close()
+        self.payload_arena = self.new_payload_arena(self.spill_to_disk)
+        # Number of evicted rows still physically present at the start of the columns
+        self.head = 0
+
+        self.topics = []
+        self.topic_lookup = {}
+        self.patterns = []
+        self.pattern_lookup = {}
+        # Search indexes: message IDs of each topic ID in ascending order (may still contain evicted IDs), and
+        # whether the timestamps are in ascending order, so the timestamp column can be bisected
+        self.topic_index = {}
+        self.timestamps_sorted = True
+
+        # IDs keep counting up, an export or search still holding IDs from before the clear finds them gone rather
+        # than getting new messages in their place
+        self.first_id = self.next_id
+        self.payload_bytes = 0
+        self.evicted_messages = 0
+        self.evicted_bytes = 0
+
+    def close(self):
+        self.payload_arena.close()
+
+    def set_spill_to_disk(self, spill_to_disk):
+        if spill_to_disk == self.spill_to_disk:
+            return
+        # Copy the payloads of the live messages over to the new arena, the store only switches once that worked
+        self.compact()
+        new_arena = self.new_payload_arena(spill_to_disk)
+        new_offsets = array("Q")
+        try:
+            for row in range(len(self.payload_offsets)):
+                payload = self.payload_arena.read(self.payload_offsets[row], self.payload_size(row))
+                new_offsets.append(new_arena.append(payload))
+        except Exception:
+            new_arena.close()
+            raise
+        self.payload_arena.close()
+        self.payload_arena = new_arena
+        self.payload_offsets = new_offsets
+        self.spill_to_disk = spill_to_disk
+
+    def __len__(self):
+        return self.next_id - self.first_id
+
+    @staticmethod
+    def intern(value, table, lookup):
+        value_id = lookup.get(value)
+        if value_id is None:
+            value_id = len(table)
+            table.append(value)
+            lookup[value] = value_id
+        return value_id
+
+    def add(self, topic, payload, qos, retained, subscription_pattern, timestamp):
+        message_id = self.next_id
+        self.next_id += 1
+        if self.timestamps_sorted and len(self.timestamps) != 0 and timestamp < self.timestamps[-1]:
+            self.timestamps_sorted = False
+        self.timestamps.append(timestamp)
+        self.qos.append(qos)
+        self.retained.append(1 if retained else 0)
+        topic_id = self.intern(topic, self.topics, self.topic_lookup)
+        self.topic_ids.append(topic_id)
+        topic_message_ids = self.topic_index.get(topic_id)
+        if topic_message_ids is None:
+            topic_message_ids = self.topic_index[topic_id] = array("Q")
+        topic_message_ids.append(message_id)
+        self.pattern_ids.append(self.intern(subscription_pattern, self.patterns, self.pattern_lookup))
+        self.payload_offsets.append(self.payload_arena.append(payload))
+        self.payload_bytes += len(payload)
+        self.evict()
+        return message_id
+
+    def payload_size(self, row):
+        start = self.payload_offsets[row]
+        if row + 1 < len(self.payload_offsets):
+            return self.payload_offsets[row + 1] - start
+        return self.payload_arena.end_offset() - start
+
+    def evict(self):
+        # The newest message is always kept, even if it is larger than the payload limit on its own
+        evicted = False
+        while 1 < len(self) and ((self.max_messages and self.max_messages < len(self)) or
+                                 (self.max_payload_bytes and self.max_payload_bytes < self.payload_bytes)):
+            payload_size = self.payload_size(self.head)
+            self.head += 1
+            self.first_id += 1
+            self.payload_bytes -= payload_size
+            self.evicted_messages += 1
+            self.evicted_bytes += payload_size
+            evicted = True
+        if evicted:
+            self.payload_arena.release(self.payload_offsets[self.head])
+            if COMPACTION_THRESHOLD <= self.head and len(self) <= self.head:
+                self.compact()
+
+    def compact(self):
+        head = self.head
+        for column in (self.timestamps, self.qos, self.retained, self.topic_ids, self.pattern_ids,
+                       self.payload_offsets):
+            del column[:head]
+        self.head = 0
+        for topic_id in list(self.topic_index.keys()):
+            topic_message_ids = self.topic_index[topic_id]
+            del topic_message_ids[:bisect_left(topic_message_ids, self.first_id)]
+            if len(topic_message_ids) == 0:
+                del self.topic_index[topic_id]
+        self.prune_interned()
+
+    def prune_interned(self):
+        # Forget the topics and subscription patterns no stored message refers to any more, so a stream of unique
+        # topics doesn't grow the intern tables beyond the limits of the store
+        if len(self.topic_index) < len(self.topics):
+            remap = self.renumber(self.topic_ids, self.topics, self.topic_lookup, self.topic_index.keys())
+            self.topic_index = {remap[topic_id]: message_ids for topic_id, message_ids in self.topic_index.items()}
+        pattern_ids = set(self.pattern_ids)
+        if len(pattern_ids) < len(self.patterns):
+            self.renumber(self.pattern_ids, self.patterns, self.pattern_lookup, pattern_ids)
+
+    @staticmethod
+    def renumber(column, table, lookup, used_ids):
+        # Keeps the values of used_ids in the intern table, renumbers them and the column referencing them
+        remap = {}
+        values = []
+        for value_id in sorted(used_ids):
+            remap[value_id] = len(values)
+            values.append(table[value_id])
+        table[:] = values
+        lookup.clear()
+        lookup.update((value, value_id) for value_id, value in enumerate(values))
+        column[:] = array(column.typecode, [remap[value_id] for value_id in column])
+        return remap
+
+    def set_limits(self, max_messages, max_payload_bytes):
+        self.max_messages = max_messages
+        self.max_payload_bytes = max_payload_bytes
+        self.evict()
+
+    def row(self, message_id):
+        if message_id < self.first_id or self.next_id <= message_id:
+            return None
+        return self.head + message_id - self.first_id
+
+    def get_payload(self, message_id):
+        row = self.row(message_id)
+        if row is None:
+            return None
+        return self.payload_arena.read(self.payload_offsets[row], self.payload_size(row))
+
+    def get_summary(self, message_id):
+        # Everything but the payload, used for the message list rows
+        row = self.row(message_id)
+        if row is None:
+            return None
+        return (self.timestamps[row],
+                self.qos[row],
+                bool(self.retained[row]),
+                self.topics[self.topic_ids[row]],
+                self.patterns[self.pattern_ids[row]])
+
+    def get(self, message_id):
+        row = self.row(message_id)
+        if row is None:
+            return {}
+        return {
+            "topic": self.topics[self.topic_ids[row]],
+            "payload": self.get_payload(message_id),
+            "qos": self.qos[row],
+            "subscription_pattern": self.patterns[self.pattern_ids[row]],
+            "retained": bool(self.retained[row]),
+            "timestamp": self.timestamps[row]
+        }
+
+    def message_ids(self):
+        return range(self.first_id, self.next_id)
+
+    def topic_message_ids(self, topic):
+        # Message IDs of a topic in ascending order, evicted ones are skipped
+        topic_message_ids = self.topic_index.get(self.topic_lookup.get(topic), ())
+        return topic_message_ids[bisect_left(topic_message_ids, self.first_id):]
+
+    def time_range_ids(self, start=None, end=None):
+        # Message IDs received between start and end, using bisection when the timestamps are in order
+        first_row = self.head
+        last_row = len(self.timestamps)
+        if not self.timestamps_sorted:
+            return range(self.first_id, self.next_id)
+        if start is not None:
+            first_row = bisect_left(self.timestamps, start, self.head)
+        if end is not None:
+            last_row = bisect_right(self.timestamps, end, first_row)
+        return range(self.first_id + first_row - self.head, self.first_id + last_row - self.head)
@@ -0,0 +1,224 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import json.scanner
+import threading
+import traceback
+from collections import deque
+from os import linesep
+
+from mqttk.constants import DECODE_INLINE_BYTES
+from mqttk.hex_printer import hex_viewer
+
+# Characters of output collected on the worker thread before they are handed over
+RENDER_BATCH = 64 * 1024
+
+
+def load_json_yielding(text):
+    """
+    json.loads() with the pure Python scanner. It is several times slower than the C one, but the interpreter can
+    switch threads while it runs, so parsing a large payload on a worker thread doesn't stall the Tk mainloop.
+    Deeply nested documents exceed the recursion limit of the Python scanner. Those up to DECODE_INLINE_BYTES are
+    parsed by the C one, which holds the interpreter no longer than parsing it inline would, larger ones re-raise
+    the RecursionError.
+    """
+    json_decoder = json.JSONDecoder()
+    json_decoder.scan_once = json.scanner.py_make_scanner(json_decoder)
+    try:
+        return json_decoder.decode(text)
+    except RecursionError:
+        if DECODE_INLINE_BYTES < len(text):
+            raise
+        return json.loads(text)
+
+
+def iter_rendered_payload(payload, decoder, background=False):
+    """
+    Generator of the pieces of the payload decoded and formatted with the given decoder. The JSON pretty formatter
+    streams the output of JSONEncoder.iterencode(), which is the same as json.dumps(), without building the whole
+    string first. With indentation the encoder is pure Python, with background=True the parsing is as well.
+    """
+    try:
+        payload_decoded = str(payload.decode("utf-8"))
+    except Exception:
+        # Shown the same as the Text widget shows raw bytes, one character per byte
+        payload_decoded = bytes(payload).decode("latin-1")
+    if decoder == "JSON pretty formatter":
+        try:
+            if background:
+                new_message_structure = load_json_yielding(payload_decoded)
+            else:
+                new_message_structure = json.loads(payload_decoded)
+        except RecursionError:
+            yield "        *** JSON NESTED TOO DEEPLY TO FORMAT, SHOWN AS RECEIVED ***{}".format(linesep+linesep)
+            yield payload_decoded
+            return
+        except Exception as e:
+            yield "        *** FAILED TO LOAD JSON ***{}{}{}{}".format(linesep+linesep,
+                                                                      e,
+                                                                      linesep+linesep,
+                                                                      traceback.format_exc())
+            return
+        yield from json.JSONEncoder(indent=2, ensure_ascii=False).iterencode(new_message_structure)
+
+    elif decoder == "Hex formatter":
+        for line in hex_viewer(payload):
+            yield line + linesep
+
+    else:
+        yield payload_decoded
+
+
+def render_payload(payload, decoder):
+    return "".join(iter_rendered_payload(payload, decoder))
+
+
+class TextSource:
+    def __init__(self, text):
+        """
+        An already rendered payload, read by the payload view in pieces. See PayloadRenderTask.
+        """
+        self.text = text
+        self.position = 0
+        self.size = len(text)
+        self.progress = 1.0
+        self.error = None
+
+    def request(self, limit):
+        pass
+
+    def read(self, max_length):
+        piece = self.text[self.position:self.position + max_length]
+        self.position += len(piece)
+        return piece
+
+    def exhausted(self):
+        return len(self.text) <= self.position
+
+    def cancel(self):
+        pass
+
+
+class PayloadRenderTask:
+    def __init__(self, executor, payload, decoder, limit, prepare=None, keep_limit=0):
+        """
+        iter_rendered_payload() running on a worker thread of executor, read by the payload view in pieces.
+
+        The worker only renders ahead until limit characters are produced, request() raises the limit, so a huge
+        payload is only formatted as far as it is looked at. Cancellation stops the worker at the next piece,
+        parsing the JSON itself can't be interrupted, but its result is thrown away.
+
+        If prepare is given, prepare(payload) runs on the worker before the rendering and returns the payload to
+        render and details about it (for example after decompressing it). The details are kept in self.details,
+        which stays None until then.
+
+        Up to keep_limit characters of output are also kept, so once the worker has rendered the whole payload it
+        can be cached, see rendered_text().
+        """
+        self.size = len(payload)
+        self.details = None
+        self.prepare = prepare
+        self.condition = threading.Condition()
+        self.pieces = deque()
+        self.produced = 0
+        self.keep_limit = keep_limit
+        self.kept = [] if keep_limit else None
+        self.limit = limit
+        self.progress = 0.0
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+        self.future = executor.submit(self.render, payload, decoder)
+
+    def render(self, payload, decoder):
+        batch = []
+        batch_length = 0
+        try:
+            if self.prepare is not None:
+                payload, self.details = self.prepare(payload)
+                self.size = len(payload)
+            for piece in iter_rendered_payload(payload, decoder, background=True):
+                batch.append(piece)
+                batch_length += len(piece)
+                if batch_length < RENDER_BATCH:
+                    continue
+                if not self.publish(batch, batch_length):
+                    return
+                batch = []
+                batch_length = 0
+            self.publish(batch, batch_length)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+
+    def publish(self, batch, batch_length):
+        # Hands a batch of pieces over to the Tk thread, waits while the limit is reached. False when cancelled.
+        with self.condition:
+            while self.limit <= self.produced and not self.cancelled:
+                self.condition.wait()
+            if self.cancelled:
+                return False
+            piece = "".join(batch)
+            self.pieces.append(piece)
+            self.produced += batch_length
+            if self.kept is not None:
+                self.kept.append(piece)
+                if self.keep_limit < self.produced:
+                    self.kept = None
+            # The formatted output is typically about twice as long as the payload
+            self.progress = min(0.99, self.produced / (2 * self.size + 1))
+            return True
+
+    def request(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify()
+
+    def read(self, max_length):
+        pieces = []
+        length = 0
+        with self.condition:
+            while self.pieces and length < max_length:
+                piece = self.pieces.popleft()
+                if max_length < length + len(piece):
+                    self.pieces.appendleft(piece[max_length - length:])
+                    piece = piece[:max_length - length]
+                pieces.append(piece)
+                length += len(piece)
+        return "".join(pieces)
+
+    def rendered_text(self):
+        # The whole rendered payload once the worker has finished, None until then or if it was too long to keep
+        with self.condition:
+            if not self.finished or self.cancelled or self.error is not None or self.kept is None:
+                return None
+            return "".join(self.kept)
+
+    def exhausted(self):
+        with self.condition:
+            return self.finished and not self.pieces
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify()
+        self.future.cancel()
@@ -0,0 +1,333 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import io
+import os
+import gzip
+import lzma
+import base64
+import json
+import threading
+import time
+from functools import partial
+
+from mqttk.capture_file import is_capture_file, read_capture_file
+from mqttk.compression import detect_compression, GZIP, XZ
+from mqttk.constants import REPLAY_ORIGINAL_TIMING, OFFLINE_LOAD_CHUNK
+from mqttk.message_queue import QueuedMessage
+
+# Below this, the scheduler stops sleeping and yields until the send time instead, for sub-millisecond accuracy
+SPIN_THRESHOLD = 0.002
+# Characters read from a JSON array export at once, the buffer grows when a single message is larger than this
+JSON_READ_SIZE = 1024 * 1024
+JSON_WHITESPACE = " \t\n\r"
+# A decoding error further than this from the end of the buffer isn't caused by a token cut off by the buffer end,
+# the longest such tokens are literals like -Infinity and surrogate pair escapes
+JSON_TRUNCATION_MARGIN = 64
+
+
+def decode_exported_payload(message):
+    payload = message.get("payload", "")
+    if message.get("payload_encoding") == "base64":
+        return base64.b64decode(payload)
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    return payload
+
+
+def export_record(message):
+    return (message["timestamp"],
+            message["topic"],
+            message.get("subscription_pattern", ""),
+            message.get("qos", 0),
+            message.get("retained", 0),
+            decode_exported_payload(message))
+
+
+def iter_columnar_block(block):
+    # Messages of a block of the columnar export, see message_export.ColumnarWriter
+    payloads = base64.b64decode(block["payload"])
+    offset = 0
+    for index, payload_size in enumerate(block["payload_size"]):
+        yield (block["timestamp"][index],
+               block["topics"][block["topic"][index]],
+               block["subscription_patterns"][block["subscription_pattern"][index]],
+               block["qos"][index],
+               block["retained"][index],
+               payloads[offset:offset + payload_size])
+        offset += payload_size
+
+
+def iter_json_array(input_file):
+    """
+    Elements of a JSON array read from input_file, decoded one at a time from a buffer that is refilled from the file
+    as needed, so the whole array is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    read_size = JSON_READ_SIZE
+    end_of_file = False
+    expected = "["
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+            position += 1
+        need_more = position == len(buffer)
+        if not need_more:
+            character = buffer[position]
+            if expected == "[":
+                if character != "[":
+                    raise ValueError("Not a JSON array")
+                position += 1
+                expected = "value"
+            elif character == "]":
+                return
+            elif expected == ",":
+                if character != ",":
+                    raise ValueError("Expected ',' or ']' in JSON array")
+                position += 1
+                expected = "value"
+            else:
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    # Only a string running into the end of the buffer or an error right at the end can be fixed
+                    # by reading more, otherwise the element is malformed
+                    if end_of_file or (JSON_TRUNCATION_MARGIN < len(buffer) - e.pos and
+                                       not e.msg.startswith("Unterminated string")):
+                        raise
+                    need_more = True
+                else:
+                    # A number at the end of the buffer may continue in the next read
+                    need_more = end == len(buffer) and not end_of_file
+                    if not need_more:
+                        position = end
+                        expected = ","
+                        yield element
+        if need_more:
+            if end_of_file:
+                raise ValueError("Truncated JSON array")
+            chunk = input_file.read(read_size)
+            end_of_file = chunk == ""
+            buffer = buffer[position:] + chunk
+            position = 0
+            # An element that doesn't fit in the buffer is decoded again after each read, grow the reads with it
+            read_size = max(JSON_READ_SIZE, len(buffer))
+
+
+def open_json_export(path):
+    # (file on disk, text file), gzip and xz compressed exports are decompressed on the fly
+    disk_file = open(path, "rb")
+    codec = detect_compression(disk_file.read(6))
+    disk_file.seek(0)
+    if codec == GZIP:
+        binary_file = gzip.GzipFile(fileobj=disk_file, mode="rb")
+    elif codec == XZ:
+        binary_file = lzma.LZMAFile(disk_file, "rb")
+    else:
+        binary_file = disk_file
+    return disk_file, io.TextIOWrapper(binary_file, encoding="utf-8")
+
+
+def read_json_export(path, progress=None):
+    # Messages exported by MQTTk in JSON, JSON Lines or columnar JSON Lines format, optionally compressed
+    disk_file, input_file = open_json_export(path)
+    with disk_file, input_file:
+        first_character = input_file.read(1)
+        while first_character.isspace():
+            first_character = input_file.read(1)
+        input_file.seek(0)
+        if progress is not None:
+            progress["size"] = os.fstat(disk_file.fileno()).st_size
+        if first_character == "[":
+            for message in iter_json_array(input_file):
+                if progress is not None:
+                    progress["position"] = disk_file.tell()
+                yield export_record(message)
+            return
+
+        for line in input_file:
+            if progress is not None:
+                progress["position"] = disk_file.tell()
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if "payload_size" in message:
+                yield from iter_columnar_block(message)
+            else:
+                yield export_record(message)
+
+
+def read_capture(path, progress=None):
+    """
+    Generator of (timestamp, topic, subscription_pattern, qos, retained, payload) tuples from a native capture file
+    or a JSON message export. If a progress dict is passed, progress["position"] / progress["size"] tells how far
+    the reading got.
+    """
+    if is_capture_file(path):
+        return read_capture_file(path, progress)
+    return read_json_export(path, progress)
+
+
+class CaptureLoader:
+    def __init__(self, path, message_queue, on_message_callback):
+        """
+        Loads a capture into the user interface without a broker connection.
+
+        The capture is read on a background thread and fed to the message queue in chunks, exactly like live
+        traffic, on_message_callback(_, __, msg, subscription_pattern) is called on the Tk thread for each message.
+        The loader waits while the queue is more than half full, so no messages are dropped and the capture is
+        never read into memory in one go.
+        """
+        self.path = path
+        self.message_queue = message_queue
+        self.on_message_callback = on_message_callback
+        self.callbacks = {}
+        # Never queue more in one go than what fits in the free half of the queue
+        self.chunk_size = max(1, min(OFFLINE_LOAD_CHUNK, message_queue.max_length // 2))
+        self.progress = {"position": 0, "size": 0}
+        self.loaded = 0
+        self.error = None
+        self.stop_event = threading.Event()
+        self.loader_thread = threading.Thread(target=self.load, daemon=True)
+
+    def start(self):
+        self.loader_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def running(self):
+        return self.loader_thread.is_alive()
+
+    def fraction(self):
+        if not self.progress["size"]:
+            return 0.0
+        return min(1.0, self.progress["position"] / self.progress["size"])
+
+    def get_callback(self, subscription_pattern):
+        callback = self.callbacks.get(subscription_pattern)
+        if callback is None:
+            callback = partial(self.on_message_callback, subscription_pattern=subscription_pattern)
+            self.callbacks[subscription_pattern] = callback
+        return callback
+
+    def load(self):
+        try:
+            for timestamp, topic, subscription_pattern, qos, retained, payload in read_capture(self.path,
+                                                                                              self.progress):
+                if self.loaded % self.chunk_size == 0:
+                    while self.message_queue.max_length // 2 < self.message_queue.depth():
+                        if self.stop_event.wait(0.01):
+                            return
+                    if self.stop_event.is_set():
+                        return
+                message = QueuedMessage(topic, payload, qos, retained, timestamp)
+                self.message_queue.put(self.get_callback(subscription_pattern), message, timestamp)
+                self.loaded += 1
+            self.progress["position"] = self.progress["size"]
+        except Exception as e:
+            self.error = e
+
+
+class ReplayEngine:
+    def __init__(self, messages, publish_function, mode=REPLAY_ORIGINAL_TIMING, speed=1.0, rate_limit=0,
+                 keep_retained=False):
+        """
+        Republishes captured messages on a background thread.
+
+        messages is an iterable of (timestamp, topic, subscription_pattern, qos, retained, payload) tuples, in
+        capture order. In REPLAY_ORIGINAL_TIMING mode the original gaps between the messages are kept, divided by
+        speed. In REPLAY_FLAT_OUT mode the messages are sent as fast as possible, or at rate_limit messages per
+        second if it is not 0. publish_function(topic, payload, qos, retained) is called on the replay thread.
+        """
+        self.messages = messages
+        self.publish_function = publish_function
+        self.mode = mode
+        self.speed = speed if 0 < speed else 1.0
+        self.rate_limit = rate_limit
+        self.keep_retained = keep_retained
+
+        self.stop_event = threading.Event()
+        self.sent = 0
+        self.started = None
+        self.finished = None
+        # How far behind schedule the last message went out, in seconds
+        self.lag = 0.0
+        self.target_rate = 0.0
+        self.error = None
+        self.replay_thread = threading.Thread(target=self.replay, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.replay_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def running(self):
+        return self.replay_thread.is_alive()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def achieved_rate(self):
+        elapsed = self.elapsed()
+        return self.sent / elapsed if 0 < elapsed else 0.0
+
+    def wait_until(self, send_time):
+        while True:
+            remaining = send_time - time.perf_counter()
+            if remaining <= 0:
+                return
+            if SPIN_THRESHOLD < remaining:
+                if self.stop_event.wait(remaining - SPIN_THRESHOLD):
+                    return
+            else:
+                time.sleep(0)
+
+    def replay(self):
+        first_timestamp = None
+        try:
+            for timestamp, topic, _, qos, retained, payload in self.messages:
+                if self.stop_event.is_set():
+                    break
+                if self.mode == REPLAY_ORIGINAL_TIMING:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                    offset = (timestamp - first_timestamp) / self.speed
+                    if 0 < offset:
+                        self.target_rate = self.sent / offset
+                elif self.rate_limit:
+                    offset = self.sent / self.rate_limit
+                    self.target_rate = self.rate_limit
+                else:
+                    offset = 0
+                send_time = self.started + offset
+                self.wait_until(send_time)
+                if self.stop_event.is_set():
+                    break
+                self.lag = max(0.0, time.perf_counter() - send_time)
+                self.publish_function(topic, payload, qos, bool(retained) and self.keep_retained)
+                self.sent += 1
+        except Exception as e:
+            self.error = e
+        self.finished = time.perf_counter()
@@ -0,0 +1,136 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+
+from mqttk.constants import SYS_METRIC_LEVELS, SYS_CUMULATIVE_METRICS
+
+# Leading number of a $SYS payload, e.g. "12.5" or "3600 seconds"
+NUMBER = re.compile(r"\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)")
+
+RATE_SUFFIX = " /s"
+
+
+def parse_metric(payload):
+    # Numeric value of a $SYS payload, None if it isn't a number
+    try:
+        match = NUMBER.match(payload.decode("utf-8"))
+    except Exception:
+        return None
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+class MetricSeries:
+    def __init__(self, levels=SYS_METRIC_LEVELS):
+        """
+        Time series of one metric at several resolutions.
+
+        Each level averages the samples into buckets of its resolution and keeps its last number of points, so a
+        series takes a fixed amount of memory, and longer time spans are served from the coarser levels. The bucket
+        still being filled is kept separately as (start, sum, count).
+        """
+        self.levels = levels
+        self.times = [array("d") for _ in levels]
+        self.values = [array("d") for _ in levels]
+        self.open_buckets = [[0.0, 0.0, 0] for _ in levels]
+        self.last_time = None
+        self.last_value = None
+
+    def add(self, timestamp, value):
+        self.last_time = timestamp
+        self.last_value = value
+        for level, (resolution, points) in enumerate(self.levels):
+            bucket_start = timestamp - timestamp % resolution
+            open_bucket = self.open_buckets[level]
+            if open_bucket[2] != 0 and open_bucket[0] < bucket_start:
+                times = self.times[level]
+                values = self.values[level]
+                times.append(open_bucket[0])
+                values.append(open_bucket[1] / open_bucket[2])
+                if points + points // 4 < len(times):
+                    del times[:len(times) - points]
+                    del values[:len(values) - points]
+                open_bucket[2] = 0
+            if open_bucket[2] == 0:
+                open_bucket[0] = bucket_start
+                open_bucket[1] = 0.0
+            # Late samples are averaged into the open bucket
+            open_bucket[1] += value
+            open_bucket[2] += 1
+
+    def points(self, span, now):
+        # (times, values) of the last span seconds before now, from the finest level that covers the span
+        level = len(self.levels) - 1
+        for index, (resolution, points) in enumerate(self.levels):
+            if span <= resolution * points:
+                level = index
+                break
+        start = now - span
+        first = bisect_left(self.times[level], start)
+        times = list(self.times[level][first:])
+        values = list(self.values[level][first:])
+        open_bucket = self.open_buckets[level]
+        if open_bucket[2] != 0 and start <= open_bucket[0]:
+            times.append(open_bucket[0])
+            values.append(open_bucket[1] / open_bucket[2])
+        return times, values
+
+
+class SysMetricsStore:
+    def __init__(self, levels=SYS_METRIC_LEVELS):
+        """
+        Numeric $SYS/broker values as downsampled time series, by the topic below $SYS/broker/.
+
+        The cumulative counters in SYS_CUMULATIVE_METRICS get a derived rate series as well, named metric + " /s",
+        computed from consecutive samples. A counter going backwards (broker restart) gives no rate sample.
+        """
+        self.levels = levels
+        self.series = {}
+
+    def add(self, metric, timestamp, payload):
+        # Names of the series updated
+        value = parse_metric(payload)
+        if value is None:
+            return ()
+        series = self.series.get(metric)
+        if series is None:
+            series = self.series[metric] = MetricSeries(self.levels)
+        last_time = series.last_time
+        last_value = series.last_value
+        series.add(timestamp, value)
+        if metric not in SYS_CUMULATIVE_METRICS:
+            return (metric,)
+        if last_time is None or timestamp <= last_time or value < last_value:
+            return (metric,)
+        rate_metric = metric + RATE_SUFFIX
+        rate_series = self.series.get(rate_metric)
+        if rate_series is None:
+            rate_series = self.series[rate_metric] = MetricSeries(self.levels)
+        rate_series.add(timestamp, (value - last_value) / (timestamp - last_time))
+        return metric, rate_metric
+
+    def get(self, metric):
+        return self.series.get(metric)
+
+    def clear(self):
+        self.series = {}
@@ -0,0 +1,83 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict, deque
+
+from mqttk.constants import TOPIC_HISTORY_LENGTH, TOPIC_HISTORY_MAX_BYTES
+
+# Estimated memory use of a history entry besides the payload bytes
+ENTRY_OVERHEAD = 100
+
+
+class TopicHistory:
+    def __init__(self, length=TOPIC_HISTORY_LENGTH, max_bytes=TOPIC_HISTORY_MAX_BYTES):
+        """
+        The last length (timestamp, payload) values of each topic.
+
+        The histories of all topics together are limited to about max_bytes, 0 means unlimited. Topics are kept in
+        least recently used order, updating or looking at a topic makes it the most recent, and the oldest values of
+        the least recently used topics are dropped first. The latest value of the most recent topic is always kept.
+        """
+        self.length = length
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self.histories = OrderedDict()
+        self.size = 0
+
+    def add(self, topic, timestamp, payload):
+        history = self.histories.get(topic)
+        if history is None:
+            history = self.histories[topic] = deque()
+        else:
+            self.histories.move_to_end(topic)
+        history.append((timestamp, payload))
+        self.size += len(payload) + ENTRY_OVERHEAD
+        while self.length < len(history):
+            self.size -= len(history.popleft()[1]) + ENTRY_OVERHEAD
+        self.evict()
+
+    def evict(self):
+        while self.max_bytes and self.max_bytes < self.size:
+            topic, history = next(iter(self.histories.items()))
+            if len(self.histories) == 1 and len(history) == 1:
+                break
+            self.size -= len(history.popleft()[1]) + ENTRY_OVERHEAD
+            if len(history) == 0:
+                del self.histories[topic]
+
+    def get(self, topic):
+        # Values of topic, newest first
+        history = self.histories.get(topic)
+        if history is None:
+            return []
+        self.histories.move_to_end(topic)
+        return list(reversed(history))
+
+    def set_limits(self, length, max_bytes):
+        self.length = max(1, length)
+        self.max_bytes = max_bytes
+        for history in self.histories.values():
+            while self.length < len(history):
+                self.size -= len(history.popleft()[1]) + ENTRY_OVERHEAD
+        self.evict()
+
+    def __len__(self):
+        return len(self.histories)
@@ -0,0 +1,189 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+
+from mqttk.constants import TOPIC_RATE_TIME_CONSTANT
+
+
+class TopicNode:
+    __slots__ = ("name", "item_id", "parent", "children", "is_topic", "values", "shown", "expanded", "placeholder",
+                 "message_count", "payload_bytes", "message_rate", "byte_rate", "last_seen")
+
+    def __init__(self, name, item_id, parent):
+        self.name = name
+        # Treeview item ID, the levels of the topic up to this node
+        self.item_id = item_id
+        self.parent = parent
+        self.children = {}
+        # False for the levels that only exist as the parent of other topics
+        self.is_topic = False
+        # (qos, retained, timestamp, payload) of the last message
+        self.values = None
+        # Treeview state: whether the node has an item, whether its children have items, and the item ID of its
+        # placeholder child if it has one instead
+        self.shown = False
+        self.expanded = False
+        self.placeholder = None
+        # Statistics of the messages of the topic and every topic below it
+        self.message_count = 0
+        self.payload_bytes = 0
+        # Exponentially weighted moving averages as of last_seen
+        self.message_rate = 0.0
+        self.byte_rate = 0.0
+        self.last_seen = 0.0
+
+    def decay(self, now):
+        # Factor of the moving averages at now, they decay while no messages arrive
+        if now <= self.last_seen:
+            return 1.0
+        return math.exp((self.last_seen - now) / TOPIC_RATE_TIME_CONSTANT)
+
+    def current_message_rate(self, now):
+        return self.message_rate * self.decay(now)
+
+    def current_byte_rate(self, now):
+        return self.byte_rate * self.decay(now)
+
+    def average_size(self):
+        if self.message_count == 0:
+            return 0
+        return self.payload_bytes / self.message_count
+
+
+def topic_item_id(topic):
+    # Topics starting with / get a "/" first level, otherwise the item ID is the topic itself
+    if topic.startswith("/"):
+        return "/" + topic
+    return topic
+
+
+class TopicTree:
+    def __init__(self):
+        """
+        The topics of the topic browser, level by level.
+
+        nodes maps the item ID of every node to the node, so a known topic is found with a single dictionary lookup
+        and a new one is added with one lookup per level, no matter how many siblings the levels have.
+
+        The last message of each topic is kept on its node. The nodes created and the nodes updated since the last
+        take_changes() are collected, so the Treeview can be brought up to date periodically, with one call per
+        changed row no matter how many messages the topic received in the meantime.
+
+        The tree holds every topic, the Treeview only the children of the expanded nodes, see TopicBrowser.
+
+        Each node counts the messages and payload bytes of its subtree and keeps moving averages of the message and
+        byte rates, updated along the path of the topic, so a message costs O(depth). The root holds the totals.
+        """
+        self.clear()
+
+    def add(self, topic):
+        # (node of the topic, nodes created for it, parents first)
+        item_id = topic_item_id(topic)
+        node = self.nodes.get(item_id)
+        new_nodes = []
+        if node is None:
+            levels = topic.split("/")
+            if topic.startswith("/"):
+                levels[0] = "/"
+            node = self.root
+            for level in levels:
+                child = node.children.get(level)
+                if child is None:
+                    child_id = level if node is self.root else node.item_id + "/" + level
+                    child = TopicNode(level, child_id, node)
+                    node.children[level] = child
+                    self.nodes[child_id] = child
+                    new_nodes.append(child)
+                node = child
+        if not node.is_topic:
+            node.is_topic = True
+            self.topic_count += 1
+        self.new_nodes.extend(new_nodes)
+        return node, new_nodes
+
+    def update(self, topic, qos, retained, timestamp, payload):
+        node = self.add(topic)[0]
+        node.values = (qos, retained, timestamp, payload)
+        self.dirty.add(node)
+        self.record(node, timestamp, len(payload))
+        return node
+
+    @staticmethod
+    def record(node, timestamp, payload_size):
+        # Adds a message to the statistics of node and all of its parents
+        while node is not None:
+            if node.last_seen < timestamp:
+                decay = node.decay(timestamp)
+                node.message_rate *= decay
+                node.byte_rate *= decay
+                node.last_seen = timestamp
+            node.message_rate += 1 / TOPIC_RATE_TIME_CONSTANT
+            node.byte_rate += payload_size / TOPIC_RATE_TIME_CONSTANT
+            node.message_count += 1
+            node.payload_bytes += payload_size
+            node = node.parent
+
+    def shown_branches(self):
+        # Nodes whose children have Treeview items, parents first
+        branches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            branches.append(node)
+            stack.extend(child for child in node.children.values() if child.expanded)
+        return branches
+
+    def take_changes(self):
+        # (nodes created, parents first, set of nodes updated) since the last call
+        new_nodes = self.new_nodes
+        dirty = self.dirty
+        self.new_nodes = []
+        self.dirty = set()
+        return new_nodes, dirty
+
+    def get(self, item_id):
+        return self.nodes.get(item_id)
+
+    @staticmethod
+    def hide_children(node):
+        # Marks the items below node as removed from the Treeview, returns the IDs of the removed placeholders
+        placeholders = []
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            for child in parent.children.values():
+                if child.shown:
+                    child.shown = False
+                    child.expanded = False
+                    if child.placeholder is not None:
+                        placeholders.append(child.placeholder)
+                        child.placeholder = None
+                    stack.append(child)
+        return placeholders
+
+    def clear(self):
+        self.root = TopicNode("", "", None)
+        # The top level items are always in the Treeview
+        self.root.shown = True
+        self.root.expanded = True
+        self.nodes = {}
+        self.topic_count = 0
+        self.new_nodes = []
+        self.dirty = set()
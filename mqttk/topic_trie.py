@@ -0,0 +1,132 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class TopicTrieNode:
+    __slots__ = ("children", "topic_filter", "callbacks", "muted")
+
+    def __init__(self):
+        self.children = {}
+        # Set on the node where a topic filter ends
+        self.topic_filter = None
+        self.callbacks = ()
+        self.muted = False
+
+
+class TopicTrie:
+    def __init__(self):
+        """
+        Subscription topic filters stored level by level, with their message callbacks and mute state.
+
+        matches(topic) walks the trie along the levels of the topic, following the literal, + and # branches, so
+        the cost depends on the depth of the topic rather than the number of subscriptions. Topics starting with $
+        are not matched by wildcards on the first level, as per the MQTT specification.
+
+        Filters are added and removed on the Tk thread while matches() runs on the paho network thread. Callbacks
+        are replaced rather than modified and nodes are only ever looked up by key, so no locking is needed.
+        """
+        self.root = TopicTrieNode()
+        self.nodes = {}
+
+    @staticmethod
+    def validate(topic_filter):
+        if topic_filter == "":
+            raise ValueError("Empty topic filter")
+        levels = topic_filter.split("/")
+        for index, level in enumerate(levels):
+            if "#" in level and (level != "#" or index != len(levels) - 1):
+                raise ValueError("Invalid topic filter {}, # must be the last level on its own".format(topic_filter))
+            if "+" in level and level != "+":
+                raise ValueError("Invalid topic filter {}, + must be on its own on a level".format(topic_filter))
+        return levels
+
+    def add(self, topic_filter, callback):
+        node = self.root
+        for level in self.validate(topic_filter):
+            child = node.children.get(level)
+            if child is None:
+                child = TopicTrieNode()
+                node.children[level] = child
+            node = child
+        node.topic_filter = topic_filter
+        node.callbacks = node.callbacks + (callback,)
+        self.nodes[topic_filter] = node
+
+    def remove(self, topic_filter):
+        node = self.nodes.pop(topic_filter, None)
+        if node is None:
+            return
+        node.callbacks = ()
+        node.muted = False
+        node.topic_filter = None
+        # Prune the branch back to the first node that is still needed
+        path = [self.root]
+        for level in topic_filter.split("/"):
+            path.append(path[-1].children[level])
+        for level, parent, child in zip(reversed(topic_filter.split("/")), reversed(path[:-1]), reversed(path[1:])):
+            if child.children or child.topic_filter is not None:
+                break
+            del parent.children[level]
+
+    def set_muted(self, topic_filter, muted):
+        node = self.nodes.get(topic_filter)
+        if node is not None:
+            node.muted = bool(muted)
+
+    def is_muted(self, topic_filter):
+        node = self.nodes.get(topic_filter)
+        return node is not None and node.muted
+
+    def __contains__(self, topic_filter):
+        return topic_filter in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def matches(self, topic):
+        # Callbacks of every unmuted topic filter matching topic
+        callbacks = []
+        levels = topic.split("/")
+        system_topic = topic.startswith("$")
+        nodes = [self.root]
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            wildcards = depth != 0 or not system_topic
+            for node in nodes:
+                if wildcards:
+                    multi_level = node.children.get("#")
+                    if multi_level is not None and not multi_level.muted:
+                        callbacks.extend(multi_level.callbacks)
+                    single_level = node.children.get("+")
+                    if single_level is not None:
+                        next_nodes.append(single_level)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            if not next_nodes:
+                return callbacks
+            nodes = next_nodes
+        for node in nodes:
+            if not node.muted:
+                callbacks.extend(node.callbacks)
+            # "a/#" matches "a" as well
+            multi_level = node.children.get("#")
+            if multi_level is not None and not multi_level.muted:
+                callbacks.extend(multi_level.callbacks)
+        return callbacks
@@ -1,8 +1,11 @@
 import tkinter as tk
 import tkinter.ttk as ttk
-from mqttk.constants import CONNECT
+from mqttk.constants import CONNECT, COLOURS, SYS_CHART_SPANS, SYS_CHART_REFRESH_INTERVAL
+from mqttk.sys_metrics import SysMetricsStore, RATE_SUFFIX
+from mqttk.widgets.metric_chart import MetricChart
 from functools import partial
 import os
+import time
 import traceback
 
 
@@ -13,6 +16,10 @@ class BrokerStats(ttk.Frame):
         self.root = root
         self.mqtt_manager = None
         self.log = log
+        # Numeric statistics over time, and the ones selected for the chart
+        self.metrics = SysMetricsStore()
+        self.plotted_metrics = []
+        self.chart_scheduled = False
 
         self.header_frame = ttk.Frame(self)
 
@@ -34,6 +41,7 @@ class BrokerStats(ttk.Frame):
         self.broker_stats_frame.pack(fill='both', expand=1)
         self.broker_stats_treeview = ttk.Treeview(self.broker_stats_frame,
                                                   show="tree headings",
+                                                  selectmode="extended",
                                                   columns=('value',))
         self.vertical_scrollbar = ttk.Scrollbar(self.broker_stats_frame, orient="vertical",
                                                 command=self.broker_stats_treeview.yview)
@@ -45,6 +53,25 @@ class BrokerStats(ttk.Frame):
         self.broker_stats_treeview.column('#0', minwidth=300, width=300, stretch=tk.NO)
         self.broker_stats_treeview.heading("value", text="Value")
         self.broker_stats_treeview.column('value', minwidth=200, width=200, stretch=tk.NO)
+        self.broker_stats_treeview.bind("<<TreeviewSelect>>", self.on_metric_select)
+
+        # Chart of the selected statistics
+        self.chart_frame = ttk.Frame(self)
+        self.chart_frame.pack(fill="x", padx=3, pady=3)
+        self.chart_bar_frame = ttk.Frame(self.chart_frame)
+        self.chart_bar_frame.pack(fill="x")
+        self.chart_span_label = ttk.Label(self.chart_bar_frame, text="Chart of the selected statistics, time span")
+        self.chart_span_label.pack(side=tk.LEFT, padx=3, pady=3)
+        self.chart_span_selector = ttk.Combobox(self.chart_bar_frame,
+                                                width=12,
+                                                state="readonly",
+                                                values=[name for name, span in SYS_CHART_SPANS],
+                                                exportselection=False)
+        self.chart_span_selector.current(0)
+        self.chart_span_selector.pack(side=tk.LEFT, padx=3, pady=3)
+        self.chart_span_selector.bind("<<ComboboxSelected>>", lambda event: self.draw_chart())
+        self.chart = MetricChart(self.chart_frame)
+        self.chart.pack(fill="x", expand=1)
 
     def subscribe(self, *args, **kwargs):
         try:
@@ -101,10 +128,47 @@ class BrokerStats(ttk.Frame):
             else:
                 self.broker_stats_treeview.set(topic, "value", payload_decoded)
 
+            updated_metrics = self.metrics.add(topic, msg.timestamp, msg.payload)
+            if len(updated_metrics) == 2:
+                self.show_rate(parent_topic, topic_split[-1], updated_metrics[1])
+            if any(updated_metric in self.plotted_metrics for updated_metric in updated_metrics):
+                self.schedule_chart()
+
         except Exception as e:
             self.log.exception("Exception inserting new message to treeview",
                                os.linesep, msg.topic, msg.payload, os.linesep, e, traceback.format_exc())
 
+    def show_rate(self, parent_topic, name, rate_metric):
+        # Derived rate of a cumulative counter, shown next to the counter
+        value = "{:.2f}".format(self.metrics.get(rate_metric).last_value)
+        if self.broker_stats_treeview.exists(rate_metric):
+            self.broker_stats_treeview.set(rate_metric, "value", value)
+        else:
+            self.broker_stats_treeview.insert(parent_topic, "end", rate_metric, text=name + RATE_SUFFIX, values=(value,))
+
+    def on_metric_select(self, *args, **kwargs):
+        self.plotted_metrics = [item_id for item_id in self.broker_stats_treeview.selection()
+                                if self.metrics.get(item_id) is not None]
+        self.draw_chart()
+
+    def schedule_chart(self):
+        if not self.chart_scheduled:
+            self.chart_scheduled = True
+            self.after(SYS_CHART_REFRESH_INTERVAL, self.draw_chart)
+
+    def draw_chart(self):
+        self.chart_scheduled = False
+        span = SYS_CHART_SPANS[max(0, self.chart_span_selector.current())][1]
+        now = time.time()
+        series = []
+        for index, metric in enumerate(self.plotted_metrics):
+            metric_series = self.metrics.get(metric)
+            if metric_series is None:
+                continue
+            times, values = metric_series.points(span, now)
+            series.append((metric, times, values, COLOURS[index % len(COLOURS)]))
+        self.chart.set_series(series, now - span, now)
+
     def interface_toggle(self, connection_state, mqtt_manager):
         # Subscribe tab items
         self.mqtt_manager = mqtt_manager
@@ -113,3 +177,6 @@ class BrokerStats(ttk.Frame):
     def flush_messages(self):
         for child in self.broker_stats_treeview.get_children():
             self.broker_stats_treeview.delete(child)
+        self.metrics.clear()
+        self.plotted_metrics = []
+        self.draw_chart()
@@ -24,9 +24,17 @@ import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import filedialog
 import json
-from mqttk.helpers import validate_name, clear_combobox_selection, get_clear_combobox_selection_function
+from mqttk.helpers import validate_name, validate_int, clear_combobox_selection, get_clear_combobox_selection_function, \
+    parse_time_string
+from mqttk.capture_archive import query_archive
+from mqttk.replay import ReplayEngine, read_capture
+from mqttk.constants import REPLAY_ORIGINAL_TIMING, REPLAY_FLAT_OUT, ARCHIVE_QUERY_POLL_INTERVAL
+from datetime import datetime
+import time
 from tkinter import messagebox
 from copy import deepcopy
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 
 about_text = "MQTTk is a lightweight, free and open source graphical MQTT\n" \
@@ -146,6 +154,188 @@ class PublishNameDialog(tk.Toplevel):
         self.destroy()
 
 
+class SettingsDialog(tk.Toplevel):
+    def __init__(self, master, title, callback, instructions=None, icon=None):
+        """
+        Base of the small dialogs editing a few whole number settings.
+
+        Subclasses add their rows with add_int_entry() and add_checkbox(), call finish() to add the buttons and
+        implement get_values(). On OK, the dialog is closed and callback is called with the values.
+        """
+        super().__init__(master=master)
+        self.transient(master)
+        self.master = master
+        self.title(title)
+        self.callback = callback
+        self.resizable(False, False)
+        if icon is not None:
+            self.iconphoto(False, icon)
+        self.protocol("WM_DELETE_WINDOW", self.on_destroy)
+        self.bind("<Escape>", self.on_destroy)
+        self.vcmd = (self.register(validate_int),
+                     '%d', '%i', '%P', '%s', '%S', '%v', '%V', '%W')
+
+        self.dialog_frame = ttk.Frame(self)
+        self.dialog_frame.pack(fill='both', expand=1)
+        self.row = 0
+
+        if instructions is not None:
+            self.instruction_text = ttk.Label(self.dialog_frame, text=instructions, anchor='n', justify=tk.CENTER)
+            self.instruction_text.grid(row=self.row, column=0, columnspan=2, padx=10, pady=10)
+            self.row += 1
+
+    def add_int_entry(self, text, value):
+        label = ttk.Label(self.dialog_frame, text=text)
+        label.grid(row=self.row, column=0, sticky="w", padx=10, pady=4)
+        entry = ttk.Entry(self.dialog_frame, validate="key", validatecommand=self.vcmd)
+        entry.insert(0, str(value))
+        entry.grid(row=self.row, column=1, sticky="ew", padx=10, pady=4)
+        self.row += 1
+        return entry
+
+    def add_checkbox(self, text, value):
+        variable = tk.IntVar()
+        variable.set(int(value))
+        checkbox = ttk.Checkbutton(self.dialog_frame, text=text, variable=variable, offvalue=0, onvalue=1)
+        checkbox.grid(row=self.row, column=0, columnspan=2, sticky="w", padx=10, pady=4)
+        self.row += 1
+        return variable
+
+    def finish(self, ok_text="OK"):
+        self.ok_button = ttk.Button(self.dialog_frame, text=ok_text)
+        self.ok_button.grid(row=self.row, column=1, columnspan=2, sticky="e", pady=10, padx=10)
+        self.ok_button["command"] = self.on_save
+        self.cancel_button = ttk.Button(self.dialog_frame, text="Cancel")
+        self.cancel_button.grid(row=self.row, column=0, sticky="w", pady=10, padx=10)
+        self.cancel_button["command"] = self.on_destroy
+
+        self.update()
+        screenwidth = self.winfo_screenwidth()
+        screenheight = self.winfo_screenheight()
+        height = self.winfo_height()
+        width = self.winfo_width()
+        alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
+        self.geometry(alignstr)
+        self.grab_set()
+
+    @staticmethod
+    def get_int(entry, multiplier=1):
+        return int(entry.get() or 0) * multiplier
+
+    def get_values(self):
+        # Arguments of the callback, None keeps the dialog open. Raises ValueError on invalid numbers.
+        raise NotImplementedError
+
+    def on_save(self):
+        try:
+            values = self.get_values()
+        except ValueError:
+            messagebox.showerror("Error", "Please enter whole numbers", parent=self)
+            return
+        if values is None:
+            return
+        self.on_destroy()
+        self.callback(*values)
+
+    def on_destroy(self, *args, **kwargs):
+        self.grab_release()
+        self.destroy()
+
+
+class CaptureLimitsDialog(SettingsDialog):
+    def __init__(self, master, max_messages, max_payload_bytes, spill_to_disk, limits_callback):
+        super().__init__(master,
+                         "Capture limits",
+                         limits_callback,
+                         instructions="The oldest messages are discarded when a limit is reached.\n"
+                                      "Set a limit to 0 to make it unlimited.")
+        self.max_messages_input = self.add_int_entry("Maximum number of messages", max_messages)
+        self.max_payload_input = self.add_int_entry("Maximum total payload size (MB)",
+                                                    max_payload_bytes // (1024 * 1024))
+        self.spill_to_disk = self.add_checkbox("Keep message payloads on disk (only the latest in memory)",
+                                               spill_to_disk)
+        self.finish()
+
+    def get_values(self):
+        return (self.get_int(self.max_messages_input),
+                self.get_int(self.max_payload_input, 1024 * 1024),
+                bool(self.spill_to_disk.get()))
+
+
+class TopicHistoryLimitsDialog(SettingsDialog):
+    def __init__(self, master, length, max_bytes, limits_callback):
+        super().__init__(master,
+                         "Topic history limits",
+                         limits_callback,
+                         instructions="The topic browser keeps the last values of each topic.\n"
+                                      "When the memory limit is reached, the values of the least\n"
+                                      "recently updated or viewed topics are discarded first.\n"
+                                      "Set the memory limit to 0 to make it unlimited.")
+        self.length_input = self.add_int_entry("Values kept per topic", length)
+        self.max_bytes_input = self.add_int_entry("Memory limit (MB)", max_bytes // (1024 * 1024))
+        self.finish()
+
+    def get_values(self):
+        length = self.get_int(self.length_input)
+        max_bytes = self.get_int(self.max_bytes_input, 1024 * 1024)
+        if length < 1:
+            messagebox.showerror("Error", "At least one value has to be kept per topic", parent=self)
+            return None
+        return length, max_bytes
+
+
+class ExportSplitDialog(SettingsDialog):
+    def __init__(self, master, split_size, split_size_callback):
+        super().__init__(master,
+                         "Split exports",
+                         split_size_callback,
+                         instructions="Message exports are split into numbered files of about this size.\n"
+                                      "Set it to 0 to export into a single file.")
+        self.split_size_input = self.add_int_entry("File size (MB)", split_size)
+        self.finish()
+
+    def get_values(self):
+        return self.get_int(self.split_size_input),
+
+
+class CaptureRecordingDialog(SettingsDialog):
+    def __init__(self, master, icon, settings, start_callback):
+        super().__init__(master, "Record capture files", start_callback, icon=icon)
+        self.directory_label = ttk.Label(self.dialog_frame, text="Directory")
+        self.directory_label.grid(row=self.row, column=0, sticky="w", padx=10, pady=4)
+        self.directory_input = ttk.Entry(self.dialog_frame, width=40)
+        self.directory_input.insert(0, settings["directory"])
+        self.directory_input.grid(row=self.row, column=1, sticky="ew", padx=10, pady=4)
+        self.browser_button = ttk.Button(self.dialog_frame, width=3, text="...", command=self.browse_directory)
+        self.browser_button.grid(row=self.row, column=2, padx=10, pady=4)
+        self.row += 1
+
+        self.rotate_size_input = self.add_int_entry("New file after (MB, 0 is never)",
+                                                    settings["rotate_size"] // (1024 * 1024))
+        self.rotate_interval_input = self.add_int_entry("New file after (minutes, 0 is never)",
+                                                        settings["rotate_interval"] // 60)
+        self.compress = self.add_checkbox("Compress capture files", settings["compress"])
+        self.finish(ok_text="Start recording")
+
+    def browse_directory(self):
+        directory = filedialog.askdirectory(initialdir=self.directory_input.get(), parent=self)
+        if directory:
+            self.directory_input.delete(0, tk.END)
+            self.directory_input.insert(0, directory)
+
+    def get_values(self):
+        if not os.path.isdir(self.directory_input.get()):
+            messagebox.showerror("Error", "Directory cannot be found", parent=self)
+            return None
+        settings = {
+            "directory": self.directory_input.get(),
+            "compress": bool(self.compress.get()),
+            "rotate_size": self.get_int(self.rotate_size_input, 1024 * 1024),
+            "rotate_interval": self.get_int(self.rotate_interval_input, 60)
+        }
+        return settings,
+
+
 class SplashScreen(tk.Toplevel):
     def __init__(self, master, splash_icon):
         super().__init__(master=master)
@@ -568,3 +758,309 @@ class SubscribePublishImportExport(tk.Toplevel):
                 self.log.info("Successfully exported publish and subscription history")
                 messagebox.showinfo("Success", "Subscription/publish history exported successfully")
             self.on_destroy()
+
+
+class ArchiveQueryDialog(tk.Toplevel):
+    def __init__(self, master, icon, config_handler, logger, database_file=None):
+        super().__init__(master=master)
+        self.master = master
+        self.title("Query capture archive")
+        self.iconphoto(False, icon)
+        self.config_handler = config_handler
+        self.log = logger
+        self.results = []
+        # Queries run on a worker thread, a query of a large archive can take a while
+        self.query_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_query = None
+
+        self.dialog_frame = ttk.Frame(self)
+        self.dialog_frame.pack(fill="both", expand=1)
+
+        self.browse_frame = ttk.Frame(self.dialog_frame)
+        self.browse_frame.pack(fill="x", padx=4, pady=4)
+        self.browse_label = ttk.Label(self.browse_frame, text="Archive")
+        self.browse_label.pack(side=tk.LEFT, padx=2, pady=4)
+        self.file_input = ttk.Entry(self.browse_frame, width=60)
+        self.file_input.pack(side=tk.LEFT, padx=2, fill="x", expand=1)
+        if database_file is not None:
+            self.file_input.insert(0, database_file)
+        self.browser_button = ttk.Button(self.browse_frame, width=3, text="...", command=self.browse_file)
+        self.browser_button.pack(side=tk.LEFT, padx=2, pady=2)
+
+        self.query_frame = ttk.Frame(self.dialog_frame)
+        self.query_frame.pack(fill="x", padx=4, pady=4)
+        self.topic_filter_label = ttk.Label(self.query_frame, text="Topic filter")
+        self.topic_filter_label.grid(row=0, column=0, sticky="w", padx=2, pady=2)
+        self.topic_filter_input = ttk.Entry(self.query_frame, width=40)
+        self.topic_filter_input.grid(row=0, column=1, sticky="ew", padx=2, pady=2)
+        self.subscription_pattern_label = ttk.Label(self.query_frame, text="Subscription pattern")
+        self.subscription_pattern_label.grid(row=0, column=2, sticky="w", padx=2, pady=2)
+        self.subscription_pattern_input = ttk.Entry(self.query_frame, width=30)
+        self.subscription_pattern_input.grid(row=0, column=3, sticky="ew", padx=2, pady=2)
+        self.start_label = ttk.Label(self.query_frame, text="From")
+        self.start_label.grid(row=1, column=0, sticky="w", padx=2, pady=2)
+        self.start_input = ttk.Entry(self.query_frame, width=40)
+        self.start_input.grid(row=1, column=1, sticky="ew", padx=2, pady=2)
+        self.end_label = ttk.Label(self.query_frame, text="To")
+        self.end_label.grid(row=1, column=2, sticky="w", padx=2, pady=2)
+        self.end_input = ttk.Entry(self.query_frame, width=30)
+        self.end_input.grid(row=1, column=3, sticky="ew", padx=2, pady=2)
+        self.time_format_label = ttk.Label(self.query_frame,
+                                           text="Times as YYYY/MM/DD HH:MM:SS or HH:MM:SS for today, empty for no limit")
+        self.time_format_label.grid(row=2, column=0, columnspan=3, sticky="w", padx=2, pady=2)
+        self.query_button = ttk.Button(self.query_frame, text="Query", command=self.on_query)
+        self.query_button.grid(row=2, column=3, sticky="e", padx=2, pady=2)
+        self.bind("<Return>", self.on_query)
+
+        self.result_label = ttk.Label(self.dialog_frame)
+        self.result_label.pack(fill="x", padx=4)
+
+        self.result_frame = ttk.Frame(self.dialog_frame)
+        self.result_frame.pack(fill="both", expand=1, padx=4, pady=4)
+        self.result_treeview = ttk.Treeview(self.result_frame,
+                                            columns=("time", "topic", "qos", "retained"),
+                                            show="headings",
+                                            selectmode="browse")
+        self.result_treeview.heading("time", text="Time")
+        self.result_treeview.column("time", minwidth=200, width=200, stretch=tk.NO)
+        self.result_treeview.heading("topic", text="Topic")
+        self.result_treeview.column("topic", minwidth=300, width=500)
+        self.result_treeview.heading("qos", text="QoS")
+        self.result_treeview.column("qos", minwidth=50, width=50, stretch=tk.NO)
+        self.result_treeview.heading("retained", text="Retained")
+        self.result_treeview.column("retained", minwidth=70, width=80, stretch=tk.NO)
+        self.result_scrollbar = ttk.Scrollbar(self.result_frame, orient="vertical", command=self.result_treeview.yview)
+        self.result_scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.result_treeview.configure(yscrollcommand=self.result_scrollbar.set)
+        self.result_treeview.pack(fill="both", expand=1)
+        self.result_treeview.bind("<<TreeviewSelect>>", self.on_result_select)
+
+        self.payload_text = tk.Text(self.dialog_frame, height=10, background="white", foreground="black",
+                                    state="disabled", exportselection=False)
+        self.payload_text.pack(fill="both", padx=4, pady=4)
+
+        width = 1000
+        height = 700
+        screenwidth = self.winfo_screenwidth()
+        screenheight = self.winfo_screenheight()
+        alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
+        self.geometry(alignstr)
+        self.protocol("WM_DELETE_WINDOW", self.on_destroy)
+        self.bind("<Escape>", self.on_destroy)
+
+    def browse_file(self):
+        file_path_name = filedialog.askopenfilename(initialdir=self.config_handler.get_last_used_directory(),
+                                                    title="Open capture archive")
+        if file_path_name == "":
+            self.log.warning("Empty file name when browsing for capture archive. Maybe the cancel button was pressed?")
+            return
+        self.config_handler.save_last_used_directory(file_path_name)
+        self.file_input.delete(0, tk.END)
+        self.file_input.insert(0, file_path_name)
+
+    def on_query(self, *args, **kwargs):
+        if self.pending_query is not None:
+            return
+        database_file = self.file_input.get()
+        if not os.path.isfile(database_file):
+            messagebox.showerror("Error", "Archive file cannot be found", parent=self)
+            return
+        try:
+            start = parse_time_string(self.start_input.get())
+            end = parse_time_string(self.end_input.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self)
+            return
+        query_start = time.time()
+        self.pending_query = self.query_executor.submit(query_archive,
+                                                        database_file,
+                                                        topic_filter=self.topic_filter_input.get().strip(),
+                                                        subscription_pattern=self.subscription_pattern_input.get().strip(),
+                                                        start=start,
+                                                        end=end)
+        self.query_button["state"] = "disabled"
+        self.result_label["text"] = "Querying..."
+        self.after(ARCHIVE_QUERY_POLL_INTERVAL, self.poll_query, self.pending_query, query_start)
+
+    def poll_query(self, future, query_start):
+        if future is not self.pending_query:
+            return
+        if not future.done():
+            self.after(ARCHIVE_QUERY_POLL_INTERVAL, self.poll_query, future, query_start)
+            return
+        self.pending_query = None
+        self.query_button["state"] = "normal"
+        try:
+            self.results = future.result()
+        except Exception as e:
+            self.result_label["text"] = ""
+            self.log.exception("Failed to query capture archive", e, traceback.format_exc())
+            messagebox.showerror("Error", "Failed to query archive: {}".format(e), parent=self)
+            return
+        self.result_label["text"] = "{} messages found in {:.1f} ms".format(len(self.results),
+                                                                          (time.time() - query_start) * 1000)
+        self.result_treeview.delete(*self.result_treeview.get_children())
+        for index, result in enumerate(self.results):
+            self.result_treeview.insert("", "end", str(index), values=(
+                datetime.fromtimestamp(result[1]).strftime("%Y/%m/%d %H:%M:%S.%f"),
+                result[2],
+                result[4],
+                "RETAINED" if result[5] else ""))
+
+    def on_result_select(self, *args, **kwargs):
+        try:
+            result = self.results[int(self.result_treeview.selection()[0])]
+        except Exception:
+            return
+        payload = result[6]
+        try:
+            payload = payload.decode("utf-8")
+        except Exception:
+            pass
+        self.payload_text.configure(state="normal")
+        self.payload_text.delete(1.0, tk.END)
+        self.payload_text.insert(1.0, payload)
+        self.payload_text.configure(state="disabled")
+
+    def on_destroy(self, *args, **kwargs):
+        # A running query can't be interrupted, its result is dropped
+        self.pending_query = None
+        self.query_executor.shutdown(wait=False)
+        self.destroy()
+
+
+class ReplayDialog(tk.Toplevel):
+    def __init__(self, master, icon, config_handler, logger, get_mqtt_manager):
+        super().__init__(master=master)
+        self.master = master
+        self.title("Replay capture to broker")
+        self.resizable(False, False)
+        self.iconphoto(False, icon)
+        self.config_handler = config_handler
+        self.log = logger
+        self.get_mqtt_manager = get_mqtt_manager
+        self.replay_engine = None
+
+        self.dialog_frame = ttk.Frame(self)
+        self.dialog_frame.pack(fill="both", expand=1, padx=4, pady=4)
+
+        self.file_label = ttk.Label(self.dialog_frame, text="Capture file or JSON export")
+        self.file_label.grid(row=0, column=0, sticky="w", padx=4, pady=4)
+        self.file_input = ttk.Entry(self.dialog_frame, width=50)
+        self.file_input.grid(row=0, column=1, columnspan=2, sticky="ew", padx=2, pady=4)
+        self.browser_button = ttk.Button(self.dialog_frame, width=3, text="...", command=self.browse_file)
+        self.browser_button.grid(row=0, column=3, padx=4, pady=4)
+
+        self.mode = tk.StringVar()
+        self.mode.set(REPLAY_ORIGINAL_TIMING)
+        self.original_timing_radiobutton = ttk.Radiobutton(self.dialog_frame,
+                                                           text="Original timing, speed factor",
+                                                           variable=self.mode,
+                                                           value=REPLAY_ORIGINAL_TIMING)
+        self.original_timing_radiobutton.grid(row=1, column=0, sticky="w", padx=4, pady=4)
+        self.speed_input = ttk.Entry(self.dialog_frame, width=10)
+        self.speed_input.insert(0, "1.0")
+        self.speed_input.grid(row=1, column=1, sticky="w", padx=2, pady=4)
+
+        self.flat_out_radiobutton = ttk.Radiobutton(self.dialog_frame,
+                                                    text="Flat out, messages/s limit (0 is unlimited)",
+                                                    variable=self.mode,
+                                                    value=REPLAY_FLAT_OUT)
+        self.flat_out_radiobutton.grid(row=2, column=0, sticky="w", padx=4, pady=4)
+        self.rate_limit_input = ttk.Entry(self.dialog_frame, width=10)
+        self.rate_limit_input.insert(0, "0")
+        self.rate_limit_input.grid(row=2, column=1, sticky="w", padx=2, pady=4)
+
+        self.keep_retained = tk.IntVar()
+        self.keep_retained_checkbox = ttk.Checkbutton(self.dialog_frame,
+                                                      text="Publish with the original retained flags",
+                                                      variable=self.keep_retained,
+                                                      offvalue=0,
+                                                      onvalue=1)
+        self.keep_retained_checkbox.grid(row=3, column=0, columnspan=2, sticky="w", padx=4, pady=4)
+
+        self.status_label = ttk.Label(self.dialog_frame, width=70)
+        self.status_label.grid(row=4, column=0, columnspan=4, sticky="w", padx=4, pady=4)
+
+        self.start_button = ttk.Button(self.dialog_frame, text="Start", command=self.on_start)
+        self.start_button.grid(row=5, column=3, sticky="e", padx=4, pady=4)
+        self.stop_button = ttk.Button(self.dialog_frame, text="Stop", command=self.on_stop, state="disabled")
+        self.stop_button.grid(row=5, column=2, sticky="e", padx=4, pady=4)
+
+        self.update()
+        screenwidth = self.winfo_screenwidth()
+        screenheight = self.winfo_screenheight()
+        height = self.winfo_height()
+        width = self.winfo_width()
+        alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
+        self.geometry(alignstr)
+        self.protocol("WM_DELETE_WINDOW", self.on_destroy)
+        self.bind("<Escape>", self.on_destroy)
+
+    def browse_file(self):
+        file_path_name = filedialog.askopenfilename(initialdir=self.config_handler.get_last_used_directory(),
+                                                    title="Open capture to replay",
+                                                    parent=self)
+        if file_path_name == "":
+            self.log.warning("Empty file name when browsing for capture to replay. Maybe the cancel button was pressed?")
+            return
+        self.config_handler.save_last_used_directory(file_path_name)
+        self.file_input.delete(0, tk.END)
+        self.file_input.insert(0, file_path_name)
+
+    def on_start(self):
+        mqtt_manager = self.get_mqtt_manager()
+        if mqtt_manager is None:
+            messagebox.showerror("Error", "Please connect to a broker first", parent=self)
+            return
+        if not os.path.isfile(self.file_input.get()):
+            messagebox.showerror("Error", "Capture file cannot be found", parent=self)
+            return
+        try:
+            speed = float(self.speed_input.get())
+            rate_limit = float(self.rate_limit_input.get() or 0)
+        except ValueError:
+            messagebox.showerror("Error", "Invalid speed factor or rate limit", parent=self)
+            return
+        publish_function = partial(mqtt_manager.publish, log=False)
+        self.replay_engine = ReplayEngine(read_capture(self.file_input.get()),
+                                          publish_function,
+                                          mode=self.mode.get(),
+                                          speed=speed,
+                                          rate_limit=rate_limit,
+                                          keep_retained=bool(self.keep_retained.get()))
+        self.log.info("Replaying", self.file_input.get())
+        self.replay_engine.start()
+        self.start_button["state"] = "disabled"
+        self.stop_button["state"] = "normal"
+        self.update_status()
+
+    def on_stop(self):
+        if self.replay_engine is not None:
+            self.replay_engine.stop()
+
+    def update_status(self):
+        if self.replay_engine is None or not self.winfo_exists():
+            return
+        status = "Sent {} messages in {:.1f} s, {:.1f} msg/s".format(self.replay_engine.sent,
+                                                                     self.replay_engine.elapsed(),
+                                                                     self.replay_engine.achieved_rate())
+        if self.replay_engine.target_rate:
+            status += " (target {:.1f} msg/s, {:.1f} ms behind)".format(self.replay_engine.target_rate,
+                                                                       self.replay_engine.lag * 1000)
+        if self.replay_engine.running():
+            self.after(250, self.update_status)
+        else:
+            if self.replay_engine.error is not None:
+                self.log.error("Replay failed", self.replay_engine.error)
+                status += " - failed: {}".format(self.replay_engine.error)
+            else:
+                status += " - finished"
+                self.log.info("Replay finished,", self.replay_engine.sent, "messages sent")
+            self.start_button["state"] = "normal"
+            self.stop_button["state"] = "disabled"
+        self.status_label["text"] = status
+
+    def on_destroy(self, *args, **kwargs):
+        self.on_stop()
+        self.destroy()
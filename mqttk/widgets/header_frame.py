@@ -46,6 +46,16 @@ class HeaderFrame(ttk.Frame):
 
         self.connection_indicator = tk.Label(self, text="DISCONNECTED", bg="#ff6b6b")
         self.connection_indicator.pack(side=tk.RIGHT, padx=5, pady=5)
+        self.queue_stats_label = ttk.Label(self)
+        self.queue_stats_label.pack(side=tk.RIGHT, padx=5, pady=5)
+        # Progress of background operations, only visible while one is running
+        self.progress_frame = ttk.Frame(self)
+        self.progress_label = ttk.Label(self.progress_frame)
+        self.progress_label.pack(side=tk.LEFT, padx=3)
+        self.progress_bar = ttk.Progressbar(self.progress_frame, orient="horizontal", length=150, maximum=1.0)
+        self.progress_bar.pack(side=tk.LEFT, padx=3)
+        self.progress_cancel_button = ttk.Button(self.progress_frame, text="Cancel", width=7)
+        self.progress_cancel_button.pack(side=tk.LEFT, padx=3)
         self.connection_error_notification = ttk.Label(self, foreground='red')
         self.connection_error_notification.pack(side=tk.RIGHT, expand=1, fill='x')
 
@@ -58,3 +68,23 @@ class HeaderFrame(ttk.Frame):
     def connection_indicator_toggle(self, connection_state):
         self.connection_indicator.configure(text='CONNECTED' if connection_state == CONNECT else "DISCONNECTED",
                                             bg="#76ff61" if connection_state == CONNECT else "#ff6b6b")
+
+    def update_queue_stats(self, depth, dropped, archive_dropped=None, capture_dropped=None):
+        # archive_dropped and capture_dropped are None while no capture archive or capture files are recorded
+        text = "Queued: {} Dropped: {}".format(depth, dropped)
+        if archive_dropped is not None:
+            text += " Archive dropped: {}".format(archive_dropped)
+        if capture_dropped is not None:
+            text += " Capture dropped: {}".format(capture_dropped)
+        self.queue_stats_label["text"] = text
+
+    def show_progress(self, text, fraction, cancel_callback=None):
+        if not self.progress_frame.winfo_ismapped():
+            self.progress_frame.pack(side=tk.RIGHT, padx=5, pady=5)
+        self.progress_label["text"] = text
+        self.progress_bar["value"] = fraction
+        self.progress_cancel_button["command"] = cancel_callback or ""
+        self.progress_cancel_button["state"] = "normal" if cancel_callback is not None else "disabled"
+
+    def hide_progress(self):
+        self.progress_frame.pack_forget()
@@ -0,0 +1,116 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import tkinter as tk
+import tkinter.ttk as ttk
+import tkinter.font as tkfont
+import platform
+
+from mqttk.hex_printer import hex_header, hex_row_count, format_hex_rows
+
+# Lines above the rows, the column header and an empty line
+HEADER_LINES = 2
+
+
+class HexView(ttk.Frame):
+    def __init__(self, master, chunk_size=16, font="TkFixedFont", **kwargs):
+        """
+        Hex dump viewer that only formats the rows in view.
+
+        The Text widget holds the column header and the visible rows only, scrolling formats the next range of rows
+        with format_hex_rows(), so the cost of showing or scrolling doesn't depend on the size of the data.
+        """
+        super().__init__(master)
+        self.chunk_size = chunk_size
+        self.data = b""
+        self.first_row = 0
+        self.font = tkfont.Font(font=font)
+
+        self.vertical_scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.vertical_scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.horizontal_scrollbar = ttk.Scrollbar(self, orient="horizontal")
+        self.horizontal_scrollbar.pack(side=tk.BOTTOM, fill="x")
+        self.text = tk.Text(self, wrap="none", font=self.font, exportselection=False, highlightthickness=0,
+                            xscrollcommand=self.horizontal_scrollbar.set, **kwargs)
+        self.text.pack(side=tk.LEFT, fill="both", expand=True)
+        self.horizontal_scrollbar["command"] = self.text.xview
+        self.text.configure(state="disabled")
+
+        self.text.bind("<Configure>", lambda event: self.render())
+        self.text.bind("<Up>", lambda event: self.scroll_rows(-1))
+        self.text.bind("<Down>", lambda event: self.scroll_rows(1))
+        self.text.bind("<Prior>", lambda event: self.scroll_rows(-self.visible_rows()))
+        self.text.bind("<Next>", lambda event: self.scroll_rows(self.visible_rows()))
+        self.text.bind("<Home>", lambda event: self.scroll_rows(-self.row_count()))
+        self.text.bind("<End>", lambda event: self.scroll_rows(self.row_count()))
+        if platform.system() == "Linux":
+            self.text.bind("<Button-4>", self.on_mouse_wheel)
+            self.text.bind("<Button-5>", self.on_mouse_wheel)
+        else:
+            self.text.bind("<MouseWheel>", self.on_mouse_wheel)
+
+    def set_data(self, data):
+        self.data = data
+        self.first_row = 0
+        self.render()
+
+    def row_count(self):
+        return hex_row_count(self.data, self.chunk_size)
+
+    def visible_rows(self):
+        return max(1, self.text.winfo_height() // self.font.metrics("linespace") - HEADER_LINES)
+
+    def scroll_rows(self, step):
+        self.first_row += step
+        self.render()
+        return "break"
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * self.row_count())
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_rows()
+            self.first_row += step
+        self.render()
+
+    def on_mouse_wheel(self, event):
+        if platform.system() == 'Windows':
+            return self.scroll_rows(int(-1 * (event.delta / 120)) * 3)
+        elif platform.system() == 'Darwin':
+            return self.scroll_rows(int(-1 * event.delta))
+        elif event.num == 4:
+            return self.scroll_rows(-3)
+        return self.scroll_rows(3)
+
+    def render(self):
+        row_count = self.row_count()
+        visible_rows = self.visible_rows()
+        self.first_row = max(0, min(self.first_row, row_count - visible_rows))
+        rows = format_hex_rows(self.data, self.first_row, visible_rows, self.chunk_size)
+        self.text.configure(state="normal")
+        self.text.delete(1.0, tk.END)
+        self.text.insert(1.0, hex_header(self.chunk_size) + "\n\n" + "\n".join(rows))
+        self.text.configure(state="disabled")
+        if row_count == 0:
+            self.vertical_scrollbar.set(0.0, 1.0)
+        else:
+            self.vertical_scrollbar.set(self.first_row / row_count,
+                                        min(row_count, self.first_row + visible_rows) / row_count)
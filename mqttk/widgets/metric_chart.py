@@ -0,0 +1,94 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import tkinter as tk
+import tkinter.ttk as ttk
+from datetime import datetime
+
+MARGIN = 10
+LEGEND_LINE = 16
+TIME_LABELS = 20
+
+
+class MetricChart(ttk.Frame):
+    def __init__(self, master, height=220, **kwargs):
+        """
+        Line chart of time series on a Canvas.
+
+        set_series() takes (name, times, values, colour) tuples, each series is scaled to its own range, the legend
+        shows the latest, lowest and highest value of each.
+        """
+        super().__init__(master)
+        self.canvas = tk.Canvas(self, height=height, background="white", highlightthickness=0, **kwargs)
+        self.canvas.pack(fill="both", expand=True)
+        self.series = []
+        self.start = 0
+        self.end = 0
+        self.canvas.bind("<Configure>", lambda event: self.draw())
+
+    def set_series(self, series, start, end):
+        self.series = series
+        self.start = start
+        self.end = end
+        self.draw()
+
+    def draw(self):
+        canvas = self.canvas
+        canvas.delete("all")
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        if len(self.series) == 0:
+            canvas.create_text(width / 2, height / 2, text="Select numeric statistics to plot them", fill="grey")
+            return
+
+        left = MARGIN
+        right = width - MARGIN
+        top = MARGIN + LEGEND_LINE * len(self.series)
+        bottom = height - TIME_LABELS
+        if right <= left or bottom <= top or self.end <= self.start:
+            return
+        canvas.create_rectangle(left, top, right, bottom, outline="grey")
+        canvas.create_text(left, bottom + 2, anchor="nw", fill="grey",
+                           text=datetime.fromtimestamp(self.start).strftime("%H:%M:%S"))
+        canvas.create_text(right, bottom + 2, anchor="ne", fill="grey",
+                           text=datetime.fromtimestamp(self.end).strftime("%H:%M:%S"))
+
+        x_scale = (right - left) / (self.end - self.start)
+        for index, (name, times, values, colour) in enumerate(self.series):
+            if len(values) == 0:
+                canvas.create_text(left, MARGIN + LEGEND_LINE * index, anchor="nw", fill=colour,
+                                   text="{}: no data in this time span".format(name))
+                continue
+            lowest = min(values)
+            highest = max(values)
+            canvas.create_text(left, MARGIN + LEGEND_LINE * index, anchor="nw", fill=colour,
+                               text="{}: {:.6g} (min {:.6g}, max {:.6g})".format(name, values[-1], lowest, highest))
+            y_scale = (bottom - top) / (highest - lowest) if lowest < highest else 0
+            coordinates = []
+            for timestamp, value in zip(times, values):
+                coordinates.append(left + (timestamp - self.start) * x_scale)
+                if y_scale:
+                    coordinates.append(bottom - (value - lowest) * y_scale)
+                else:
+                    coordinates.append((top + bottom) / 2)
+            if len(coordinates) == 2:
+                x, y = coordinates
+                canvas.create_oval(x - 2, y - 2, x + 2, y + 2, fill=colour, outline=colour)
+            else:
+                canvas.create_line(*coordinates, fill=colour, width=2)
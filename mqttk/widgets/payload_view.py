@@ -0,0 +1,169 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import tkinter as tk
+import tkinter.ttk as ttk
+
+from mqttk.widgets.scrolled_text import CustomScrolledText
+from mqttk.constants import PAYLOAD_VIEW_INITIAL_CHARS, PAYLOAD_VIEW_LOAD_MORE_CHARS, PAYLOAD_VIEW_CHUNK, \
+    PAYLOAD_VIEW_MAX_LINE, DECODE_POLL_INTERVAL
+
+
+class PayloadView(ttk.Frame):
+    def __init__(self, master, **kwargs):
+        """
+        Payload box that streams its content in chunks.
+
+        The content comes from a source (TextSource or PayloadRenderTask) and is inserted PAYLOAD_VIEW_CHUNK
+        characters per mainloop iteration. Only the first PAYLOAD_VIEW_INITIAL_CHARS characters are shown until
+        "Load more" is pressed, and lines longer than PAYLOAD_VIEW_MAX_LINE characters are split. The line breaks
+        added for that are tagged and left out when the selection is copied.
+        """
+        super().__init__(master)
+        self.status_frame = ttk.Frame(self)
+        self.status_label = ttk.Label(self.status_frame)
+        self.status_label.pack(side=tk.LEFT, padx=3, pady=3)
+        self.load_more_button = ttk.Button(self.status_frame, text="Load more", command=self.load_more)
+        self.load_more_button.pack(side=tk.LEFT, padx=3, pady=3)
+        self.status_frame.pack(side=tk.BOTTOM, fill="x")
+        self.text = CustomScrolledText(self, **kwargs)
+        self.text.pack(side=tk.TOP, fill="both", expand=True)
+        self.text.configure(state="disabled")
+        self.text.bind("<<Copy>>", self.copy_selection)
+
+        self.source = None
+        self.limit = 0
+        self.inserted = 0
+        self.line_length = 0
+        self.lines_split = False
+        self.pump_scheduled = False
+        self.set_status(None)
+
+    def set_status(self, text, load_more=False):
+        self.status_label["text"] = text or ""
+        self.load_more_button["state"] = "normal" if load_more else "disabled"
+        if text is None:
+            self.status_frame.pack_forget()
+        else:
+            self.status_frame.pack(side=tk.BOTTOM, fill="x", before=self.text.frame)
+
+    def clear(self):
+        if self.source is not None:
+            self.source.cancel()
+            self.source = None
+        self.inserted = 0
+        self.line_length = 0
+        self.lines_split = False
+        self.text.configure(state="normal")
+        self.text.delete(1.0, tk.END)
+        self.text.configure(state="disabled")
+        self.set_status(None)
+
+    def show(self, source):
+        self.clear()
+        self.source = source
+        self.limit = PAYLOAD_VIEW_INITIAL_CHARS
+        source.request(self.limit)
+        self.pump()
+
+    def load_more(self):
+        if self.source is None:
+            return
+        self.limit += PAYLOAD_VIEW_LOAD_MORE_CHARS
+        self.source.request(self.limit)
+        self.schedule_pump(1)
+
+    def schedule_pump(self, delay):
+        if not self.pump_scheduled:
+            self.pump_scheduled = True
+            self.after(delay, self.on_pump)
+
+    def on_pump(self):
+        self.pump_scheduled = False
+        self.pump()
+
+    def pump(self):
+        source = self.source
+        if source is None:
+            return
+        text = source.read(min(PAYLOAD_VIEW_CHUNK, self.limit - self.inserted))
+        if text:
+            self.insert_text(text)
+        if source.error is not None:
+            self.source = None
+            self.set_status("Failed to decode payload: {}".format(source.error))
+        elif source.exhausted():
+            self.source = None
+            if self.lines_split:
+                self.set_status("Lines longer than {} characters are shown wrapped".format(PAYLOAD_VIEW_MAX_LINE))
+            else:
+                self.set_status(None)
+        elif self.limit <= self.inserted:
+            self.set_status("Showing the first {:.1f} MB of the payload".format(self.inserted / (1024 * 1024)),
+                            load_more=True)
+        elif text:
+            self.schedule_pump(1)
+        else:
+            self.set_status("Decoding {:.1f} MB payload... {:.0f}%".format(source.size / (1024 * 1024),
+                                                                           100 * source.progress))
+            self.schedule_pump(DECODE_POLL_INTERVAL)
+
+    def insert_text(self, text):
+        # Lines are split where they exceed PAYLOAD_VIEW_MAX_LINE, across chunk boundaries too. The inserted line
+        # breaks get the "split" tag, the arguments of Text.insert() alternate between text and tags.
+        arguments = []
+        pieces = []
+        for index, line in enumerate(text.split("\n")):
+            if index != 0:
+                pieces.append("\n")
+                self.line_length = 0
+            while PAYLOAD_VIEW_MAX_LINE < self.line_length + len(line):
+                cut = PAYLOAD_VIEW_MAX_LINE - self.line_length
+                pieces.append(line[:cut])
+                arguments += ["".join(pieces), (), "\n", ("split",)]
+                pieces = []
+                line = line[cut:]
+                self.line_length = 0
+                self.lines_split = True
+            pieces.append(line)
+            self.line_length += len(line)
+        arguments += ["".join(pieces), ()]
+        self.inserted += len(text)
+        self.text.configure(state="normal")
+        self.text.insert(tk.END, *arguments)
+        self.text.configure(state="disabled")
+
+    def copy_selection(self, *args, **kwargs):
+        # Copies the selected part of the payload as it was received, without the line breaks added by the split
+        try:
+            position = self.text.index(tk.SEL_FIRST)
+            last = self.text.index(tk.SEL_LAST)
+        except tk.TclError:
+            return "break"
+        pieces = []
+        while True:
+            split_range = self.text.tag_nextrange("split", position, last)
+            if not split_range:
+                break
+            pieces.append(self.text.get(position, split_range[0]))
+            position = split_range[1]
+        pieces.append(self.text.get(position, last))
+        self.clipboard_clear()
+        self.clipboard_append("".join(pieces))
+        return "break"
@@ -20,40 +20,31 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter.colorchooser import askcolor
-import base64
-import json
-from os import linesep
+from tkinter import messagebox
 import traceback
 from functools import partial
-import time
 from datetime import datetime
-import zlib
-from bz2 import decompress
+from concurrent.futures import ThreadPoolExecutor
+import re
+from array import array
+from bisect import bisect_left
 from multiprocessing import Lock
-from copy import deepcopy
 
 from mqttk.widgets.scroll_frame import ScrollFrame
-from mqttk.widgets.scrolled_text import CustomScrolledText
-from mqttk.constants import CONNECT, DECODER_OPTIONS, COLOURS
-from mqttk.hex_printer import hex_viewer
-from mqttk.helpers import get_clear_combobox_selection_function, clear_combobox_selection
-
-ZLIB_TAG0 = chr(0x78)
-ZLIB_TAG1 = (chr(0x01), chr(0x5E), chr(0x9C), chr(0xDA))
-
-
-def decompress_message(message_data):
-    try:
-        return zlib.decompress(message_data)
-    except Exception:
-        pass
-
-    try:
-        return decompress(message_data)
-    except Exception:
-        pass
-
-    return message_data
+from mqttk.widgets.payload_view import PayloadView
+from mqttk.widgets.virtual_list import VirtualListbox
+from mqttk.widgets.hex_view import HexView
+from mqttk.widgets.dialogs import CaptureLimitsDialog
+from mqttk.message_store import MessageStore
+from mqttk.message_search import SearchQuery, SearchTask, SearchWorkers
+from mqttk.render_cache import RenderCache
+from mqttk.payload_renderer import render_payload, PayloadRenderTask, TextSource
+from mqttk.compression import CodecCache, DecompressionLimitExceeded
+from mqttk.constants import CONNECT, DECODER_OPTIONS, COLOURS, RENDER_INTERVAL, SEARCH_POLL_INTERVAL, \
+    AUTOSCROLL_DETAILS_INTERVAL, DECODE_INLINE_BYTES, DECODE_WORKERS, PAYLOAD_VIEW_INITIAL_CHARS, DECODE_POLL_INTERVAL, \
+    DECOMPRESS_MAX_BYTES
+from mqttk.helpers import get_clear_combobox_selection_function, clear_combobox_selection, parse_time_string, \
+    format_size
 
 
 class SubscriptionFrame(ttk.Frame):
@@ -129,24 +120,31 @@ class SubscribeTab(ttk.Frame):
         self.color_carousel = -1
         self.current_connection = None
         self.last_connection = None
-        self.exporting = False
-        # Holds messages and relevant stuff
-        # {
-        #     "id": {
-        #         "topic": "message topic",
-        #         "subscription_pattern": "subscription pattern",
-        #         "timestamp": "date of reception timestamp or date string whatever",
-        #         "qos": "message qos",
-        #         "payload": "message content",
-        #         "message_list_instance_ref": message list object reference
-        #     }
-        #
-        # }
-        self.messages = {}
-
-        self.mute_patterns = []
+        # Holds messages and relevant stuff, see MessageStore
+        self.message_store = MessageStore(*self.config_handler.get_message_store_limits())
+        # Evictions already applied to the message list
+        self.listed_evictions = 0
+        # Archives/capture files recording every message added to the store, see CaptureArchive.add
+        self.recorders = []
+
         self.mqtt_manager = None
-        self.message_id_counter = 0
+        # Subscription pattern colours, the message list looks them up when a row is drawn
+        self.pattern_colours = {}
+        self.render_scheduled = False
+        # Rendered payloads by (message ID, decoder, decompress flag)
+        self.render_cache = RenderCache()
+        # Compression codec of the payloads of each topic
+        self.codec_cache = CodecCache()
+        self.details_scheduled = False
+        # Large payloads are decompressed and rendered on a worker thread, only the one of the selected message
+        self.render_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+        # PayloadRenderTask or future decompressing the payload of the selected message in the background
+        self.pending_payload = None
+        # Search results shown in the message list instead of every message, None when no search is applied
+        self.search_query = None
+        self.view_ids = None
+        self.search_task = None
+        self.search_workers = SearchWorkers()
 
         background_colour = root_style.lookup("TLabel", "background")
         foreground_colour = root_style.lookup("TLabel", "foreground")
@@ -177,6 +175,59 @@ class SubscribeTab(ttk.Frame):
                                                    offvalue=0,
                                                    onvalue=1)
         self.autoscroll_checkbox.pack(side=tk.RIGHT, padx=3)
+        # Capture limits button
+        self.capture_limits_button = ttk.Button(self.subscribe_bar_frame, text="Capture limits")
+        self.capture_limits_button.pack(side=tk.RIGHT, padx=3)
+        self.capture_limits_button["command"] = self.on_capture_limits
+        # Message store statistics
+        self.store_stats_label = ttk.Label(self.subscribe_bar_frame)
+        self.store_stats_label.pack(side=tk.RIGHT, padx=3)
+
+        # Search bar
+        self.search_bar_frame = ttk.Frame(self, height=1)
+        self.search_bar_frame.pack(anchor="nw", side=tk.TOP, fill=tk.X)
+        ttk.Label(self.search_bar_frame, text="Topic").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_topic_entry = ttk.Entry(self.search_bar_frame, width=25)
+        self.search_topic_entry.pack(side=tk.LEFT, padx=3, pady=3)
+        ttk.Label(self.search_bar_frame, text="Payload").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_payload_entry = ttk.Entry(self.search_bar_frame, width=25)
+        self.search_payload_entry.pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_regex_state = tk.IntVar()
+        self.search_regex_checkbox = ttk.Checkbutton(self.search_bar_frame,
+                                                     text="Regex",
+                                                     variable=self.search_regex_state,
+                                                     offvalue=0,
+                                                     onvalue=1)
+        self.search_regex_checkbox.pack(side=tk.LEFT, padx=3)
+        ttk.Label(self.search_bar_frame, text="QoS").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_qos_selector = ttk.Combobox(self.search_bar_frame, width=4, state="readonly",
+                                                values=["Any", "0", "1", "2"], exportselection=False)
+        self.search_qos_selector.current(0)
+        self.search_qos_selector.bind("<<ComboboxSelected>>",
+                                      get_clear_combobox_selection_function(self.search_qos_selector))
+        self.search_qos_selector.pack(side=tk.LEFT, padx=3, pady=3)
+        ttk.Label(self.search_bar_frame, text="Retained").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_retained_selector = ttk.Combobox(self.search_bar_frame, width=4, state="readonly",
+                                                     values=["Any", "Yes", "No"], exportselection=False)
+        self.search_retained_selector.current(0)
+        self.search_retained_selector.bind("<<ComboboxSelected>>",
+                                           get_clear_combobox_selection_function(self.search_retained_selector))
+        self.search_retained_selector.pack(side=tk.LEFT, padx=3, pady=3)
+        ttk.Label(self.search_bar_frame, text="From").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_start_entry = ttk.Entry(self.search_bar_frame, width=20)
+        self.search_start_entry.pack(side=tk.LEFT, padx=3, pady=3)
+        ttk.Label(self.search_bar_frame, text="To").pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_end_entry = ttk.Entry(self.search_bar_frame, width=20)
+        self.search_end_entry.pack(side=tk.LEFT, padx=3, pady=3)
+        for entry in (self.search_topic_entry, self.search_payload_entry, self.search_start_entry,
+                      self.search_end_entry):
+            entry.bind("<Return>", self.on_search)
+        self.search_button = ttk.Button(self.search_bar_frame, text="Search", command=self.on_search)
+        self.search_button.pack(side=tk.LEFT, padx=3, pady=3)
+        self.clear_search_button = ttk.Button(self.search_bar_frame, text="Clear search", command=self.clear_search)
+        self.clear_search_button.pack(side=tk.LEFT, padx=3, pady=3)
+        self.search_result_label = ttk.Label(self.search_bar_frame)
+        self.search_result_label.pack(side=tk.LEFT, padx=3, pady=3)
 
         # Subscribe bottom part frame
         self.subscribe_tab_bottom_frame = ttk.Frame(self)
@@ -207,14 +258,18 @@ class SubscribeTab(ttk.Frame):
         self.incoming_messages_frame = ttk.Frame(self.subscribe_tab_bottom_frame)
         self.incoming_messages_frame.pack(expand=1, fill='both')
 
-        self.incoming_messages_list = tk.Listbox(self.incoming_messages_frame, selectmode="browse",
-                                                 font="Courier 13", background=background_colour)  # TkFixedFont, "Courier 13"
+        self.incoming_messages_list = VirtualListbox(self.incoming_messages_frame,
+                                                     self.get_message_row,
+                                                     font="Courier 13",
+                                                     background=background_colour,
+                                                     select_background="#96bfff")
+        self.incoming_messages_list.default_foreground = foreground_colour or "black"
         self.incoming_messages_list.bind("<<ListboxSelect>>", self.on_message_select)
 
         self.incoming_messages_scrollbar = ttk.Scrollbar(self.incoming_messages_frame,
                                                          orient='vertical',
                                                          command=self.incoming_messages_list.yview)
-        self.incoming_messages_list['yscrollcommand'] = self.incoming_messages_scrollbar.set
+        self.incoming_messages_list.yscrollcommand = self.incoming_messages_scrollbar.set
         self.incoming_messages_scrollbar.pack(side=tk.RIGHT, fill='y')
 
         self.incoming_messages_scrollbar_h = ttk.Scrollbar(self.incoming_messages_frame,
@@ -269,6 +324,9 @@ class SubscribeTab(ttk.Frame):
                                                    onvalue=1,
                                                    command=self.on_message_select)
         self.decompress_checkbox.pack(side=tk.RIGHT, padx=3)
+        # Payload size, compressed and decompressed
+        self.payload_size_label = ttk.Label(self.message_date_and_qos_frame)
+        self.payload_size_label.pack(side=tk.RIGHT, padx=3, pady=3)
 
         # Decoder selector
         self.message_decoder_selector = ttk.Combobox(self.message_date_and_qos_frame,
@@ -283,13 +341,14 @@ class SubscribeTab(ttk.Frame):
         self.message_decoder_selector.bind("<<ComboboxSelected>>", self.on_decoder_select)
 
         # Message Payload
-        self.message_payload_box = CustomScrolledText(self.message_content_frame,
-                                                      exportselection=False,
-                                                      background="white",
-                                                      foreground="black", highlightthickness=0)
+        self.message_payload_box = PayloadView(self.message_content_frame,
+                                               exportselection=False,
+                                               background="white",
+                                               foreground="black", highlightthickness=0)
         self.message_payload_box.pack(fill="both", expand=True)
-        self.message_payload_box.configure(state="disabled")
-        # Message decoder
+        # Hex formatter output, shown instead of the payload box
+        self.hex_view = HexView(self.message_content_frame, background="white", foreground="black")
+        self.hex_view_shown = False
 
     def interface_toggle(self, connection_state, mqtt_manager, current_connection):
         # Subscribe tab items
@@ -308,28 +367,106 @@ class SubscribeTab(ttk.Frame):
         self.on_message_select()
         pass
 
-    def add_message(self, message_title, colour):
-        self.incoming_messages_list.insert(tk.END, message_title)
-        self.incoming_messages_list.itemconfig(tk.END, fg=colour)
+    def schedule_render(self):
+        if not self.render_scheduled:
+            self.render_scheduled = True
+            self.after(RENDER_INTERVAL, self.render_pending_messages)
+
+    def render_pending_messages(self):
+        self.render_scheduled = False
+        if self.view_ids is None:
+            evictions = self.message_store.evicted_messages - self.listed_evictions
+            row_count = len(self.message_store)
+        else:
+            # Evicted search results are dropped from the start of the view
+            evictions = bisect_left(self.view_ids, self.message_store.first_id)
+            del self.view_ids[:evictions]
+            row_count = len(self.view_ids)
+        self.listed_evictions = self.message_store.evicted_messages
+        if evictions == 0 and self.incoming_messages_list.size() == row_count:
+            return
+        selection_evicted = False
+        if evictions:
+            selection_before = self.incoming_messages_list.curselection()
+            self.incoming_messages_list.remove_first_rows(evictions)
+            selection_evicted = bool(selection_before) and not self.incoming_messages_list.curselection()
+        self.incoming_messages_list.set_row_count(row_count)
+        self.update_store_stats()
+        if self.view_ids is not None and self.search_task is None:
+            self.search_result_label["text"] = "{} matches".format(row_count)
         if bool(self.autoscroll_state.get()):
-            self.incoming_messages_list.selection_clear(0, tk.END)
-            self.incoming_messages_list.activate(tk.END)
-            self.incoming_messages_list.see("end")
-            self.incoming_messages_list.selection_set("end", "end")
+            self.incoming_messages_list.selection_set(tk.END)
+            self.incoming_messages_list.see(tk.END)
+            self.schedule_message_details()
+        elif selection_evicted:
             self.on_message_select(None)
 
-    def on_message_select(self, *args, **kwargs):
-        message_list_id = self.incoming_messages_list.curselection()
+    def schedule_message_details(self):
+        # While autoscrolling only the message selected when the interval is up is shown, the ones scrolled past
+        # in between are never decoded
+        if not self.details_scheduled:
+            self.details_scheduled = True
+            self.after(AUTOSCROLL_DETAILS_INTERVAL, self.on_scheduled_message_details)
+
+    def on_scheduled_message_details(self):
+        self.details_scheduled = False
+        self.on_message_select()
+
+    def update_store_stats(self):
+        self.store_stats_label["text"] = "{} messages, {:.1f} MB stored{}, {} evicted".format(
+            len(self.message_store),
+            self.message_store.payload_bytes / (1024 * 1024),
+            " on disk" if self.message_store.spill_to_disk else "",
+            self.message_store.evicted_messages)
+
+    def on_capture_limits(self):
+        CaptureLimitsDialog(self,
+                            self.message_store.max_messages,
+                            self.message_store.max_payload_bytes,
+                            self.message_store.spill_to_disk,
+                            self.set_capture_limits)
+
+    def set_capture_limits(self, max_messages, max_payload_bytes, spill_to_disk):
         try:
-            message_label = self.incoming_messages_list.get(message_list_id)
+            self.message_store.set_spill_to_disk(spill_to_disk)
         except Exception as e:
-            self.log.warning("Failed to get message from incoming message list (maybe empty?)", message_list_id)
-            message_label = None
-        if message_label is None:
-            message_id = 0
+            self.log.exception("Failed to change message payload storage", e, traceback.format_exc())
+            messagebox.showerror("Error", "Failed to change message payload storage: {}".format(e))
+        self.message_store.set_limits(max_messages, max_payload_bytes)
+        self.config_handler.save_message_store_limits(max_messages,
+                                                      max_payload_bytes,
+                                                      self.message_store.spill_to_disk)
+        self.render_pending_messages()
+        self.update_store_stats()
+
+    def list_message_id(self, index):
+        # Message ID shown in a row of the message list
+        if self.view_ids is None:
+            return self.message_store.first_id + index
+        if index < len(self.view_ids):
+            return self.view_ids[index]
+        return None
+
+    def get_message_row(self, index):
+        message_id = self.list_message_id(index)
+        summary = self.message_store.get_summary(message_id)
+        if summary is None:
+            return "", None
+        timestamp, qos, retained, topic, subscription_pattern = summary
+        simple_time_string = datetime.fromtimestamp(round(timestamp, 3)).strftime("%H:%M:%S.%f")[:-3]
+        message_title = "{} #{:05d} [QoS:{}] [{}] - {}".format(simple_time_string,
+                                                               message_id,
+                                                               qos,
+                                                               "R" if retained else " ",
+                                                               topic)
+        return message_title, self.pattern_colours.get(subscription_pattern)
+
+    def on_message_select(self, *args, **kwargs):
+        message_list_id = self.incoming_messages_list.curselection()
+        if len(message_list_id) == 0:
+            message_id = None
         else:
-            # message_id = int(message_label[-5:])
-            message_id = message_list_id[0]
+            message_id = self.list_message_id(message_list_id[0])
 
         message_data = self.get_message_details(message_id)
         self.message_topic_label["state"] = "normal"
@@ -340,43 +477,147 @@ class SubscribeTab(ttk.Frame):
                                            datetime.fromtimestamp(message_data.get("timestamp", 0)).strftime("%Y/%m/%d, %H:%M:%S.%f"))
         self.message_date_label["text"] = time_string
         self.message_qos_label["text"] = "QoS: {}".format(message_data.get("qos", ""))
-        self.message_id_label["text"] = "ID: {}".format(message_id)
-        self.message_payload_box.configure(state="normal")
-        self.message_payload_box.delete(1.0, tk.END)
-
-        if bool(self.attempt_to_decompress.get()) and 4 < len(message_data.get("payload", "")):
-            payload = decompress_message(message_data["payload"])
+        self.message_id_label["text"] = "ID: {}".format("" if message_id is None else message_id)
+        self.message_payload_box.clear()
+        self.payload_size_label["text"] = ""
+        # Whatever is still being decompressed for the previous selection is not shown any more
+        self.pending_payload = None
+        if message_id is not None and self.message_decoder_selector.get() == "Hex formatter":
+            self.show_hex_view(True)
+            self.show_hex_payload(message_id, message_data["topic"], message_data["payload"])
+            return
+        self.show_hex_view(False)
+        if message_id is not None:
+            self.message_payload_box.show(self.get_payload_source(message_id,
+                                                                  message_data["topic"],
+                                                                  message_data["payload"]))
+
+    def show_hex_view(self, hex_view_shown):
+        if hex_view_shown == self.hex_view_shown:
+            return
+        self.hex_view_shown = hex_view_shown
+        if hex_view_shown:
+            self.message_payload_box.pack_forget()
+            self.hex_view.pack(fill="both", expand=True)
         else:
-            payload = message_data.get("payload", "")
-
+            self.hex_view.pack_forget()
+            self.message_payload_box.pack(fill="both", expand=True)
+
+    def decompress_payload(self, topic, payload, max_size=DECOMPRESS_MAX_BYTES):
+        """
+        (payload, size text) with the payload decompressed if it is compressed. Raises DecompressionLimitExceeded if
+        it decompresses to more than max_size bytes, if that is below DECOMPRESS_MAX_BYTES. Also runs on the render
+        workers.
+        """
         try:
-            payload_decoded = str(payload.decode("utf-8"))
-        except Exception:
-            payload_decoded = payload
-        decoder = self.message_decoder_selector.get()
-        if decoder == "JSON pretty formatter":
-            try:
-                new_message_structure = json.loads(payload_decoded)
-            except Exception as e:
-                new_message = "        *** FAILED TO LOAD JSON ***{}{}{}{}".format(linesep+linesep,
-                                                                                   e,
-                                                                                   linesep+linesep,
-                                                                                   traceback.format_exc())
-            else:
-                new_message = json.dumps(new_message_structure, indent=2, ensure_ascii=False)
-            self.message_payload_box.insert(1.0, new_message)
-
-        elif decoder == "Hex formatter":
-            try:
-                data_to_decode = payload_decoded.encode("utf-8")
-            except Exception:
-                data_to_decode = payload_decoded
-            for line in hex_viewer(data_to_decode):
-                self.message_payload_box.insert(tk.END, line+linesep)
+            decompressed_payload, codec = self.codec_cache.decompress(topic, payload, max_size)
+        except DecompressionLimitExceeded as e:
+            if max_size < DECOMPRESS_MAX_BYTES:
+                raise
+            return payload, "{}, {}".format(format_size(len(payload)), e)
+        if codec is None:
+            return payload, "{}, not compressed".format(format_size(len(payload)))
+        return decompressed_payload, "{} {} \u2192 {}".format(codec,
+                                                             format_size(len(payload)),
+                                                             format_size(len(decompressed_payload)))
+
+    def get_decompressed_payload(self, topic, payload):
+        # (payload, size text), decompressed if enabled. None if it decompresses to too much for the Tk thread.
+        if not bool(self.attempt_to_decompress.get()) or len(payload) <= 4:
+            return payload, format_size(len(payload))
+        try:
+            return self.decompress_payload(topic, payload, DECODE_INLINE_BYTES)
+        except DecompressionLimitExceeded:
+            return None
 
-        else:
-            self.message_payload_box.insert(1.0, payload_decoded)
-        self.message_payload_box.configure(state="disabled")
+    def show_size_text(self, message_id, size_text):
+        # The size text is cached with the rendered payloads
+        if bool(self.attempt_to_decompress.get()):
+            self.render_cache.put((message_id, "size"), size_text)
+        self.payload_size_label["text"] = size_text
+
+    def get_payload_source(self, message_id, topic, payload):
+        # Rendered payload for the payload box, large JSON payloads are rendered in the background as they are shown.
+        # Payloads decompressing to more than DECODE_INLINE_BYTES are decompressed in the background too.
+        decoder = self.message_decoder_selector.get()
+        decompress_payload = bool(self.attempt_to_decompress.get())
+        cache_key = (message_id, decoder, decompress_payload)
+        rendered_payload = self.render_cache.get(cache_key)
+        size_text = self.render_cache.get((message_id, "size")) if decompress_payload else format_size(len(payload))
+        if rendered_payload is not None and size_text is not None:
+            self.payload_size_label["text"] = size_text
+            return TextSource(rendered_payload)
+        decompressed = self.get_decompressed_payload(topic, payload)
+        if decompressed is None:
+            self.payload_size_label["text"] = "{}, decompressing...".format(format_size(len(payload)))
+            render_task = PayloadRenderTask(self.render_executor,
+                                            payload,
+                                            decoder,
+                                            PAYLOAD_VIEW_INITIAL_CHARS,
+                                            prepare=partial(self.decompress_payload, topic),
+                                            keep_limit=self.render_cache.max_bytes // 4)
+            self.pending_payload = render_task
+            self.after(DECODE_POLL_INTERVAL, self.poll_render_task, message_id, cache_key, render_task, False)
+            return render_task
+        payload, size_text = decompressed
+        self.show_size_text(message_id, size_text)
+        if rendered_payload is not None:
+            return TextSource(rendered_payload)
+        if len(payload) < DECODE_INLINE_BYTES or decoder != "JSON pretty formatter":
+            rendered_payload = render_payload(payload, decoder)
+            self.render_cache.put(cache_key, rendered_payload)
+            return TextSource(rendered_payload)
+        render_task = PayloadRenderTask(self.render_executor,
+                                        payload,
+                                        decoder,
+                                        PAYLOAD_VIEW_INITIAL_CHARS,
+                                        keep_limit=self.render_cache.max_bytes // 4)
+        self.pending_payload = render_task
+        self.after(DECODE_POLL_INTERVAL, self.poll_render_task, message_id, cache_key, render_task, True)
+        return render_task
+
+    def poll_render_task(self, message_id, cache_key, render_task, details_shown):
+        # Shows the sizes once the render worker has decompressed the payload, caches the rendered payload once the
+        # worker got to the end of it. Renderings longer than the cache would take are not kept by the task.
+        if render_task is not self.pending_payload or render_task.error is not None:
+            return
+        if not details_shown and render_task.details is not None:
+            self.show_size_text(message_id, render_task.details)
+            details_shown = True
+        rendered_payload = render_task.rendered_text()
+        if rendered_payload is not None:
+            self.pending_payload = None
+            self.render_cache.put(cache_key, rendered_payload)
+        elif not render_task.finished:
+            self.after(DECODE_POLL_INTERVAL, self.poll_render_task, message_id, cache_key, render_task, details_shown)
+
+    def show_hex_payload(self, message_id, topic, payload):
+        decompressed = self.get_decompressed_payload(topic, payload)
+        if decompressed is not None:
+            payload, size_text = decompressed
+            self.show_size_text(message_id, size_text)
+            self.hex_view.set_data(payload)
+            return
+        self.payload_size_label["text"] = "{}, decompressing...".format(format_size(len(payload)))
+        self.hex_view.set_data(b"")
+        future = self.render_executor.submit(self.decompress_payload, topic, payload)
+        self.pending_payload = future
+        self.after(DECODE_POLL_INTERVAL, self.poll_hex_payload, message_id, future)
+
+    def poll_hex_payload(self, message_id, future):
+        if future is not self.pending_payload:
+            return
+        if not future.done():
+            self.after(DECODE_POLL_INTERVAL, self.poll_hex_payload, message_id, future)
+            return
+        self.pending_payload = None
+        try:
+            payload, size_text = future.result()
+        except Exception as e:
+            self.log.exception("Failed to decompress payload", e, traceback.format_exc())
+            return
+        self.show_size_text(message_id, size_text)
+        self.hex_view.set_data(payload)
 
     def get_color(self, topic):
         colour = self.config_handler.get_subscription_colour(self.current_connection, topic)
@@ -397,17 +638,23 @@ class SubscribeTab(ttk.Frame):
                                                                 self.topic_mute_callback,
                                                                 height=60)
             self.subscription_frames[topic].pack(fill=tk.X, expand=1, padx=2, pady=1)
+            self.pattern_colours[topic] = self.subscription_frames[topic].colour
+
+    def remove_subscription_frame(self, topic):
+        # Unsubscribe callback of subscription frames without a broker subscription (offline captures)
+        self.subscription_frames.pop(topic, None)
 
     def topic_mute_callback(self, topic, mute_state):
-        if mute_state and topic not in self.mute_patterns:
-            self.mute_patterns.append(topic)
-        if not mute_state and topic in self.mute_patterns:
-            self.mute_patterns.remove(topic)
+        # Live messages of muted subscriptions are dropped by the MQTT manager, the frame state covers the messages
+        # already queued and offline captures
+        if topic in self.subscription_frames:
+            self.subscription_frames[topic].mute_state = bool(mute_state)
+        if self.mqtt_manager is not None:
+            self.mqtt_manager.set_subscription_muted(topic, mute_state)
 
     def on_colour_change(self, topic, colour):
-        for message_id in list(self.messages.keys()):
-            if self.messages[message_id]["subscription_pattern"] == topic:
-                self.incoming_messages_list.itemconfig(message_id, fg=colour)
+        self.pattern_colours[topic] = colour
+        self.incoming_messages_list.redraw()
         self.config_handler.add_subscription_history(self.current_connection, topic, colour)
 
     def add_subscription(self, topic=None):
@@ -434,30 +681,88 @@ class SubscribeTab(ttk.Frame):
                                                          self.subscription_frames[topic].colour)
 
     def add_new_message(self, mqtt_message_object, subscription_pattern):
-        timestamp = time.time()
-        # Theoretically there will be no race condition here?
-        new_message_id = self.message_id_counter
-        self.message_id_counter += 1
-        simple_time_string = datetime.fromtimestamp(round(timestamp, 3)).strftime("%H:%M:%S.%f")[:-3]
-        self.messages[new_message_id] = {
-            "topic": mqtt_message_object.topic,
-            "payload": mqtt_message_object.payload,
-            "qos": mqtt_message_object.qos,
-            "subscription_pattern": subscription_pattern,
-            "retained": mqtt_message_object.retain,
-            "timestamp": timestamp
-        }
-        message_title = "{} #{:05d} [QoS:{}] [{}] - {}".format(simple_time_string,
-                                                               new_message_id,
-                                                               mqtt_message_object.qos,
-                                                               "R" if mqtt_message_object.retain else " ",
-                                                               mqtt_message_object.topic)
+        message_id = self.message_store.add(mqtt_message_object.topic,
+                                            mqtt_message_object.payload,
+                                            mqtt_message_object.qos,
+                                            mqtt_message_object.retain,
+                                            subscription_pattern,
+                                            mqtt_message_object.timestamp)
+        for recorder in self.recorders:
+            recorder.add(mqtt_message_object.topic,
+                         mqtt_message_object.payload,
+                         mqtt_message_object.qos,
+                         mqtt_message_object.retain,
+                         subscription_pattern,
+                         mqtt_message_object.timestamp)
+        # A running search picks up the messages added since it started once it is finished
+        if self.view_ids is not None and self.search_task is None and \
+                self.search_query.matches(self.message_store, message_id):
+            self.view_ids.append(message_id)
+        self.schedule_render()
+
+    def on_search(self, *args, **kwargs):
         try:
-            colour = self.subscription_frames[subscription_pattern].colour
-        except Exception as e:
-            self.log.warning("Failed to add new message:", e, mqtt_message_object.topic)
-        else:
-            self.add_message(message_title, colour)
+            qos = self.search_qos_selector.get()
+            retained = self.search_retained_selector.get()
+            query = SearchQuery(topic_filter=self.search_topic_entry.get().strip(),
+                                payload=self.search_payload_entry.get(),
+                                regex=bool(self.search_regex_state.get()),
+                                qos=None if qos == "Any" else int(qos),
+                                retained=None if retained == "Any" else retained == "Yes",
+                                start=parse_time_string(self.search_start_entry.get()),
+                                end=parse_time_string(self.search_end_entry.get()))
+        except (ValueError, re.error) as e:
+            self.log.warning("Invalid message search", e)
+            self.search_result_label["text"] = "Invalid search: {}".format(e)
+            return
+        self.cancel_search()
+        self.search_query = query
+        self.search_task = SearchTask(self.message_store, query, self.search_workers)
+        self.search_result_label["text"] = "Searching..."
+        self.poll_search()
+
+    def poll_search(self):
+        if self.search_task is None:
+            return
+        if not self.search_task.poll():
+            self.search_result_label["text"] = "Searching... {:.0f}%".format(100 * self.search_task.fraction())
+            self.after(SEARCH_POLL_INTERVAL, self.poll_search)
+            return
+        search_task = self.search_task
+        self.search_task = None
+        if search_task.error is not None:
+            self.log.error("Message search failed", search_task.error)
+            self.search_result_label["text"] = "Search failed: {}".format(search_task.error)
+            self.search_query = None
+            return
+        view_ids = search_task.results()
+        for message_id in range(max(search_task.snapshot_id, self.message_store.first_id), self.message_store.next_id):
+            if self.search_query.matches(self.message_store, message_id):
+                view_ids.append(message_id)
+        self.set_view(view_ids)
+
+    def cancel_search(self):
+        if self.search_task is not None:
+            self.search_task.cancel()
+            self.search_task = None
+
+    def clear_search(self):
+        self.cancel_search()
+        self.search_query = None
+        self.search_result_label["text"] = ""
+        self.set_view(None)
+
+    def set_view(self, view_ids):
+        self.view_ids = view_ids
+        self.listed_evictions = self.message_store.evicted_messages
+        self.incoming_messages_list.clear()
+        self.render_pending_messages()
+        self.on_message_select()
+
+    def search_result_count(self):
+        if self.view_ids is None:
+            return 0
+        return len(self.view_ids)
 
     def load_subscription_history(self):
         self.subscribe_selector.configure(
@@ -479,15 +784,16 @@ class SubscribeTab(ttk.Frame):
         self.subscription_frames = {}
 
     def on_mqtt_message(self, _, __, msg, subscription_pattern):
-        if self.exporting:
-            return
-        if subscription_pattern in self.mute_patterns:
+        subscription_frame = self.subscription_frames.get(subscription_pattern)
+        if subscription_frame is not None and subscription_frame.mute_state:
             return
         self.add_new_message(mqtt_message_object=msg,
                              subscription_pattern=subscription_pattern)
 
     def get_message_details(self, message_id):
-        return self.messages.get(message_id, {})
+        if message_id is None:
+            return {}
+        return self.message_store.get(message_id)
 
     def on_unsubscribe(self, topic):
         self.subscription_frames.pop(topic, None)
@@ -497,34 +803,39 @@ class SubscribeTab(ttk.Frame):
             self.log.warning("Failed to unsubscribe", topic, "maybe a failed subscription?")
 
     def flush_messages(self):
-        self.message_id_counter = 0
-        self.incoming_messages_list.delete(0, "end")
-        self.messages = {}
+        self.message_store.clear()
+        self.render_cache.clear()
+        self.codec_cache.clear()
+        self.listed_evictions = 0
+        if self.search_query is not None:
+            self.cancel_search()
+            self.view_ids = array("Q")
+            self.search_result_label["text"] = "0 matches"
+        self.incoming_messages_list.clear()
+        self.update_store_stats()
         self.on_message_select()
 
+    def close(self):
+        self.cancel_search()
+        self.message_payload_box.clear()
+        self.render_executor.shutdown(wait=False)
+        self.search_workers.close()
+        self.message_store.close()
+
     def message_list_length(self):
-        return len(self.messages)
+        return len(self.message_store)
 
     def get_selected_message_payload(self):
         try:
             message_list_id = self.incoming_messages_list.curselection()
-            message_id = message_list_id[0]
-            message_data = self.get_message_details(message_id)["payload"]
+            message_id = self.list_message_id(message_list_id[0])
+            message_data = self.message_store.get_payload(message_id)
         except Exception as e:
             return None
         return message_data
 
-    def get_messages(self, base64_only):
-        self.exporting = True
-        for message in self.messages.values():
-            message_to_export = deepcopy(message)
-            if base64_only:
-                message_to_export["payload"] = base64.b64encode(message_to_export["payload"]).decode("utf-8")
-                yield message_to_export
-                continue
-            try:
-                message_to_export["payload"] = message_to_export["payload"].decode("utf-8")
-            except Exception:
-                message_to_export["payload"] = base64.b64encode(message_to_export["payload"]).decode("utf-8")
-            yield message_to_export
-        self.exporting = False
+    def get_export_message_ids(self, search_results=False):
+        # Snapshot of the message IDs to export, messages received during the export are left out
+        if search_results:
+            return array("Q", self.view_ids or ())
+        return self.message_store.message_ids()
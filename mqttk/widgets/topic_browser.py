@@ -25,7 +25,28 @@ import traceback
 from functools import partial
 from datetime import datetime
 
-from mqttk.constants import CONNECT, COLOURS
+from mqttk.constants import CONNECT, COLOURS, TOPIC_BROWSER_REFRESH_INTERVAL, TOPIC_STATS_REFRESH_INTERVAL
+from mqttk.topic_tree import TopicTree
+from mqttk.topic_history import TopicHistory
+from mqttk.widgets.dialogs import TopicHistoryLimitsDialog
+from mqttk.helpers import format_size, format_age
+
+# Item ID prefix of the placeholder children of collapsed nodes. # is a wildcard, it can't appear in a topic name,
+# so no topic item ID starts with it.
+PLACEHOLDER_PREFIX = "#"
+
+COLUMN_HEADINGS = {
+    "#0": "Topic",
+    "qos": "QoS",
+    "retained": "Retained",
+    "last_message": "Last message",
+    "messages": "Messages",
+    "message_rate": "msg/s",
+    "byte_rate": "Bytes/s",
+    "average_size": "Avg size",
+    "age": "Age",
+    "payload": "Payload"
+}
 
 
 class TopicBrowser(ttk.Frame):
@@ -43,6 +64,16 @@ class TopicBrowser(ttk.Frame):
         self.mqtt_manager = None
         self.message_id_counter = 0
         self.individual_topics = 0
+        # Source of truth for the topics in the Treeview, Tk is only asked to insert the nodes that are new
+        self.topic_tree = TopicTree()
+        self.refresh_scheduled = False
+        # Item IDs of the placeholder children in the Treeview
+        self.placeholders = set()
+        self.placeholder_counter = 0
+        self.topic_history = TopicHistory(*self.config_handler.get_topic_history_limits())
+        # Column the expanded branches are sorted by, None for the order of arrival
+        self.sort_column = None
+        self.sort_descending = False
 
         # Subscribe frame
         self.topic_browser_bar_frame = ttk.Frame(self, height=1)
@@ -67,6 +98,10 @@ class TopicBrowser(ttk.Frame):
         self.flush_messages_button = ttk.Button(self.topic_browser_bar_frame, text="Clear topics")
         self.flush_messages_button.pack(side=tk.RIGHT, padx=3)
         self.flush_messages_button["command"] = self.flush_messages
+        # History limits button
+        self.history_limits_button = ttk.Button(self.topic_browser_bar_frame, text="History limits")
+        self.history_limits_button.pack(side=tk.RIGHT, padx=3)
+        self.history_limits_button["command"] = self.on_history_limits
         # Filter retained checkbox
         self.filter_retained = tk.IntVar()
         self.filter_retained_checkbox = ttk.Checkbutton(self.topic_browser_bar_frame,
@@ -78,17 +113,25 @@ class TopicBrowser(ttk.Frame):
 
         self.treeview_frame = ttk.Frame(self)
         self.treeview_frame.pack(expand=1, fill="both", pady=2, padx=2)
-        self.topic_treeview = ttk.Treeview(self.treeview_frame, columns=("qos", "retained", "last_message", "payload"), show="tree headings")
-        self.topic_treeview.heading('#0', text='Topic')
+        self.topic_treeview = ttk.Treeview(self.treeview_frame,
+                                           columns=("qos", "retained", "last_message", "messages", "message_rate",
+                                                    "byte_rate", "average_size", "age", "payload"),
+                                           show="tree headings")
         self.topic_treeview.column('#0', minwidth=300, width=300, stretch=tk.NO)
-        self.topic_treeview.heading('qos', text='QoS')
         self.topic_treeview.column('qos', minwidth=50, width=50, stretch=tk.NO)
-        self.topic_treeview.heading('retained', text='Retained')
         self.topic_treeview.column('retained', minwidth=70, width=80, stretch=tk.NO)
-        self.topic_treeview.heading('last_message', text='Last message')
         self.topic_treeview.column('last_message', minwidth=70, width=90, stretch=tk.NO)
-        self.topic_treeview.heading('payload', text='Payload')
+        self.topic_treeview.column('messages', minwidth=70, width=80, stretch=tk.NO)
+        self.topic_treeview.column('message_rate', minwidth=60, width=70, stretch=tk.NO)
+        self.topic_treeview.column('byte_rate', minwidth=70, width=90, stretch=tk.NO)
+        self.topic_treeview.column('average_size', minwidth=70, width=80, stretch=tk.NO)
+        self.topic_treeview.column('age', minwidth=60, width=70, stretch=tk.NO)
         self.topic_treeview.column('payload', minwidth=300, width=900, stretch=tk.NO)
+        for column, heading in COLUMN_HEADINGS.items():
+            self.topic_treeview.heading(column, text=heading, command=partial(self.on_heading_click, column))
+        self.topic_treeview.bind("<<TreeviewOpen>>", self.on_treeview_open)
+        self.topic_treeview.bind("<<TreeviewSelect>>", self.show_history)
+        self.topic_treeview.bind("<<TreeviewClose>>", self.on_treeview_close)
         if sys.platform == "darwin":
             self.topic_treeview.bind("<Button-2>", self.popup)
         if sys.platform == "linux":
@@ -101,6 +144,26 @@ class TopicBrowser(ttk.Frame):
         self.topic_treeview.configure(yscrollcommand=self.vertical_scrollbar.set)
         self.topic_treeview.pack(fill="both", side=tk.LEFT, expand=1)
 
+        # Value history of the selected topic
+        self.history_frame = ttk.Frame(self)
+        self.history_frame.pack(side=tk.BOTTOM, fill="x", pady=2, padx=2)
+        self.history_label = ttk.Label(self.history_frame, text="Select a topic to see its recent values")
+        self.history_label.pack(anchor="w", padx=3, pady=3)
+        self.history_treeview = ttk.Treeview(self.history_frame, columns=("time", "size", "payload"), show="headings",
+                                             height=8)
+        self.history_treeview.heading("time", text="Time")
+        self.history_treeview.column("time", minwidth=150, width=170, stretch=tk.NO)
+        self.history_treeview.heading("size", text="Size")
+        self.history_treeview.column("size", minwidth=70, width=80, stretch=tk.NO)
+        self.history_treeview.heading("payload", text="Payload")
+        self.history_treeview.column("payload", minwidth=300, width=900)
+        self.history_scrollbar = ttk.Scrollbar(self.history_frame, orient="vertical",
+                                               command=self.history_treeview.yview)
+        self.history_scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.history_treeview.configure(yscrollcommand=self.history_scrollbar.set)
+        self.history_treeview.pack(fill="x", side=tk.LEFT, expand=1)
+        self.history_node = None
+
         self.horizontal_scrollbar = ttk.Scrollbar(self, orient="horizontal", command=self.topic_treeview.xview)
         self.horizontal_scrollbar.pack(side=tk.BOTTOM, fill="x")
         self.topic_treeview.configure(xscrollcommand=self.horizontal_scrollbar.set)
@@ -109,6 +172,8 @@ class TopicBrowser(ttk.Frame):
         self.popup_menu.add_command(label="Copy topic", command=self.copy_topic)
         self.popup_menu.add_command(label="Copy payload", command=self.copy_payload)
 
+        self.after(TOPIC_STATS_REFRESH_INTERVAL, self.refresh_stats)
+
     def interface_toggle(self, connection_state, mqtt_manager, current_connection):
         # Subscribe tab items
         self.mqtt_manager = mqtt_manager
@@ -164,53 +229,231 @@ class TopicBrowser(ttk.Frame):
             if bool(self.filter_retained.get()) and msg.retain == 1:
                 return
 
-            try:
-                payload_decoded = str(msg.payload.decode("utf-8"))
-            except Exception:
-                payload_decoded = msg.payload
-
-            time_string = datetime.fromtimestamp(time.time()).strftime("%H:%M:%S")
-            topic_split = msg.topic.split("/")
-
-            # Fix anomaly when someone thinks MQTT is linux and starts the topic with /...
-            if msg.topic.startswith("/"):
-                topic_split[0] = "/"
-
-            if 1 < len(topic_split):
-                if topic_split[0] not in self.topic_treeview.get_children(""):
-                    try:
-                        self.topic_treeview.insert("", "end", topic_split[0], text=topic_split[0])
-                    except Exception:
-                        # print(msg.topic, topic_split[0], self.topic_treeview.get_children(""))
-                        raise
-                for i in range(1, len(topic_split)-1):
-                    parent_topic = "/".join(topic_split[0:i])
-                    topic = "/".join(topic_split[0:i+1])
-                    if topic not in self.topic_treeview.get_children(parent_topic):
-                        self.topic_treeview.insert(parent_topic, "end", topic, text=topic_split[i])
-
-            parent_topic = "/".join(topic_split[0:-1])
-            topic = "/".join(topic_split)
-            if topic not in self.topic_treeview.get_children(parent_topic):
-                self.update_individual_topics()
-                self.topic_treeview.insert(parent_topic,
-                                           "end",
-                                           "/".join(topic_split),
-                                           text=topic_split[-1],
-                                           values=(msg.qos,
-                                                   "RETAINED" if msg.retain == 1 else "",
-                                                   time_string,
-                                                   payload_decoded))
-            else:
-                self.topic_treeview.set(topic, "qos", msg.qos)
-                self.topic_treeview.set(topic, "retained", "RETAINED" if msg.retain == 1 else "")
-                self.topic_treeview.set(topic, "last_message", time_string)
-                self.topic_treeview.set(topic, "payload", payload_decoded)
+            node = self.topic_tree.update(msg.topic, msg.qos, msg.retain, msg.timestamp, msg.payload)
+            self.topic_history.add(node.item_id, msg.timestamp, msg.payload)
+            if not self.refresh_scheduled:
+                self.refresh_scheduled = True
+                self.after(TOPIC_BROWSER_REFRESH_INTERVAL, self.refresh_treeview)
 
         except Exception as e:
             self.log.exception("Exception inserting new message to treeview",
                                os.linesep, msg.topic, msg.payload, os.linesep, e, traceback.format_exc())
 
+    @staticmethod
+    def decode_payload(payload):
+        try:
+            return str(payload.decode("utf-8"))
+        except Exception:
+            return payload
+
+    def node_values(self, node, now=None):
+        # The statistics of a node with children are those of its whole subtree
+        if now is None:
+            now = time.time()
+        stats = (node.message_count,
+                 "{:.1f}".format(node.current_message_rate(now)),
+                 format_size(int(node.current_byte_rate(now))) + "/s",
+                 format_size(int(node.average_size())),
+                 format_age(now - node.last_seen))
+        if node.values is None:
+            return ("", "", "") + stats + ("",)
+        qos, retained, timestamp, payload = node.values
+        return (qos,
+                "RETAINED" if retained == 1 else "",
+                datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")) + stats + (self.decode_payload(payload),)
+
+    def sort_key(self, node, now):
+        column = self.sort_column
+        if column == "#0":
+            return node.name
+        if column == "messages":
+            return node.message_count
+        if column == "message_rate":
+            return node.current_message_rate(now)
+        if column == "byte_rate":
+            return node.current_byte_rate(now)
+        if column == "average_size":
+            return node.average_size()
+        if column == "age":
+            return now - node.last_seen
+        if node.values is None:
+            return (0, b"")
+        qos, retained, timestamp, payload = node.values
+        if column == "qos":
+            return (1, qos)
+        if column == "retained":
+            return (1, retained)
+        if column == "last_message":
+            return (1, timestamp)
+        return (1, payload)
+
+    def sorted_children(self, node, now=None):
+        children = list(node.children.values())
+        if self.sort_column is not None:
+            if now is None:
+                now = time.time()
+            children.sort(key=lambda child: self.sort_key(child, now), reverse=self.sort_descending)
+        return children
+
+    def sort_branch(self, node, now):
+        # Moves the items of the children of an expanded node into the sort order, if they aren't in it already
+        children = [child for child in self.sorted_children(node, now) if child.shown]
+        item_ids = tuple(child.item_id for child in children)
+        if item_ids == self.topic_treeview.get_children(node.item_id):
+            return
+        for index, item_id in enumerate(item_ids):
+            self.topic_treeview.move(item_id, node.item_id, index)
+
+    def on_heading_click(self, column):
+        if self.sort_column == column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column = column
+            # Busiest and largest first, names and times in ascending order
+            self.sort_descending = column in ("messages", "message_rate", "byte_rate", "average_size")
+        for heading_column, heading in COLUMN_HEADINGS.items():
+            if heading_column == column:
+                heading += " \u25bc" if self.sort_descending else " \u25b2"
+            self.topic_treeview.heading(heading_column, text=heading)
+        now = time.time()
+        for branch in self.topic_tree.shown_branches():
+            self.sort_branch(branch, now)
+
+    def visible_nodes(self):
+        # Nodes of the rows on screen, found by walking down the Treeview one row at a time
+        nodes = []
+        height = self.topic_treeview.winfo_height()
+        y = 0
+        while y < height:
+            item_id = self.topic_treeview.identify_row(y)
+            bbox = self.topic_treeview.bbox(item_id) if item_id != "" else ""
+            if not bbox:
+                # Heading or empty space
+                y += 2
+                continue
+            node = self.topic_tree.get(item_id)
+            if node is not None:
+                nodes.append(node)
+            y = max(y + 1, bbox[1] + bbox[3])
+        return nodes
+
+    def refresh_stats(self):
+        # Rates and ages change without messages too, the rows on screen are updated and the expanded branches are
+        # sorted periodically
+        try:
+            now = time.time()
+            for node in self.visible_nodes():
+                self.topic_treeview.item(node.item_id, values=self.node_values(node, now))
+            if self.sort_column is not None:
+                for branch in self.topic_tree.shown_branches():
+                    self.sort_branch(branch, now)
+            self.update_individual_topics(self.topic_tree.topic_count)
+        except Exception as e:
+            self.log.exception("Exception updating topic statistics", e, traceback.format_exc())
+        self.after(TOPIC_STATS_REFRESH_INTERVAL, self.refresh_stats)
+
+    def show_node(self, node):
+        # Creates the collapsed Treeview item of node
+        self.topic_treeview.insert(node.parent.item_id,
+                                   "end",
+                                   node.item_id,
+                                   text=node.name,
+                                   values=self.node_values(node))
+        node.shown = True
+        if len(node.children) != 0:
+            self.add_placeholder(node)
+
+    def add_placeholder(self, node):
+        # Makes a collapsed node expandable without creating the items of its children
+        self.placeholder_counter += 1
+        placeholder = PLACEHOLDER_PREFIX + str(self.placeholder_counter)
+        self.topic_treeview.insert(node.item_id, "end", placeholder, text="...")
+        self.placeholders.add(placeholder)
+        node.placeholder = placeholder
+
+    def on_treeview_open(self, *args, **kwargs):
+        node = self.topic_tree.get(self.topic_treeview.focus())
+        if node is None or node.expanded:
+            return
+        if node.placeholder is not None:
+            self.topic_treeview.delete(node.placeholder)
+            self.placeholders.discard(node.placeholder)
+            node.placeholder = None
+        node.expanded = True
+        for child in self.sorted_children(node):
+            self.show_node(child)
+
+    def on_treeview_close(self, *args, **kwargs):
+        # The items of a collapsed branch are discarded, the tree keeps the data
+        node = self.topic_tree.get(self.topic_treeview.focus())
+        if node is None or not node.expanded:
+            return
+        children = self.topic_treeview.get_children(node.item_id)
+        if len(children) != 0:
+            self.topic_treeview.delete(*children)
+        self.placeholders.difference_update(self.topic_tree.hide_children(node))
+        node.expanded = False
+        if len(node.children) != 0:
+            self.add_placeholder(node)
+
+    def refresh_treeview(self):
+        # Pushes the rows changed since the last refresh to the Treeview, one call per row. Only the nodes whose
+        # parent is expanded have items.
+        self.refresh_scheduled = False
+        new_nodes, dirty_nodes = self.topic_tree.take_changes()
+        for node in new_nodes:
+            dirty_nodes.discard(node)
+            parent = node.parent
+            try:
+                if parent.expanded and not node.shown:
+                    self.show_node(node)
+                elif parent.shown and not parent.expanded and parent.placeholder is None:
+                    self.add_placeholder(parent)
+            except Exception as e:
+                self.log.exception("Exception inserting new topic to treeview", node.item_id, e,
+                                   traceback.format_exc())
+        for node in dirty_nodes:
+            if not node.shown:
+                continue
+            try:
+                self.topic_treeview.item(node.item_id, values=self.node_values(node))
+            except Exception as e:
+                self.log.exception("Exception updating topic in treeview", node.item_id, e, traceback.format_exc())
+        if len(new_nodes) != 0:
+            self.update_individual_topics(self.topic_tree.topic_count)
+        if self.history_node is not None and self.history_node in dirty_nodes:
+            self.show_history()
+
+    def show_history(self, *args, **kwargs):
+        selection = self.topic_treeview.selection()
+        node = self.topic_tree.get(selection[0]) if len(selection) != 0 else None
+        self.history_node = node
+        rows = self.history_treeview.get_children()
+        if len(rows) != 0:
+            self.history_treeview.delete(*rows)
+        if node is None:
+            self.history_label["text"] = "Select a topic to see its recent values"
+            return
+        history = self.topic_history.get(node.item_id)
+        self.history_label["text"] = "Last {} values of {}".format(len(history), node.item_id)
+        for timestamp, payload in history:
+            self.history_treeview.insert("",
+                                         "end",
+                                         values=(datetime.fromtimestamp(timestamp).strftime("%Y/%m/%d %H:%M:%S.%f"),
+                                                 format_size(len(payload)),
+                                                 self.decode_payload(payload)))
+
+    def on_history_limits(self):
+        TopicHistoryLimitsDialog(self,
+                                 self.topic_history.length,
+                                 self.topic_history.max_bytes,
+                                 self.set_history_limits)
+
+    def set_history_limits(self, length, max_bytes):
+        self.config_handler.save_topic_history_limits(length, max_bytes)
+        self.topic_history.set_limits(length, max_bytes)
+        self.show_history()
+
     def on_unsubscribe(self):
         try:
             self.mqtt_manager.unsubscribe(self.current_subscription)
@@ -222,15 +465,21 @@ class TopicBrowser(ttk.Frame):
 
     def flush_messages(self):
         self.update_individual_topics(0)
-        for child in self.topic_treeview.get_children():
-            self.topic_treeview.delete(child)
+        self.topic_tree.clear()
+        self.topic_history.clear()
+        self.placeholders.clear()
+        children = self.topic_treeview.get_children()
+        if len(children) != 0:
+            self.topic_treeview.delete(*children)
+        self.show_history()
 
     def update_individual_topics(self, value=None):
         if value is not None:
             self.individual_topics = value
         else:
             self.individual_topics += 1
-        self.stat_label["text"] = "{} individual topics mapped".format(self.individual_topics)
+        self.stat_label["text"] = "{} individual topics mapped, {:.1f} msg/s".format(
+            self.individual_topics, self.topic_tree.root.current_message_rate(time.time()))
 
     def copy_topic(self, *args, **kwargs):
         try:
@@ -238,14 +487,15 @@ class TopicBrowser(ttk.Frame):
         except Exception:
             pass
         else:
+            if topic in self.placeholders:
+                return
             self.root.clipboard_clear()
             self.root.clipboard_append(topic)
 
     def copy_payload(self, *args, **kwargs):
         try:
             selection = self.topic_treeview.selection()[0]
-            values = self.topic_treeview.item(selection).get("values", [])
-            payload = values[3]
+            payload = self.topic_treeview.set(selection, "payload")
         except Exception:
             pass
         else:
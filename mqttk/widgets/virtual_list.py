@@ -0,0 +1,197 @@
+"""
+MQTTk - Lightweight graphical MQTT client and message analyser
+
+Copyright (C) 2022  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import tkinter as tk
+import tkinter.font as tkfont
+import platform
+
+
+class VirtualListbox(tk.Canvas):
+    def __init__(self, master, row_provider, font="TkFixedFont", background="white",
+                 select_background="#96bfff", **kwargs):
+        """
+        Listbox look-alike that only draws the rows that are visible.
+
+        The rows are not stored in the widget, they are fetched on demand through row_provider(index), which must
+        return a (text, colour) tuple. Only the row count is tracked here, so memory and redraw cost don't depend on
+        the number of rows. Selection changes generate a <<ListboxSelect>> event just like tk.Listbox.
+        """
+        super().__init__(master, background=background, highlightthickness=0, takefocus=1, **kwargs)
+        self.row_provider = row_provider
+        self.font = tkfont.Font(font=font)
+        self.row_height = self.font.metrics("linespace") + 1
+        self.select_background = select_background
+        self.default_foreground = "black"
+        self.yscrollcommand = None
+
+        self.row_count = 0
+        self.first_visible = 0
+        self.selected = None
+        self.max_width = 0
+        # Canvas items are recycled between redraws, one text item for each visible row
+        self.text_items = []
+        self.selection_item = self.create_rectangle(0, 0, 0, 0, fill=select_background, width=0, state="hidden")
+
+        self.bind("<Configure>", self.on_configure)
+        self.bind("<Button-1>", self.on_click)
+        self.bind("<Up>", lambda event: self.move_selection(-1))
+        self.bind("<Down>", lambda event: self.move_selection(1))
+        self.bind("<Prior>", lambda event: self.move_selection(-self.visible_rows()))
+        self.bind("<Next>", lambda event: self.move_selection(self.visible_rows()))
+        self.bind("<Home>", lambda event: self.select_row(0))
+        self.bind("<End>", lambda event: self.select_row(self.row_count - 1))
+        if platform.system() == "Linux":
+            self.bind("<Button-4>", self.on_mouse_wheel)
+            self.bind("<Button-5>", self.on_mouse_wheel)
+        else:
+            self.bind("<MouseWheel>", self.on_mouse_wheel)
+
+    def visible_rows(self):
+        return max(1, self.winfo_height() // self.row_height)
+
+    def size(self):
+        return self.row_count
+
+    def set_row_count(self, row_count):
+        self.row_count = row_count
+        if self.selected is not None and row_count <= self.selected:
+            self.selected = None
+        self.first_visible = max(0, min(self.first_visible, row_count - self.visible_rows()))
+        self.redraw()
+
+    def remove_first_rows(self, count):
+        # Rows dropped from the top of the list, the view and the selection stay on the same rows
+        self.row_count = max(0, self.row_count - count)
+        self.first_visible = max(0, self.first_visible - count)
+        if self.selected is not None:
+            self.selected = self.selected - count if count <= self.selected else None
+
+    def curselection(self):
+        if self.selected is None:
+            return ()
+        return (self.selected,)
+
+    def selection_clear(self, *args):
+        self.selected = None
+        self.redraw()
+
+    def selection_set(self, index, *args):
+        if index == tk.END or index == "end":
+            index = self.row_count - 1
+        self.selected = index if 0 <= index < self.row_count else None
+        self.redraw()
+
+    def select_row(self, index):
+        if self.row_count == 0:
+            return
+        index = max(0, min(index, self.row_count - 1))
+        self.focus_set()
+        self.selection_set(index)
+        self.see(index)
+        self.event_generate("<<ListboxSelect>>")
+
+    def move_selection(self, step):
+        if self.selected is None:
+            self.select_row(self.first_visible)
+        else:
+            self.select_row(self.selected + step)
+
+    def see(self, index):
+        if index == tk.END or index == "end":
+            index = self.row_count - 1
+        visible_rows = self.visible_rows()
+        if index < self.first_visible:
+            self.first_visible = index
+        elif self.first_visible + visible_rows <= index:
+            self.first_visible = index - visible_rows + 1
+        self.first_visible = max(0, self.first_visible)
+        self.redraw()
+
+    def yview(self, *args):
+        visible_rows = self.visible_rows()
+        if not args:
+            return self.scroll_fractions()
+        if args[0] == "moveto":
+            self.first_visible = int(float(args[1]) * self.row_count)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= visible_rows
+            self.first_visible += step
+        self.first_visible = max(0, min(self.first_visible, self.row_count - visible_rows))
+        self.redraw()
+
+    def scroll_fractions(self):
+        if self.row_count == 0:
+            return 0.0, 1.0
+        last_visible = min(self.row_count, self.first_visible + self.visible_rows())
+        return self.first_visible / self.row_count, last_visible / self.row_count
+
+    def on_mouse_wheel(self, event):
+        if platform.system() == 'Windows':
+            self.yview("scroll", int(-1 * (event.delta / 120)) * 3, "units")
+        elif platform.system() == 'Darwin':
+            self.yview("scroll", int(-1 * event.delta), "units")
+        else:
+            if event.num == 4:
+                self.yview("scroll", -3, "units")
+            elif event.num == 5:
+                self.yview("scroll", 3, "units")
+
+    def on_click(self, event):
+        index = self.first_visible + int(self.canvasy(event.y) // self.row_height)
+        if index < self.row_count:
+            self.select_row(index)
+
+    def on_configure(self, *args):
+        self.redraw()
+
+    def redraw(self):
+        visible_rows = self.visible_rows()
+        while len(self.text_items) < visible_rows:
+            self.text_items.append(self.create_text(2, len(self.text_items) * self.row_height,
+                                                    anchor="nw", font=self.font))
+
+        for slot, item in enumerate(self.text_items):
+            index = self.first_visible + slot
+            if slot < visible_rows and index < self.row_count:
+                text, colour = self.row_provider(index)
+                self.itemconfigure(item, text=text, fill=colour or self.default_foreground, state="normal")
+                text_width = self.font.measure(text)
+                if self.max_width < text_width:
+                    self.max_width = text_width
+            else:
+                self.itemconfigure(item, text="", state="hidden")
+
+        if self.selected is not None and 0 <= self.selected - self.first_visible < visible_rows:
+            top = (self.selected - self.first_visible) * self.row_height
+            self.coords(self.selection_item, 0, top, max(self.max_width + 4, self.winfo_width()), top + self.row_height)
+            self.itemconfigure(self.selection_item, state="normal")
+        else:
+            self.itemconfigure(self.selection_item, state="hidden")
+
+        self.configure(scrollregion=(0, 0, self.max_width + 4, self.winfo_height()))
+        if self.yscrollcommand is not None:
+            self.yscrollcommand(*self.scroll_fractions())
+
+    def clear(self):
+        self.max_width = 0
+        self.selected = None
+        self.first_visible = 0
+        self.set_row_count(0)
@@ -1,3 +1,8 @@
-from mqttk.__main__ import main
+from multiprocessing import freeze_support
 
-main()
+if __name__ == "__main__":
+    # Message search worker processes start through this script in frozen builds, they must return here before
+    # the application is started
+    freeze_support()
+    from mqttk.__main__ import main
+    main()